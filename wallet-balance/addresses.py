@@ -0,0 +1,97 @@
+import re
+from typing import Iterable, Optional
+
+from cache_manager import CACHES
+from settings import CHAIN_CONFIG, get_chain_wallets
+
+# ============================================================
+# ADDRESS NORMALIZATION
+# ============================================================
+#
+# EIP-55 checksumming is a keccak hash per call; the same wallets and
+# tokens are checksummed on every request by every module. Checksummed
+# forms are memoized here (bounded, in cache_manager), keyed by the
+# lower-case address. Configured wallets and tokens are checksummed
+# once, when this module is first imported, and pinned.
+#
+# keccak comes from eth_hash directly: eth_utils would add ~250 ms of
+# import time for the same result.
+
+ADDRESS_RE = re.compile(r"0x[a-fA-F0-9]{40}")
+
+# lower-case address -> checksummed address
+_CHECKSUMS = CACHES.namespace("addresses", max_entries=10_000)
+
+
+def _checksum(lower: str) -> str:
+    from eth_hash.auto import keccak
+
+    digest = keccak(lower[2:].encode()).hex()
+    return "0x" + "".join(
+        c.upper() if int(digest[i], 16) >= 8 else c
+        for i, c in enumerate(lower[2:])
+    )
+
+
+def is_hex_address(value) -> bool:
+    """
+    True for "0x" + 40 hex digits, in any case (checksum not verified).
+    """
+    return isinstance(value, str) and ADDRESS_RE.fullmatch(value) is not None
+
+
+def to_checksum_address(address: str) -> str:
+    """
+    EIP-55 form of a hex address in any case, memoized. Like
+    Web3.to_checksum_address, mixed-case input is not verified.
+    Raises ValueError for anything that isn't an address.
+    """
+    if not is_hex_address(address):
+        raise ValueError(f"Not an address: {address!r}")
+
+    key = address.lower()
+    cached = _CHECKSUMS.get(key)
+    if cached:
+        return cached
+
+    checksummed = _checksum(key)
+    _CHECKSUMS.set(key, checksummed)
+    return checksummed
+
+
+def normalize_address(address) -> Optional[str]:
+    """
+    Checksummed address, or None if invalid. A missing "0x" is added.
+    """
+    if not isinstance(address, str):
+        return None
+
+    if not address.startswith("0x") and not address.startswith("0X"):
+        address = "0x" + address
+    address = "0x" + address[2:]
+
+    if not is_hex_address(address):
+        return None
+
+    return to_checksum_address(address)
+
+
+def preload(addresses: Iterable[str]) -> int:
+    """
+    Checksums addresses up front and pins them. Returns how many were added.
+    """
+    added = 0
+    for address in addresses:
+        if is_hex_address(address) and address.lower() not in _CHECKSUMS:
+            _CHECKSUMS.set(address.lower(), _checksum(address.lower()), pin=True)
+            added += 1
+    return added
+
+
+def _configured_addresses() -> Iterable[str]:
+    for config in CHAIN_CONFIG.values():
+        yield from get_chain_wallets(config)
+        yield from config.get("tokens", [])
+
+
+preload(_configured_addresses())
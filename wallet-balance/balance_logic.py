@@ -1,10 +1,25 @@
+from __future__ import annotations
+
+import asyncio
 import datetime
-from web3 import Web3
-from moralis import evm_api
-from settings import get_moralis_api_key, PROVIDERS, CHAIN_CONFIG
-import re
+import weakref
+from collections import deque
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterable
+from settings import get_chain_wallets, get_http_pool_maxsize, get_moralis_api_key, get_range_window_days, PROVIDERS, CHAIN_CONFIG
 import os
 from common import get_boolean_from_value, is_date_older_than_cutoff
+from transport import post_json
+import block_index
+import metrics
+import resilience
+import result_cache
+from singleflight import coalesce
+
+# web3 and moralis are imported where they are used: together they cost
+# over a second of import time. Balance reads go through erc20_calls /
+# multicall as raw eth_calls, so the request path never needs web3.
+if TYPE_CHECKING:
+    from web3 import Web3
 
 ERC20_ABI = [
     {
@@ -30,6 +45,7 @@ ERC20_ABI = [
     }
 ]
 
+@coalesce("balance_logic.get_block_by_date")
 def get_block_by_date(date_str: str, chain: str) -> int:
     iso_timestamp = f"{date_str}T00:00:00Z"
     provider = PROVIDERS[chain]["provider"]
@@ -44,44 +60,80 @@ def get_block_by_date(date_str: str, chain: str) -> int:
             if block_num > 71000000:
                 return block_num
 
+    cached = block_index.get_block(chain, date_str)
+    if cached:
+        return cached
+
+    if provider == "routed":
+        import provider_router
+
+        block = provider_router.get_block_by_date(chain, date_str)
+        return block_index.record_block(chain, date_str, block, source="routed")
+
+    if provider == "moralis":
+        from moralis import evm_api
+
         moralis_ak = get_moralis_api_key()
-        result = evm_api.block.get_date_to_block(
-            api_key=moralis_ak,
-            params={
-                "chain": PROVIDERS[chain]["moralis_chain"],
-                "date": iso_timestamp
-            }
-        )
-        return int(result["block"])
+        with metrics.timed_call("moralis", chain, "getDateToBlock"):
+            result = resilience.call(
+                "moralis", chain, evm_api.block.get_date_to_block,
+                api_key=moralis_ak,
+                params={
+                    "chain": PROVIDERS[chain]["moralis_chain"],
+                    "date": iso_timestamp
+                }
+            )
+        return block_index.record_block(chain, date_str, int(result["block"]), source="moralis")
 
     elif provider == "alchemy":
-        import requests
-        ts = int(datetime.datetime.fromisoformat(date_str).timestamp())
+        ts = int(
+            datetime.datetime.fromisoformat(date_str)
+            .replace(tzinfo=datetime.timezone.utc)
+            .timestamp()
+        )
         payload = {
             "jsonrpc": "2.0",
             "id": 1,
             "method": "alchemy_getBlockByTimestamp",
             "params": [hex(ts), "latest"]
         }
-        response = requests.post(PROVIDERS[chain]["alchemy_url"], json=payload)
+        response = post_json(PROVIDERS[chain]["alchemy_url"], payload)
         response.raise_for_status()
-        return int(response.json()["result"]["number"], 16)
+        result = response.json()["result"]
+        block = int(result["number"], 16)
+
+        # Alchemy answers with the last block at or before ts; every other
+        # path stores the first block at or after it (see provider_router)
+        block_ts = result.get("timestamp")
+        if block_ts is None:
+            header = {"jsonrpc": "2.0", "id": 1, "method": "eth_getBlockByNumber", "params": [hex(block), False]}
+            response = post_json(PROVIDERS[chain]["alchemy_url"], header)
+            response.raise_for_status()
+            block_ts = response.json()["result"]["timestamp"]
+        if int(block_ts, 16) < ts:
+            block += 1
+        return block_index.record_block(chain, date_str, block, source="alchemy")
 
     raise ValueError("Unsupported provider")
 
 
+@coalesce("balance_logic.get_moralis_token_balances")
 def get_moralis_token_balances(wallet: str, tokens: list[str], chain: str, block_number: int):
+    from moralis import evm_api
+
     moralis_ak = get_moralis_api_key()
 
-    result = evm_api.token.get_wallet_token_balances(
-        api_key=moralis_ak,
-        params={
-            "chain": PROVIDERS[chain]["moralis_chain"],
-            "address": wallet,
-            "to_block": block_number,
-            "token_addresses": tokens
-        }
-    )
+    with metrics.timed_call("moralis", chain, "getWalletTokenBalances"):
+        result = resilience.call(
+            "moralis", chain, evm_api.token.get_wallet_token_balances,
+            api_key=moralis_ak,
+            params={
+                "chain": PROVIDERS[chain]["moralis_chain"],
+                "address": wallet,
+                "to_block": block_number,
+                "token_addresses": tokens
+            }
+        )
     return [
         {
             "token_address": x["token_address"],
@@ -94,53 +146,334 @@ def get_moralis_token_balances(wallet: str, tokens: list[str], chain: str, block
     ]
 
 
-def get_alchemy_token_balance(w3: Web3, token_address: str, wallet: str, block_number: int):
-    contract = w3.eth.contract(address=Web3.to_checksum_address(token_address), abi=ERC20_ABI)
-    balance = contract.functions.balanceOf(wallet).call(block_identifier=block_number)
-    decimals = contract.functions.decimals().call()
-    symbol = contract.functions.symbol().call()
-    return {
-        "token_address": token_address,
-        "symbol": symbol,
-        "balance": balance / (10 ** decimals),
-        "raw_balance": balance,
-        "decimals": decimals
-    }
+def get_alchemy_token_balance(rpc: str | Web3, token_address: str, wallet: str, block_number: int, chain: str | None = None):
+    """
+    One token via raw eth_calls (erc20_calls), no web3 contract.
+    Raises if the token's calls fail.
+    """
+    from erc20_calls import read_token_balance
+
+    return read_token_balance(rpc, chain, token_address, wallet, block_number)
+
+
+def _rpc_url(chain: str) -> str:
+    """
+    JSON-RPC URL of an alchemy or routed chain (route://<chain> goes
+    through provider_router).
+    """
+    if PROVIDERS[chain]["provider"] == "routed":
+        import provider_router
+
+        return provider_router.route_url(chain)
+    return PROVIDERS[chain]["alchemy_url"]
+
+
+def _chain_result(balances_by_wallet: dict[str, list[dict]]) -> list[dict] | dict[str, list[dict]]:
+    """
+    One wallet keeps the original {chain: [balances]} shape; several
+    wallets give {chain: {wallet: [balances]}}.
+    """
+    if len(balances_by_wallet) == 1:
+        return next(iter(balances_by_wallet.values()))
+    return balances_by_wallet
+
+
+def _configured_chains() -> list[tuple[str, list[str], list[str]]]:
+    """
+    (chain, valid checksummed wallets, tokens) for every chain in CHAIN_CONFIG
+    with at least one valid wallet.
+    """
+    chains = []
+    for chain, config in CHAIN_CONFIG.items():
+        wallets = [w for w in map(validate_eth_address, get_chain_wallets(config)) if w]
+        if wallets:
+            chains.append((chain, wallets, config["tokens"]))
+    return chains
+
+
+def iter_chain_wallet_balances(chain: str, wallets: list[str], tokens: list[str], block: int):
+    """
+    Yields (wallet, balances) for every wallet at block. On Alchemy all
+    (wallet, token) reads are planned into as few aggregate3 calls as
+    possible (see multicall.plan_wallet_batches).
+    """
+    provider = PROVIDERS[chain]["provider"]
+
+    if provider == "moralis":
+        for wallet in wallets:
+            yield wallet, get_moralis_token_balances(wallet, tokens, chain, block)
+
+    elif provider in ("alchemy", "routed"):
+        from multicall import get_multicall_wallet_balances, plan_wallet_batches
+
+        from erc20_calls import read_token_balances
+
+        rpc_url = _rpc_url(chain)
+        metadata = {}
+        for batch in plan_wallet_batches(wallets, tokens, metadata):
+            # None before Multicall3 existed
+            balances = get_multicall_wallet_balances(rpc_url, chain, batch, tokens, block, metadata)
+            for wallet in batch:
+                if balances is None:
+                    yield wallet, read_token_balances(rpc_url, chain, wallet, tokens, block)
+                else:
+                    yield wallet, balances[wallet]
+
+    else:
+        for wallet in wallets:
+            yield wallet, []
 
 
 def get_all_balances_by_date(date: str):
     results = {}
 
-    for chain, config in CHAIN_CONFIG.items():
-        wallet = config["wallet"]
-        tokens = config["tokens"]
-        provider = PROVIDERS[chain]["provider"]
+    for chain, wallets, tokens in _configured_chains():
+        try:
+            block = get_block_by_date(date, chain)
+            balances = dict(iter_chain_wallet_balances(chain, wallets, tokens, block))
+            results[chain] = _chain_result(balances)
+
+        except Exception as e:
+            results[chain] = [{"error": str(e)}]
+
+    return results
+
+
+
+# ============================================================
+# ASYNC ENGINE
+# ============================================================
+#
+# Same results as get_all_balances_by_date, but every chain runs
+# concurrently and, within a chain, wallet batches and per-token calls
+# run concurrently. The blocking SDK/web3 calls run on worker threads;
+# a semaphore per provider caps how many threads it takes, at the most
+# its rate limiter's window can grow to (HTTP_POOL_MAXSIZE). The window
+# itself (rate_limit.py) decides how many calls are actually in flight.
 
-        wallet = validate_eth_address(wallet)
-        if wallet:
+_PROVIDER_SEMAPHORES: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
 
+
+def _get_provider_semaphore(provider: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphores = _PROVIDER_SEMAPHORES.setdefault(loop, {})
+    if provider not in semaphores:
+        semaphores[provider] = asyncio.Semaphore(get_http_pool_maxsize())
+    return semaphores[provider]
+
+
+async def _run_on_provider(provider: str, fn, *args):
+    async with _get_provider_semaphore(provider):
+        return await asyncio.to_thread(fn, *args)
+
+
+async def _iter_windowed(jobs: Iterable[Callable[[], Awaitable]], window: int) -> AsyncIterator:
+    """
+    Runs coroutine factories with at most window in flight and yields
+    their results in job order. Only the window is held in memory.
+    """
+    jobs = iter(jobs)
+    in_flight: deque = deque()
+
+    def start_next() -> None:
+        job = next(jobs, None)
+        if job is not None:
+            in_flight.append(asyncio.ensure_future(job()))
+
+    try:
+        for _ in range(max(1, window)):
+            start_next()
+
+        while in_flight:
+            result = await in_flight.popleft()
+            start_next()
+            yield result
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+async def iter_chain_wallet_balances_async(
+    date: str,
+    chain: str,
+    wallets: list[str],
+    tokens: list[str],
+    block: int | None = None,
+    metadata: dict | None = None,
+) -> AsyncIterator[tuple[str, list[dict]]]:
+    """
+    Yields (wallet, balances) for every wallet, in order, as soon as its
+    batch is done. block skips block resolution when it is already known;
+    metadata is a token metadata dict shared across calls (see multicall).
+    Failures are reported per wallet as [{"error": ...}].
+    """
+    provider = PROVIDERS[chain]["provider"]
+    window = get_http_pool_maxsize()
+
+    try:
+        if block is None:
+            block = await _run_on_provider(provider, get_block_by_date, date, chain)
+    except Exception as e:
+        for wallet in wallets:
+            yield wallet, [{"error": str(e)}]
+        return
+
+    if provider == "moralis":
+        async def moralis_wallet(wallet: str):
             try:
-                block = get_block_by_date(date, chain)
-
-                if provider == "moralis":
-                    balances = get_moralis_token_balances(wallet, tokens, chain, block)
-                elif provider == "alchemy":
-                    w3 = Web3(Web3.HTTPProvider(PROVIDERS[chain]["alchemy_url"]))
-                    balances = [
-                        get_alchemy_token_balance(w3, token, wallet, block)
-                        for token in tokens
-                    ]
-                else:
-                    balances = []
+                return wallet, await _run_on_provider(
+                    provider, get_moralis_token_balances, wallet, tokens, chain, block
+                )
+            except Exception as e:
+                return wallet, [{"error": str(e)}]
+
+        async for result in _iter_windowed(((lambda w=w: moralis_wallet(w)) for w in wallets), window):
+            yield result
+
+    elif provider in ("alchemy", "routed"):
+        from multicall import get_multicall_wallet_balances, plan_wallet_batches
 
+        from erc20_calls import read_token_balances
+
+        rpc_url = _rpc_url(chain)
+        if metadata is None:
+            metadata = {}
+
+        async def alchemy_batch(batch: list[str]) -> list[tuple[str, list[dict]]]:
+            try:
+                balances = await _run_on_provider(
+                    provider, get_multicall_wallet_balances, rpc_url, chain, batch, tokens, block, metadata
+                )
+                if balances is not None:
+                    return [(wallet, balances[wallet]) for wallet in batch]
+
+                # Before Multicall3 existed: one JSON-RPC batch per wallet
+                return list(zip(batch, await asyncio.gather(*(
+                    _run_on_provider(provider, read_token_balances, rpc_url, chain, wallet, tokens, block)
+                    for wallet in batch
+                ))))
             except Exception as e:
-                balances = [{"error": str(e)}]
+                return [(wallet, [{"error": str(e)}]) for wallet in batch]
 
-            results[chain] = balances
+        batches = plan_wallet_batches(wallets, tokens, metadata)
 
-    return results
+        # The first batch fetches token metadata; the rest reuse it
+        for result in await alchemy_batch(batches[0]):
+            yield result
+
+        async for batch_results in _iter_windowed(((lambda b=b: alchemy_batch(b)) for b in batches[1:]), window):
+            for result in batch_results:
+                yield result
+
+    else:
+        for wallet in wallets:
+            yield wallet, []
 
 
+async def get_chain_balances_async(
+    date: str,
+    chain: str,
+    wallets: list[str],
+    tokens: list[str],
+    block: int | None = None,
+    metadata: dict | None = None,
+) -> list[dict] | dict[str, list[dict]]:
+    balances = {
+        wallet: wallet_balances
+        async for wallet, wallet_balances in iter_chain_wallet_balances_async(
+            date, chain, wallets, tokens, block, metadata
+        )
+    }
+    return _chain_result(balances)
+
+
+@coalesce("balance_logic.get_all_balances_by_date_async")
+async def get_all_balances_by_date_async(date: str):
+    chains = _configured_chains()
+
+    balances = await asyncio.gather(*(
+        get_chain_balances_async(date, chain, wallets, tokens)
+        for chain, wallets, tokens in chains
+    ))
+
+    return {
+        chain: chain_balances
+        for (chain, _, _), chain_balances in zip(chains, balances)
+    }
+
+
+async def iter_wallet_balances_async(date: str, wallets: list[str] | None = None) -> AsyncIterator[tuple[str, str, list[dict]]]:
+    """
+    Yields (chain, wallet, balances) one wallet at a time, for the given
+    wallets or, when wallets is None, every wallet in CHAIN_CONFIG. Memory
+    stays bounded by the in-flight batches however many wallets there are.
+    Raises ValueError listing any invalid address (function_app.parse_wallets
+    rejects them with a 400 first).
+    """
+    if wallets is not None:
+        checksummed = [validate_eth_address(w) for w in wallets]
+        invalid = [w for w, c in zip(wallets, checksummed) if c is None]
+        if invalid or not wallets:
+            raise ValueError(f"Invalid wallet addresses: {', '.join(invalid) or 'none given'}")
+        wallets = checksummed
+
+    for chain, configured_wallets, tokens in _configured_chains():
+        async for wallet, balances in iter_chain_wallet_balances_async(
+            date, chain, configured_wallets if wallets is None else wallets, tokens
+        ):
+            yield chain, wallet, balances
+
+
+# ============================================================
+# DATE RANGES
+# ============================================================
+#
+# A start/end range is one pass instead of one request per day:
+#   1. days already in the result cache are served from it
+#   2. blocks for all remaining (chain, day) pairs are resolved up front,
+#      concurrently
+#   3. days are computed a few at a time (RANGE_WINDOW_DAYS) with token
+#      metadata shared across them, and yielded in date order
+# Only the window of in-flight days is held in memory.
+
+async def iter_balances_by_date_range_async(dates: list[str]) -> AsyncIterator[tuple[str, dict]]:
+    """
+    Yields (date, {chain: balances}) for every date, in order.
+    """
+    chains = _configured_chains()
+    metadata = {chain: {} for chain, _, _ in chains}
+
+    # One lookup per date: compute() reuses it
+    cached = {date: result_cache.get_result(date) for date in dates}
+    pending = [date for date in dates if cached[date] is None]
+
+    async def resolve(chain: str, date: str):
+        try:
+            return await _run_on_provider(PROVIDERS[chain]["provider"], get_block_by_date, date, chain)
+        except Exception as e:
+            return e
+
+    pairs = [(chain, date) for chain, _, _ in chains for date in pending]
+    blocks = dict(zip(pairs, await asyncio.gather(*(resolve(chain, date) for chain, date in pairs))))
+
+    async def compute(date: str) -> tuple[str, dict]:
+        if cached[date]:
+            return date, cached[date]["data"]
+
+        async def chain_balances(chain: str, wallets: list[str], tokens: list[str]):
+            block = blocks[(chain, date)]
+            if isinstance(block, Exception):
+                return [{"error": str(block)}]
+            return await get_chain_balances_async(date, chain, wallets, tokens, block, metadata[chain])
+
+        balances = await asyncio.gather(*(chain_balances(*chain) for chain in chains))
+        data = {chain: chain_data for (chain, _, _), chain_data in zip(chains, balances)}
+        result_cache.put_result(date, data)
+        return date, data
+
+    async for result in _iter_windowed(((lambda d=d: compute(d)) for d in dates), get_range_window_days()):
+        yield result
+
 
 def validate_eth_address(address: str) -> str | None:
     """
@@ -148,16 +481,6 @@ def validate_eth_address(address: str) -> str | None:
     - Returns the checksummed address if valid
     - Returns None if invalid
     """
-    if not isinstance(address, str):
-        return None
-
-    if not address.startswith("0x") and not address.startswith("0X"):
-        address = "0x" + address
-
-    if not re.fullmatch(r"0x[a-fA-F0-9]{40}", address):
-        return None
-
-    if not Web3.is_address(address):
-        return None
+    from addresses import normalize_address
 
-    return Web3.to_checksum_address(address)
+    return normalize_address(address)
@@ -0,0 +1,167 @@
+import json
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+import metrics
+from cache_manager import CACHES
+from common import get_datetime_now_pt
+from storage import connect
+
+# ============================================================
+# PERSISTENT DATE → BLOCK INDEX
+# ============================================================
+#
+# Maps (chain, timezone, day) to the block at the start of that day.
+# Every get_block_by_date variant reads here first and writes through
+# after a network lookup, so a resolved day never costs a call again.
+#
+# Only closed days are written: the block for a day that has not ended
+# yet (or a future day, where providers return "latest") can still move.
+
+SUPPORTED_TZ = ("UTC", "PT")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS block_index (
+    chain  TEXT    NOT NULL,
+    tz     TEXT    NOT NULL,
+    day    TEXT    NOT NULL,
+    block  INTEGER NOT NULL,
+    source TEXT,
+    PRIMARY KEY (chain, tz, day)
+);
+"""
+
+# In-memory front for the table: (chain, tz, day) -> block.
+# Closed days never change, so entries are pinned.
+_MEMORY = CACHES.namespace("block_index.memory", pin=True)
+
+
+def _db():
+    return connect("block_index", SCHEMA)
+
+
+def _key(chain: str, day: str, tz: str) -> tuple:
+    if tz not in SUPPORTED_TZ:
+        raise ValueError(f"Unsupported timezone for block index: {tz}")
+    return (chain.lower(), tz, day)
+
+
+def is_day_closed(day: str, tz: str = "UTC") -> bool:
+    """
+    True once day (YYYY-MM-DD) has fully ended in tz.
+    """
+    if tz == "PT":
+        today = get_datetime_now_pt().date()
+    else:
+        today = datetime.now(timezone.utc).date()
+
+    return datetime.strptime(day, "%Y-%m-%d").date() < today
+
+
+def get_block(chain: str, day: str, tz: str = "UTC") -> Optional[int]:
+    key = _key(chain, day, tz)
+
+    cached = _MEMORY.get(key)
+    if cached is not None:
+        metrics.cache_hit("block_index")
+        return cached
+
+    row = _db().execute(
+        "SELECT block FROM block_index WHERE chain = ? AND tz = ? AND day = ?",
+        key,
+    ).fetchone()
+
+    metrics.record_cache("block_index", row is not None)
+    if row is None:
+        return None
+
+    _MEMORY.set(key, row["block"])
+    return row["block"]
+
+
+def put_block(chain: str, day: str, block: int, tz: str = "UTC", source: Optional[str] = None) -> None:
+    key = _key(chain, day, tz)
+
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO block_index (chain, tz, day, block, source) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (*key, int(block), source),
+        )
+
+    _MEMORY.set(key, int(block))
+
+
+def record_block(chain: str, day: str, block: int, tz: str = "UTC", source: Optional[str] = None) -> int:
+    """
+    Write-through after a network lookup. Skips days that are still open.
+    Returns block so callers can `return record_block(...)`.
+    """
+    if block and block > 0 and is_day_closed(day, tz):
+        put_block(chain, day, block, tz=tz, source=source)
+    return block
+
+
+# ============================================================
+# BULK IMPORT / EXPORT
+# ============================================================
+
+def import_blocks(rows: Iterable[Dict]) -> int:
+    """
+    Bulk upsert of {"chain", "day", "block", "tz"?, "source"?} rows.
+    Returns number of rows written.
+    """
+    records = [
+        (*_key(row["chain"], row["day"], row.get("tz", "UTC")), int(row["block"]), row.get("source", "import"))
+        for row in rows
+    ]
+
+    conn = _db()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO block_index (chain, tz, day, block, source) "
+            "VALUES (?, ?, ?, ?, ?)",
+            records,
+        )
+
+    for chain, tz, day, block, _ in records:
+        _MEMORY.set((chain, tz, day), block)
+
+    return len(records)
+
+
+def import_history(history: Dict[str, Dict[str, int]], tz: str = "UTC") -> int:
+    """
+    Imports a BLOCK_HISTORY-shaped dict: {chain: {day: block}}.
+    """
+    return import_blocks(
+        {"chain": chain, "day": day, "block": block, "tz": tz}
+        for chain, days in history.items()
+        for day, block in days.items()
+    )
+
+
+def export_blocks(chain: Optional[str] = None) -> List[Dict]:
+    query = "SELECT chain, tz, day, block, source FROM block_index"
+    params: tuple = ()
+    if chain:
+        query += " WHERE chain = ?"
+        params = (chain.lower(),)
+    query += " ORDER BY chain, tz, day"
+
+    return [dict(row) for row in _db().execute(query, params)]
+
+
+# python block_index.py export [chain] > blocks.json
+# python block_index.py import blocks.json
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "export":
+        json.dump(export_blocks(sys.argv[2] if len(sys.argv) > 2 else None), sys.stdout, indent=2)
+    elif len(sys.argv) == 3 and sys.argv[1] == "import":
+        with open(sys.argv[2]) as f:
+            print(f"Imported {import_blocks(json.load(f))} blocks")
+    else:
+        print("usage: block_index.py export [chain] | import <file.json>")
+        sys.exit(2)
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import math
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from cache_manager import CACHES
+
+if TYPE_CHECKING:
+    from web3 import Web3
+
+# ============================================================
+# TIMESTAMP → BLOCK SEARCH
+# ============================================================
+#
+# Fallback for when the provider has no timestamp API. Instead of a
+# binary search over [0, latest] (~25 sequential eth_getBlockByNumber on
+# BSC), interpolate between known (block, timestamp) anchors. Block times
+# are close to constant, so a cold lookup converges in a handful of
+# probes, and every fetched header is cached for the next search.
+
+# Seconds per block, used only to extrapolate before a lower anchor exists.
+AVG_BLOCK_TIME: Dict[str, float] = {
+    "eth": 12.0,
+    "bsc": 0.75,
+}
+
+MAX_CACHED_HEADERS = 4096
+
+# Extrapolation overshoots slightly so the first probe lands before the target
+EXTRAPOLATION_MARGIN = 0.02
+
+
+class HeaderCache:
+    """
+    Bounded LRU of block -> timestamp per chain: one cache_manager
+    namespace ("block_headers.<chain>") per chain.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_HEADERS):
+        self.max_entries = max_entries
+
+    def _namespace(self, chain: str):
+        return CACHES.namespace(f"block_headers.{chain}", max_entries=self.max_entries)
+
+    def get(self, chain: str, block: int) -> Optional[int]:
+        return self._namespace(chain).get(block)
+
+    def put(self, chain: str, block: int, timestamp: int) -> None:
+        self._namespace(chain).set(block, timestamp)
+
+    def bracket(self, chain: str, target_ts: int) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        """
+        Tightest cached anchors around target_ts:
+        (last block with ts <= target, first block with ts > target).
+        """
+        lo = hi = None
+        for block, ts in self._namespace(chain).items():
+            if ts <= target_ts:
+                if lo is None or block > lo[0]:
+                    lo = (block, ts)
+            elif hi is None or block < hi[0]:
+                hi = (block, ts)
+        return lo, hi
+
+
+HEADER_CACHE = HeaderCache()
+
+
+def seed_anchors(chain: str, anchors: Dict[int, int]) -> None:
+    """
+    Adds known {block: timestamp} pairs to the header cache.
+    """
+    for block, ts in anchors.items():
+        HEADER_CACHE.put(chain.lower(), block, ts)
+
+
+def get_block_timestamp(w3: Web3, chain: str, block: int) -> int:
+    """
+    Block timestamp, served from the header cache when possible.
+    """
+    chain = chain.lower()
+    cached = HEADER_CACHE.get(chain, block)
+    if cached is not None:
+        return cached
+
+    ts = w3.eth.get_block(block)["timestamp"]
+    HEADER_CACHE.put(chain, block, ts)
+    return ts
+
+
+def find_block_by_timestamp(w3: Web3, chain: str, target_ts: int) -> int:
+    """
+    Returns the block whose timestamp equals target_ts, otherwise the
+    last block before it (same result as the plain binary search).
+    """
+    chain = chain.lower()
+
+    latest = w3.eth.get_block("latest")
+    HEADER_CACHE.put(chain, latest["number"], latest["timestamp"])
+    if target_ts >= latest["timestamp"]:
+        return latest["number"]
+
+    lo, hi = HEADER_CACHE.bracket(chain, target_ts)
+    if hi is None:
+        hi = (latest["number"], latest["timestamp"])
+
+    slow_steps = 0
+    while True:
+        if lo is not None and hi[0] - lo[0] <= 1:
+            return lo[0]
+
+        if lo is None:
+            # No lower anchor yet: extrapolate back from hi, using the block
+            # time observed between hi and latest once we have two points
+            block_time = 0.0
+            if hi[0] < latest["number"]:
+                block_time = (latest["timestamp"] - hi[1]) / (latest["number"] - hi[0])
+            if block_time <= 0:
+                # Blocks sharing a timestamp (fast chains) say nothing about the pace
+                block_time = AVG_BLOCK_TIME.get(chain, 12.0)
+            distance = (hi[1] - target_ts) / block_time
+            guess = max(0, hi[0] - math.ceil(distance * (1 + EXTRAPOLATION_MARGIN)) - 1)
+        elif slow_steps >= 2 or hi[1] == lo[1]:
+            # Interpolation is stalling (uneven block times) or has no
+            # timestamp span to work with: bisect once
+            guess = (lo[0] + hi[0]) // 2
+            slow_steps = 0
+        else:
+            span = hi[0] - lo[0]
+            guess = lo[0] + int((target_ts - lo[1]) * span / (hi[1] - lo[1]))
+            guess = min(max(guess, lo[0] + 1), hi[0] - 1)
+
+        ts = get_block_timestamp(w3, chain, guess)
+        width = hi[0] - (lo[0] if lo is not None else 0)
+
+        if ts == target_ts:
+            return guess
+
+        if ts < target_ts:
+            lo = (guess, ts)
+        else:
+            if guess == 0:
+                return 0
+            hi = (guess, ts)
+            if lo is None:
+                continue
+
+        new_width = hi[0] - lo[0]
+        slow_steps = slow_steps + 1 if new_width * 2 > width else 0
+
+
+def find_first_block_at_or_after(w3: Web3, chain: str, target_ts: int) -> int:
+    """
+    First block whose timestamp is >= target_ts: what a date resolves to
+    on every path (QuickNode "after", Moralis dateToBlock,
+    provider_router), so the block index holds the same block whichever
+    path filled it. The latest block if none is that late yet.
+    """
+    chain = chain.lower()
+    block = find_block_by_timestamp(w3, chain, target_ts)
+    ts = get_block_timestamp(w3, chain, block)
+
+    if ts < target_ts:
+        # find_block_by_timestamp cached the latest header: no later anchor, no later block
+        _, hi = HEADER_CACHE.bracket(chain, target_ts)
+        return block + 1 if hi is not None else block
+
+    # Several blocks can share target_ts: step back to the first
+    while block > 0 and get_block_timestamp(w3, chain, block - 1) == target_ts:
+        block -= 1
+    return block
@@ -0,0 +1,289 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterator, Optional, Tuple
+
+import metrics
+from settings import get_cache_max_bytes
+
+# ============================================================
+# BOUNDED IN-MEMORY CACHES
+# ============================================================
+#
+# Every process-level cache is a namespace of one CacheManager:
+#   - per namespace: LRU bound (max_entries) and optional TTL (seconds)
+#   - across namespaces: one byte budget (CACHE_MAX_BYTES); when it is
+#     exceeded the least recently used unpinned entry of any namespace
+#     is evicted
+#   - pinned entries (immutable data: token metadata, closed-day blocks)
+#     count towards the budget but are never evicted
+# Lookups, evictions and expirations are recorded in metrics under the
+# namespace name.
+#
+#     TOKEN_SNAPSHOT_CACHE = CACHES.namespace("token_snapshot", max_entries=10_000)
+#     snapshot = TOKEN_SNAPSHOT_CACHE.get(key)
+#     TOKEN_SNAPSHOT_CACHE.set(key, snapshot)
+
+# Charged for values whose size can't be measured (e.g. web3 contracts)
+OPAQUE_OBJECT_SIZE = 4096
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Approximate deep size in bytes of plain data (dict/list/tuple/str/
+    bytes/numbers). Other objects are charged OPAQUE_OBJECT_SIZE.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return sys.getsizeof(value)
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if _depth > 8:
+        return OPAQUE_OBJECT_SIZE
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(v, _depth + 1) for v in value)
+    return OPAQUE_OBJECT_SIZE
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "pinned")
+
+    def __init__(self, value: Any, size: int, expires_at: Optional[float], pinned: bool):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.pinned = pinned
+
+
+class CacheNamespace:
+    """
+    One named cache. Thread-safe; shares its lock and byte budget with
+    the owning CacheManager.
+    """
+
+    def __init__(self, manager: "CacheManager", name: str, max_entries: Optional[int],
+                 ttl: Optional[float], pin: bool):
+        self.manager = manager
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pin = pin
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # --------------------------------------------------------
+    # Reads
+    # --------------------------------------------------------
+
+    def _live_entry(self, key: Hashable) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            self.manager._remove(self, key, reason="expired")
+            return None
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the cached value (refreshing its LRU position) or default.
+        Counted as a hit or miss.
+        """
+        with self.manager._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                if not entry.pinned:
+                    self.manager._touch(self, key)
+        metrics.record_cache(self.name, entry is not None)
+        return default if entry is None else entry.value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Like get(), but neither counted nor moved in the LRU order.
+        """
+        with self.manager._lock:
+            entry = self._live_entry(key)
+        return default if entry is None else entry.value
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.manager._lock:
+            return self._live_entry(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        """
+        Snapshot of (key, value) pairs; does not count as lookups.
+        """
+        now = time.monotonic()
+        with self.manager._lock:
+            return iter([
+                (key, entry.value) for key, entry in self._entries.items()
+                if entry.expires_at is None or entry.expires_at > now
+            ])
+
+    # --------------------------------------------------------
+    # Writes
+    # --------------------------------------------------------
+
+    def set(self, key: Hashable, value: Any, pin: Optional[bool] = None,
+            ttl: Optional[float] = None, size: Optional[int] = None) -> None:
+        """
+        Stores value. pin/ttl default to the namespace's policy; size
+        defaults to estimate_size(value).
+        """
+        pinned = self.pin if pin is None else pin
+        ttl = self.ttl if ttl is None else ttl
+        entry = _Entry(
+            value,
+            estimate_size(value) if size is None else size,
+            None if pinned or not ttl else time.monotonic() + ttl,
+            pinned,
+        )
+        self.manager._store(self, key, entry)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self.manager._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self.manager._remove(self, key, reason=None)
+            return entry.value
+
+    def clear(self) -> None:
+        with self.manager._lock:
+            for key in list(self._entries):
+                self.manager._remove(self, key, reason=None)
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "pinned": sum(1 for entry in self._entries.values() if entry.pinned),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class CacheManager:
+    """
+    Owns all namespaces and enforces the shared byte budget.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes if max_bytes is not None else get_cache_max_bytes()
+        self.bytes = 0
+        self._namespaces: Dict[str, CacheNamespace] = {}
+        # Global LRU order of unpinned entries: (namespace name, key) -> None
+        self._lru: "OrderedDict[Tuple[str, Hashable], None]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def namespace(self, name: str, max_entries: Optional[int] = None,
+                  ttl: Optional[float] = None, pin: bool = False) -> CacheNamespace:
+        """
+        Returns the named namespace, creating it with this policy on first use.
+        """
+        with self._lock:
+            ns = self._namespaces.get(name)
+            if ns is None:
+                ns = self._namespaces[name] = CacheNamespace(self, name, max_entries, ttl, pin)
+            return ns
+
+    def _touch(self, ns: CacheNamespace, key: Hashable) -> None:
+        self._lru.move_to_end((ns.name, key))
+
+    def _store(self, ns: CacheNamespace, key: Hashable, entry: _Entry) -> None:
+        with self._lock:
+            if key in ns._entries:
+                self._remove(ns, key, reason=None)
+
+            ns._entries[key] = entry
+            ns.bytes += entry.size
+            self.bytes += entry.size
+            if not entry.pinned:
+                self._lru[(ns.name, key)] = None
+
+            # Per-namespace bound: oldest unpinned entry of this namespace
+            if ns.max_entries is not None and len(ns._entries) > ns.max_entries:
+                for old_key, old_entry in ns._entries.items():
+                    if not old_entry.pinned and old_key != key:
+                        self._remove(ns, old_key, reason="evicted")
+                        break
+
+            # Global budget: oldest unpinned entry of any namespace
+            while self.bytes > self.max_bytes and self._lru:
+                (name, old_key), _ = next(iter(self._lru.items()))
+                if name == ns.name and old_key == key and len(self._lru) == 1:
+                    break
+                self._remove(self._namespaces[name], old_key, reason="evicted")
+
+    def _remove(self, ns: CacheNamespace, key: Hashable, reason: Optional[str]) -> None:
+        entry = ns._entries.pop(key)
+        ns.bytes -= entry.size
+        self.bytes -= entry.size
+        self._lru.pop((ns.name, key), None)
+
+        if reason == "evicted":
+            ns.evictions += 1
+            metrics.record_cache_eviction(ns.name, reason)
+        elif reason == "expired":
+            ns.expirations += 1
+            metrics.record_cache_eviction(ns.name, reason)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "namespaces": {name: ns.stats() for name, ns in sorted(self._namespaces.items())},
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            for ns in self._namespaces.values():
+                ns.clear()
+
+    def to_prometheus(self, prefix: str = "wallet_balance") -> str:
+        """
+        Memory gauges, appended to metrics.to_prometheus() by the metrics route.
+        """
+        data = self.stats()
+        lines = [
+            f"# HELP {prefix}_cache_bytes Approximate bytes held per cache namespace",
+            f"# TYPE {prefix}_cache_bytes gauge",
+        ]
+        for name, stats in data["namespaces"].items():
+            lines.append(f'{prefix}_cache_bytes{{cache="{name}"}} {stats["bytes"]}')
+        lines += [
+            f"# HELP {prefix}_cache_entries Entries per cache namespace",
+            f"# TYPE {prefix}_cache_entries gauge",
+        ]
+        for name, stats in data["namespaces"].items():
+            lines.append(f'{prefix}_cache_entries{{cache="{name}"}} {stats["entries"]}')
+        lines += [
+            f"# HELP {prefix}_cache_budget_bytes Byte budget shared by all caches",
+            f"# TYPE {prefix}_cache_budget_bytes gauge",
+            f"{prefix}_cache_budget_bytes {data['max_bytes']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide manager shared by every module
+CACHES = CacheManager()
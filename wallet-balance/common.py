@@ -1,5 +1,5 @@
 import pytz
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 def get_boolean_from_value(val: str):
@@ -29,4 +29,16 @@ def is_date_older_than_cutoff(date_str: str, cutoff_str: str = "2025-12-01") ->
         cutoff = datetime.strptime(cutoff_str, "%Y-%m-%d").date()
         return date <= cutoff
     except ValueError:
-        return False  # Invalid date format
\ No newline at end of file
+        return False  # Invalid date format
+
+
+def get_date_range(start_str: str, end_str: str) -> list[str]:
+    """
+    Every YYYY-MM-DD date from start to end, inclusive.
+    Raises ValueError on a bad format or when end is before start.
+    """
+    start = datetime.strptime(start_str, "%Y-%m-%d").date()
+    end = datetime.strptime(end_str, "%Y-%m-%d").date()
+    if end < start:
+        raise ValueError("'end' must not be before 'start'")
+    return [(start + timedelta(days=n)).strftime("%Y-%m-%d") for n in range((end - start).days + 1)]
\ No newline at end of file
@@ -0,0 +1,180 @@
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import token_registry
+from provider_examples import decode_symbol_return, execute_eth_call_batch, execute_eth_call_raw
+
+# ============================================================
+# LEAN ERC-20 CALLS
+# ============================================================
+#
+# ERC-20 reads without web3: calldata is the 4-byte selector plus
+# 32-byte words built by concatenation, sent as raw eth_call (JSON-RPC
+# batches where possible) through transport, and decoded by slicing.
+# This skips contract construction, checksumming and web3's generic ABI
+# encoder/decoder on every call, and web3's import cost entirely.
+#
+# Addresses are passed as hex strings in any case; they are never
+# checksummed.
+
+BALANCE_OF_SELECTOR = "0x70a08231"    # balanceOf(address)
+DECIMALS_SELECTOR = "0x313ce567"      # decimals()
+SYMBOL_SELECTOR = "0x95d89b41"        # symbol()
+NAME_SELECTOR = "0x06fdde03"          # name()
+TOTAL_SUPPLY_SELECTOR = "0x18160ddd"  # totalSupply()
+AGGREGATE3_SELECTOR = "0x82ad56cb"    # aggregate3((address,bool,bytes)[])
+
+
+def rpc_url_of(rpc) -> str:
+    """
+    RPC URL from a URL or a web3 instance, for callers that still hold one.
+    """
+    if isinstance(rpc, str):
+        return rpc
+    return rpc.provider.endpoint_uri
+
+
+# ============================================================
+# ENCODING
+# ============================================================
+
+def _word(value: int) -> bytes:
+    return value.to_bytes(32, "big")
+
+
+def _address_word(address: str) -> bytes:
+    return bytes.fromhex(address[2:]).rjust(32, b"\x00")
+
+
+def balance_of_calldata(wallet: str) -> str:
+    return BALANCE_OF_SELECTOR + wallet[2:].lower().rjust(64, "0")
+
+
+def encode_aggregate3(calls: Sequence[Tuple[str, bytes]], allow_failure: bool = True) -> str:
+    """
+    Calldata for Multicall3 aggregate3() from (target, calldata) pairs.
+    """
+    heads = []
+    tails = []
+    offset = 32 * len(calls)
+    for target, call_data in calls:
+        padding = b"\x00" * (-len(call_data) % 32)
+        element = (
+            _address_word(target)
+            + _word(int(allow_failure))
+            + _word(0x60)
+            + _word(len(call_data))
+            + call_data
+            + padding
+        )
+        heads.append(_word(offset))
+        tails.append(element)
+        offset += len(element)
+
+    body = _word(0x20) + _word(len(calls)) + b"".join(heads) + b"".join(tails)
+    return AGGREGATE3_SELECTOR + body.hex()
+
+
+# ============================================================
+# DECODING
+# ============================================================
+
+def decode_uint(data: Optional[bytes]) -> Optional[int]:
+    if not data or len(data) < 32:
+        return None
+    return int.from_bytes(data[:32], "big")
+
+
+def decode_aggregate3(data: bytes) -> List[Tuple[bool, bytes]]:
+    """
+    (success, returnData) per call from aggregate3()'s return data.
+    """
+    base = int.from_bytes(data[0:32], "big")
+    count = int.from_bytes(data[base:base + 32], "big")
+    start = base + 32
+
+    results = []
+    for i in range(count):
+        element = start + int.from_bytes(data[start + 32 * i:start + 32 * (i + 1)], "big")
+        success = int.from_bytes(data[element:element + 32], "big") != 0
+        data_start = element + int.from_bytes(data[element + 32:element + 64], "big")
+        length = int.from_bytes(data[data_start:data_start + 32], "big")
+        results.append((success, data[data_start + 32:data_start + 32 + length]))
+    return results
+
+
+# ============================================================
+# CALLS
+# ============================================================
+
+def read_token_balances(
+    rpc,
+    chain: Optional[str],
+    wallet: str,
+    tokens: List[str],
+    block: Union[int, str],
+) -> List[Dict]:
+    """
+    Balance dict per token for one wallet at block, in one JSON-RPC batch:
+    balanceOf for every token, plus decimals()/symbol() (at latest) for
+    tokens the registry doesn't know yet. Without chain the registry is
+    skipped. A token whose calls fail comes back as
+    {"token_address": ..., "error": ...}.
+    """
+    metadata: Dict[str, Dict] = {}
+    if chain:
+        for token in tokens:
+            registered = token_registry.get_metadata(chain, token)
+            if registered:
+                metadata[token.lower()] = {"decimals": registered["decimals"], "symbol": registered["symbol"]}
+
+    calls = [{"to": token, "data": balance_of_calldata(wallet)} for token in tokens]
+    missing = list(dict.fromkeys(token.lower() for token in tokens if token.lower() not in metadata))
+    for token in missing:
+        calls.append({"to": token, "data": DECIMALS_SELECTOR, "block": "latest"})
+        calls.append({"to": token, "data": SYMBOL_SELECTOR, "block": "latest"})
+
+    responses = execute_eth_call_batch(rpc_url=rpc_url_of(rpc), calls=calls, block=block)
+
+    fetched = []
+    for n, token in enumerate(missing):
+        decimals_response = responses[len(tokens) + 2 * n]
+        symbol_response = responses[len(tokens) + 2 * n + 1]
+        decimals = decode_uint(decimals_response["result"]) if decimals_response["error"] is None else None
+        if decimals is None:
+            continue
+        symbol = decode_symbol_return(symbol_response["result"]) if symbol_response["error"] is None else None
+        metadata[token] = {"decimals": decimals, "symbol": symbol}
+        fetched.append({"chain": chain, "token": token, **metadata[token]})
+
+    if chain:
+        token_registry.put_many(fetched, source="rpc")
+
+    balances = []
+    for token, response in zip(tokens, responses):
+        balance = decode_uint(response["result"]) if response["error"] is None else None
+        meta = metadata.get(token.lower())
+        if balance is None or meta is None:
+            balances.append({"token_address": token, "error": "balanceOf/decimals call failed"})
+            continue
+        balances.append({
+            "token_address": token,
+            "symbol": meta["symbol"],
+            "balance": balance / (10 ** meta["decimals"]),
+            "raw_balance": balance,
+            "decimals": meta["decimals"],
+        })
+    return balances
+
+
+def read_token_balance(rpc, chain: Optional[str], token: str, wallet: str, block: Union[int, str]) -> Dict:
+    """
+    Single-token read_token_balances(); raises RuntimeError if it fails.
+    """
+    balance = read_token_balances(rpc, chain, wallet, [token], block)[0]
+    if "error" in balance:
+        raise RuntimeError(f"{balance['error']} for {token}")
+    return balance
+
+
+def read_total_supply(rpc, token: str, block: Union[int, str] = "latest") -> Optional[int]:
+    return decode_uint(execute_eth_call_raw(rpc_url_of(rpc), token, TOTAL_SUPPLY_SELECTOR, block))
@@ -1,13 +1,151 @@
 import azure.functions as func
 import json
-from balance_logic import get_all_balances_by_date
-from common import is_date_older_than_cutoff, get_datetime_str_now_pt
+import logging
+import re
+import sys
+import metrics
+from cache_manager import CACHES
+from common import is_date_older_than_cutoff, get_date_range, get_datetime_str_now_pt
+from result_cache import RESULT_VERSION, etag_matches, get_result, put_result
+from settings import (
+    CHAIN_CONFIG,
+    get_chain_wallets,
+    get_max_buffered_range_days,
+    get_max_buffered_wallets,
+    get_max_range_days,
+    get_max_wallets_per_request,
+)
+
+# Optional: true HTTP streaming needs the FastAPI extension, which is not
+# in requirements.txt. Add azurefunctions-extensions-http-fastapi there and
+# set PYTHON_ENABLE_INIT_INDEXING=1 to register token_balances_stream;
+# without it, range and wallets= output is buffered (see MAX_BUFFERED_*).
+try:
+    from azurefunctions.extensions.http.fastapi import Request, StreamingResponse
+except ImportError:
+    StreamingResponse = None
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+
+def parse_date_range(start: str, end: str):
+    """
+    Returns (dates, None) or (None, error message).
+    """
+    if not start or not end:
+        return None, "Range mode needs both 'start' and 'end' query parameters in YYYY-MM-DD format."
+
+    if len(start) != 10 or len(end) != 10:
+        return None, "'start' and 'end' query parameters must be in YYYY-MM-DD format."
+
+    # Arbitrary date cutoff date. I don't want to query too far in the past
+    if is_date_older_than_cutoff(start):
+        return None, "'start' query parameter must be in YYYY-MM-DD format and newer than '2025-12-01."
+
+    try:
+        dates = get_date_range(start, end)
+    except ValueError as e:
+        return None, f"Invalid range: {e}"
+
+    if len(dates) > get_max_range_days():
+        return None, f"Range is longer than {get_max_range_days()} days."
+
+    return dates, None
+
+
+def buffered_range_error(dates):
+    """
+    token_balances builds the whole NDJSON body before answering (the
+    Functions HTTP binding can't stream), so ranges are capped there.
+    """
+    limit = get_max_buffered_range_days()
+    if len(dates) <= limit:
+        return None
+    error = f"Range is longer than {limit} days: split it into ranges of at most {limit} days"
+    return error + (" or use token_balances_stream." if StreamingResponse is not None else ".")
+
+
+def buffered_wallets_error(wallets):
+    """
+    Same cap for wallets=: wallets None (all) counts every configured wallet.
+    """
+    if wallets is None:
+        wallets = {w.lower() for config in CHAIN_CONFIG.values() for w in get_chain_wallets(config)}
+    limit = get_max_buffered_wallets()
+    if len(wallets) <= limit:
+        return None
+    error = f"More than {limit} wallets: list them in pages of at most {limit} wallets"
+    return error + (" or use token_balances_stream." if StreamingResponse is not None else ".")
+
+
+def parse_wallets(wallets_param: str):
+    """
+    'all' (every configured wallet) or comma-separated addresses.
+    Returns (wallets or None for all, None) or (None, error message
+    listing the invalid addresses); never falls back to all wallets.
+    """
+    if wallets_param.strip().lower() == "all":
+        return None, None
+
+    wallets = list(dict.fromkeys(w.strip() for w in wallets_param.split(",") if w.strip()))
+
+    invalid = [w for w in wallets if not re.fullmatch(r"0x[a-fA-F0-9]{40}", w)]
+    if invalid or not wallets:
+        return None, f"Invalid 'wallets' query parameter: {', '.join(invalid) or 'empty'}"
+
+    if len(wallets) > get_max_wallets_per_request():
+        return None, f"At most {get_max_wallets_per_request()} wallets per request."
+
+    return wallets, None
+
+
+async def iter_wallets_ndjson(date, wallets):
+    """
+    One JSON line per (chain, wallet), sent as soon as its batch is done.
+    """
+    from balance_logic import iter_wallet_balances_async
+
+    async for chain, wallet, balances in iter_wallet_balances_async(date, wallets):
+        yield json.dumps({"version": RESULT_VERSION, "date": date, "chain": chain, "wallet": wallet, "balances": balances}) + "\n"
+
+
+async def iter_range_ndjson(dates):
+    """
+    One JSON line per day, in date order, each shaped like a single-date
+    response.
+    """
+    # Imported on first use: keeps web3/moralis out of cold start
+    from balance_logic import iter_balances_by_date_range_async
+
+    async for date, data in iter_balances_by_date_range_async(dates):
+        yield json.dumps({**data, "version": RESULT_VERSION, "date": date}) + "\n"
+
+
 @app.function_name(name="token_balances")
 @app.route(route="token_balances", auth_level=func.AuthLevel.FUNCTION)
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        return await token_balances(req)
+    finally:
+        # Every branch (single date, range, wallets=); no-op unless STATSD_ADDRESS is set
+        try:
+            metrics.send_statsd()
+        except (OSError, ValueError):
+            pass
+
+
+async def token_balances(req: func.HttpRequest) -> func.HttpResponse:
+    if req.params.get("start") or req.params.get("end"):
+        dates, error = parse_date_range(req.params.get("start"), req.params.get("end"))
+        error = error or buffered_range_error(dates)
+        if error:
+            return func.HttpResponse(error, status_code=400)
+        try:
+            body = "".join([line async for line in iter_range_ndjson(dates)])
+            return func.HttpResponse(body, mimetype="application/x-ndjson")
+        except Exception as e:
+            return func.HttpResponse(f"Error: {str(e)}", status_code=500)
+
     date = req.params.get("date")
 
     if not date:
@@ -20,14 +158,111 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     if date and is_date_older_than_cutoff(date):
         return func.HttpResponse("'date' query parameter must be in YYYY-MM-DD format and newer than '2025-12-01.", status_code=400)
 
+    if req.params.get("wallets"):
+        wallets, error = parse_wallets(req.params.get("wallets"))
+        error = error or buffered_wallets_error(wallets)
+        if error:
+            return func.HttpResponse(error, status_code=400)
+        try:
+            body = "".join([line async for line in iter_wallets_ndjson(date, wallets)])
+            return func.HttpResponse(body, mimetype="application/x-ndjson")
+        except Exception as e:
+            return func.HttpResponse(f"Error: {str(e)}", status_code=500)
+
     try:
-        data = {}
-        data = get_all_balances_by_date(date)
-        
-        data["version"] = "v1.0"
+        # Closed days are immutable: serve them from the result cache
+        cached = get_result(date)
+        if cached:
+            if etag_matches(req.headers.get("If-None-Match"), cached["etag"]):
+                return func.HttpResponse(status_code=304, headers={"ETag": cached["etag"]})
+            data = dict(cached["data"])
+            etag = cached["etag"]
+        else:
+            # Imported on first use: keeps web3/moralis out of cold start
+            from balance_logic import get_all_balances_by_date_async
+
+            data = await get_all_balances_by_date_async(date)
+            etag = put_result(date, data)
+            data = dict(data)
+
+        data["version"] = RESULT_VERSION
         data["date"] = date
         data["now_pt"] = f"{get_datetime_str_now_pt()}"
-        return func.HttpResponse(json.dumps(data, indent=2), mimetype="application/json")
+        return func.HttpResponse(json.dumps(data, indent=2), mimetype="application/json", headers={"ETag": etag})
     except Exception as e:
         return func.HttpResponse(f"Error: {str(e)}", status_code=500)
 
+
+if StreamingResponse is not None:
+
+    @app.function_name(name="token_balances_stream")
+    @app.route(route="token_balances_stream", auth_level=func.AuthLevel.FUNCTION)
+    async def token_balances_stream(req: Request) -> StreamingResponse:
+        """
+        Streamed NDJSON: ?date=...&wallets=... sends a line per wallet, and
+        ?start=...&end=... a line per day, each as soon as it is done.
+        """
+        if req.query_params.get("wallets"):
+            date = req.query_params.get("date")
+            if not date or len(date) != 10 or is_date_older_than_cutoff(date):
+                return StreamingResponse(iter(["'date' query parameter must be in YYYY-MM-DD format and newer than '2025-12-01."]), status_code=400, media_type="text/plain")
+            wallets, error = parse_wallets(req.query_params.get("wallets"))
+            if error:
+                return StreamingResponse(iter([error]), status_code=400, media_type="text/plain")
+            return StreamingResponse(iter_wallets_ndjson(date, wallets), media_type="application/x-ndjson")
+
+        dates, error = parse_date_range(req.query_params.get("start"), req.query_params.get("end"))
+        if error:
+            return StreamingResponse(iter([error]), status_code=400, media_type="text/plain")
+        return StreamingResponse(iter_range_ndjson(dates), media_type="application/x-ndjson")
+
+
+# 08:10 UTC is just after midnight PT in both PST (00:10) and PDT (01:10).
+# NCRONTAB: {second} {minute} {hour} {day} {month} {day-of-week}
+@app.function_name(name="precompute_yesterday")
+@app.timer_trigger(schedule="0 10 8 * * *", arg_name="timer", run_on_startup=False, use_monitor=True)
+async def precompute_yesterday(timer: func.TimerRequest) -> None:
+    """
+    Computes yesterday's (PT) balances and supplies into the result cache
+    and prices into the price cache, so the day's requests are cache reads.
+    """
+    from precompute import precompute_day, previous_day_pt
+
+    summary = await precompute_day(previous_day_pt())
+    logging.info("precompute_yesterday: %s", json.dumps(summary))
+
+    try:
+        metrics.send_statsd()
+    except (OSError, ValueError):
+        pass
+
+
+# "admin" is a reserved route prefix on Functions, hence "metrics".
+# Needs the host master key.
+@app.function_name(name="metrics")
+@app.route(route="metrics", auth_level=func.AuthLevel.ADMIN)
+def metrics_route(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Provider call and cache counters for this worker since it started,
+    plus current cache memory use, per-provider rate limiter and circuit
+    breaker state and, once a routed chain has been used, per-endpoint
+    routing stats. ?format=prometheus for the Prometheus text format,
+    ?reset=true to zero the counters after reading them.
+    """
+    if req.params.get("format") == "prometheus":
+        response = func.HttpResponse(metrics.to_prometheus() + CACHES.to_prometheus(), mimetype="text/plain", headers={"Content-Type": "text/plain; version=0.0.4"})
+    else:
+        body = {**metrics.snapshot(), "memory": CACHES.stats()}
+        # Only loaded once used; importing them here would cost cold start
+        if "rate_limit" in sys.modules:
+            body["rate_limits"] = sys.modules["rate_limit"].snapshot()
+        if "resilience" in sys.modules:
+            body["breakers"] = sys.modules["resilience"].snapshot()
+        if "provider_router" in sys.modules:
+            body["routing"] = sys.modules["provider_router"].snapshot()
+        response = func.HttpResponse(json.dumps(body, indent=2), mimetype="application/json")
+
+    if req.params.get("reset") == "true":
+        metrics.reset()
+    return response
+
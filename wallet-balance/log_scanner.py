@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Deque, Dict, Iterator, List, Optional, Tuple
+
+from addresses import to_checksum_address
+from settings import get_log_scan_workers
+
+if TYPE_CHECKING:
+    from web3 import Web3
+
+# ============================================================
+# SHARDED LOG SCANNER
+# ============================================================
+#
+# A single eth_getLogs over a long history fails on providers that cap
+# the block range or the result count, and it runs serially. This engine
+# splits [from_block, to_block] into shards and fetches them on a bounded
+# thread pool. A shard rejected for being too large is halved and retried,
+# and later shards shrink to match. Logs are yielded in block order as
+# shards complete. Only `workers` shards are held at a time, so memory
+# stays flat regardless of history size.
+
+# Blocks per shard to start with. Providers commonly cap ranges at 5k-10k.
+DEFAULT_SHARD_SIZE: Dict[str, int] = {
+    "eth": 10_000,
+    "bsc": 5_000,
+}
+
+# Substrings of provider errors that mean "ask for a smaller range"
+RANGE_ERROR_MARKERS = (
+    "-32005",
+    "query returned more than",
+    "too many results",
+    "response size",
+    "block range",
+    "is limited to",
+    "range is too large",
+    "range too large",
+)
+
+
+def is_range_error(exc: Exception) -> bool:
+    message = str(exc).lower()
+    return any(marker in message for marker in RANGE_ERROR_MARKERS)
+
+
+def _split(start: int, end: int, size: int) -> List[Tuple[int, int]]:
+    return [
+        (shard_start, min(shard_start + size - 1, end))
+        for shard_start in range(start, end + 1, size)
+    ]
+
+
+def iter_logs(
+    w3: Web3,
+    filter_params: Dict,
+    from_block: int,
+    to_block: int,
+    chain: Optional[str] = None,
+    shard_size: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> Iterator[Dict]:
+    """
+    Yields every log matching filter_params ("address", "topics") in
+    [from_block, to_block], in block order.
+    """
+    if from_block > to_block:
+        return
+
+    size = shard_size or DEFAULT_SHARD_SIZE.get((chain or "").lower(), 5_000)
+    workers = workers or get_log_scan_workers()
+
+    def fetch(shard: Tuple[int, int]) -> List[Dict]:
+        return w3.eth.get_logs({
+            **filter_params,
+            "fromBlock": shard[0],
+            "toBlock": shard[1],
+        })
+
+    queued: Deque[Tuple[int, int]] = deque(_split(from_block, to_block, size))
+    in_flight: Deque = deque()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while queued or in_flight:
+            while queued and len(in_flight) < workers:
+                shard = queued.popleft()
+                in_flight.append((shard, executor.submit(fetch, shard)))
+
+            shard, future = in_flight.popleft()
+            try:
+                logs = future.result()
+            except Exception as e:
+                start, end = shard
+                if start == end or not is_range_error(e):
+                    raise
+
+                # Halve this shard; both halves go first to keep block order
+                mid = (start + end) // 2
+                in_flight.appendleft(((mid + 1, end), executor.submit(fetch, (mid + 1, end))))
+                in_flight.appendleft(((start, mid), executor.submit(fetch, (start, mid))))
+
+                # Later shards adopt the smaller size
+                size = max(1, min(size, mid - start + 1))
+                queued = deque(
+                    piece
+                    for q_start, q_end in queued
+                    for piece in _split(q_start, q_end, size)
+                )
+                continue
+
+            yield from logs
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ============================================================
+# TRANSFER EVENTS
+# ============================================================
+
+TRANSFER_EVENT_SIG = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+
+def _as_bytes(value) -> bytes:
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    return bytes(value)
+
+
+def decode_transfer_log(log: Dict) -> Dict:
+    """
+    {"block": int, "from": "0x..", "to": "0x..", "value": int}
+    Addresses are lowercase hex.
+    """
+    return {
+        "block": log["blockNumber"],
+        "from": "0x" + _as_bytes(log["topics"][1])[-20:].hex(),
+        "to": "0x" + _as_bytes(log["topics"][2])[-20:].hex(),
+        "value": int.from_bytes(_as_bytes(log["data"]), "big"),
+    }
+
+
+def iter_transfers(
+    w3: Web3,
+    chain: str,
+    token: str,
+    from_block: int,
+    to_block: int,
+    topics: Optional[List] = None,
+) -> Iterator[Dict]:
+    """
+    Streams decoded Transfer events for token.
+    topics defaults to every transfer; pass e.g. [sig, ZERO_TOPIC] for mints.
+    """
+    for log in iter_logs(
+        w3,
+        {
+            "address": to_checksum_address(token),
+            "topics": topics or [TRANSFER_EVENT_SIG],
+        },
+        from_block,
+        to_block,
+        chain=chain,
+    ):
+        yield decode_transfer_log(log)
@@ -0,0 +1,357 @@
+import json
+import logging
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+from settings import get_statsd_address
+
+# ============================================================
+# CALL + CACHE METRICS
+# ============================================================
+#
+# Process-wide counters, kept in memory for the life of the worker:
+#   calls:  outbound provider calls per (provider, chain, method), with
+#           error count and total/max latency. JSON-RPC batches count one
+#           call per method plus one HTTP round trip.
+#   caches: hits, misses, evictions and expirations per named cache.
+#   retries / fallbacks: transient-error retries per (provider, chain),
+#           and slower fallback paths taken per (call site, reason)
+#           (resilience.py).
+#
+# transport.py records every HTTP call automatically; SDK calls that do
+# not go through transport (Moralis) use timed_call(). Read with
+# snapshot(), or export with to_prometheus() / send_statsd().
+
+_LOCK = threading.Lock()
+
+# (provider, chain, method) -> {"count", "errors", "seconds", "max_seconds"}
+_CALLS: Dict[Tuple[str, str, str], Dict] = {}
+
+# (provider, chain) -> {"round_trips", "bytes_sent", "bytes_received"}
+_HTTP: Dict[Tuple[str, str], Dict] = {}
+
+# cache -> {"hits", "misses"}
+_CACHES: Dict[str, Dict] = {}
+
+# (provider, chain) -> retries
+_RETRIES: Dict[Tuple[str, str], int] = {}
+
+# (call site, reason) -> fallbacks taken
+_FALLBACKS: Dict[Tuple[str, str], int] = {}
+
+# URL prefix -> (provider, chain), for endpoints the heuristics can't label
+_ENDPOINTS: Dict[str, Tuple[str, str]] = {}
+
+_STARTED = time.time()
+
+KNOWN_PROVIDERS = ("quiknode", "alchemy", "moralis", "etherscan", "bscscan", "infura", "ankr")
+PROVIDER_ALIASES = {"quiknode": "quicknode"}
+KNOWN_CHAINS = {"eth": "eth", "ethereum": "eth", "bsc": "bsc", "bnb": "bsc", "bscscan": "bsc", "etherscan": "eth"}
+
+
+# ============================================================
+# ENDPOINT LABELS
+# ============================================================
+
+def register_endpoint(url: str, provider: str, chain: str) -> None:
+    """
+    Labels calls to url (and anything under it) explicitly.
+    """
+    with _LOCK:
+        _ENDPOINTS[url.rstrip("/").lower()] = (provider, chain)
+
+
+def describe_endpoint(url: str) -> Tuple[str, str]:
+    """
+    (provider, chain) for a URL: registered labels first, then guessed
+    from the host/path, e.g. eth-mainnet.quiknode.pro -> (quicknode, eth).
+    """
+    lowered = url.lower()
+    for prefix, labels in _ENDPOINTS.items():
+        if lowered.startswith(prefix):
+            return labels
+
+    parts = urlsplit(lowered)
+    words = re.split(r"[^a-z0-9]+", parts.netloc + parts.path)
+
+    provider = next((p for p in KNOWN_PROVIDERS if p in parts.netloc), parts.hostname or "unknown")
+    chain = next((KNOWN_CHAINS[w] for w in words if w in KNOWN_CHAINS), "unknown")
+    return PROVIDER_ALIASES.get(provider, provider), chain
+
+
+def rpc_methods(body) -> Iterable[str]:
+    """
+    JSON-RPC method names in a request body (single or batch).
+    Returns () when the body is not JSON-RPC.
+    """
+    if isinstance(body, (bytes, str)):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return ()
+    if isinstance(body, dict):
+        body = [body]
+    if not isinstance(body, list):
+        return ()
+    return [item["method"] for item in body if isinstance(item, dict) and "method" in item]
+
+
+# ============================================================
+# RECORDING
+# ============================================================
+
+def record_call(provider: str, chain: str, method: str, seconds: float, error: bool = False) -> None:
+    key = (provider, chain, method)
+    with _LOCK:
+        stats = _CALLS.get(key)
+        if stats is None:
+            stats = _CALLS[key] = {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0}
+        stats["count"] += 1
+        stats["errors"] += int(error)
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+
+def record_round_trip(provider: str, chain: str, bytes_sent: int, bytes_received: int) -> None:
+    key = (provider, chain)
+    with _LOCK:
+        stats = _HTTP.get(key)
+        if stats is None:
+            stats = _HTTP[key] = {"round_trips": 0, "bytes_sent": 0, "bytes_received": 0}
+        stats["round_trips"] += 1
+        stats["bytes_sent"] += bytes_sent
+        stats["bytes_received"] += bytes_received
+
+
+@contextmanager
+def timed_call(provider: str, chain: str, method: str):
+    """
+    Times a call that does not go through transport:
+
+        with timed_call("moralis", chain, "getTokenPrice"):
+            evm_api.token.get_token_price(...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record_call(provider, chain, method, time.perf_counter() - start, error=True)
+        raise
+    record_call(provider, chain, method, time.perf_counter() - start)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    with _LOCK:
+        stats = _CACHES.get(cache)
+        if stats is None:
+            stats = _CACHES[cache] = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        stats["hits" if hit else "misses"] += 1
+
+
+def record_cache_eviction(cache: str, reason: str = "evicted") -> None:
+    """
+    reason: "evicted" (size/budget bound) or "expired" (TTL).
+    """
+    with _LOCK:
+        stats = _CACHES.get(cache)
+        if stats is None:
+            stats = _CACHES[cache] = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        stats["expirations" if reason == "expired" else "evictions"] += 1
+
+
+def record_retry(provider: str, chain: str) -> None:
+    with _LOCK:
+        _RETRIES[(provider, chain)] = _RETRIES.get((provider, chain), 0) + 1
+
+
+def record_fallback(name: str, reason: str) -> None:
+    """
+    name: the call site that fell back, e.g. "quicknode_provider.get_block_by_date";
+    reason: why, usually the exception class.
+    """
+    with _LOCK:
+        _FALLBACKS[(name, reason)] = _FALLBACKS.get((name, reason), 0) + 1
+
+
+def cache_hit(cache: str) -> None:
+    record_cache(cache, True)
+
+
+def cache_miss(cache: str) -> None:
+    record_cache(cache, False)
+
+
+def reset() -> None:
+    global _STARTED
+    with _LOCK:
+        _CALLS.clear()
+        _HTTP.clear()
+        _CACHES.clear()
+        _RETRIES.clear()
+        _FALLBACKS.clear()
+        _STARTED = time.time()
+
+
+# ============================================================
+# EXPORT
+# ============================================================
+
+def snapshot() -> Dict:
+    """
+    JSON-friendly copy of all counters.
+    """
+    with _LOCK:
+        calls = [
+            {"provider": p, "chain": c, "method": m, **stats,
+             "avg_ms": round(stats["seconds"] * 1000 / stats["count"], 2)}
+            for (p, c, m), stats in sorted(_CALLS.items())
+        ]
+        http = [
+            {"provider": p, "chain": c, **stats}
+            for (p, c), stats in sorted(_HTTP.items())
+        ]
+        caches = {
+            name: {**stats, "hit_ratio": round(stats["hits"] / max(1, stats["hits"] + stats["misses"]), 4)}
+            for name, stats in sorted(_CACHES.items())
+        }
+        return {
+            "since": _STARTED,
+            "calls_total": sum(stats["count"] for stats in _CALLS.values()),
+            "calls": calls,
+            "http": http,
+            "caches": caches,
+            "retries": [
+                {"provider": p, "chain": c, "count": count}
+                for (p, c), count in sorted(_RETRIES.items())
+            ],
+            "fallbacks": [
+                {"name": n, "reason": r, "count": count}
+                for (n, r), count in sorted(_FALLBACKS.items())
+            ],
+        }
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def to_prometheus(prefix: str = "wallet_balance") -> str:
+    """
+    Prometheus text exposition format (version 0.0.4).
+    """
+    data = snapshot()
+    lines = []
+
+    def family(name: str, kind: str, help_text: str) -> str:
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        return f"{prefix}_{name}"
+
+    metric = family("provider_calls_total", "counter", "Outbound provider calls")
+    for c in data["calls"]:
+        lines.append(f"{metric}{_labels(provider=c['provider'], chain=c['chain'], method=c['method'])} {c['count']}")
+
+    metric = family("provider_call_errors_total", "counter", "Outbound provider calls that failed")
+    for c in data["calls"]:
+        lines.append(f"{metric}{_labels(provider=c['provider'], chain=c['chain'], method=c['method'])} {c['errors']}")
+
+    metric = family("provider_call_seconds_total", "counter", "Time spent in outbound provider calls")
+    for c in data["calls"]:
+        lines.append(f"{metric}{_labels(provider=c['provider'], chain=c['chain'], method=c['method'])} {c['seconds']:.6f}")
+
+    metric = family("http_round_trips_total", "counter", "HTTP requests sent to providers")
+    for h in data["http"]:
+        lines.append(f"{metric}{_labels(provider=h['provider'], chain=h['chain'])} {h['round_trips']}")
+
+    metric = family("http_bytes_sent_total", "counter", "Request bytes sent to providers")
+    for h in data["http"]:
+        lines.append(f"{metric}{_labels(provider=h['provider'], chain=h['chain'])} {h['bytes_sent']}")
+
+    metric = family("http_bytes_received_total", "counter", "Response bytes received from providers")
+    for h in data["http"]:
+        lines.append(f"{metric}{_labels(provider=h['provider'], chain=h['chain'])} {h['bytes_received']}")
+
+    metric = family("cache_requests_total", "counter", "Cache lookups by result")
+    for name, stats in data["caches"].items():
+        lines.append(f"{metric}{_labels(cache=name, result='hit')} {stats['hits']}")
+        lines.append(f"{metric}{_labels(cache=name, result='miss')} {stats['misses']}")
+
+    metric = family("cache_evictions_total", "counter", "Cache entries dropped by reason")
+    for name, stats in data["caches"].items():
+        lines.append(f"{metric}{_labels(cache=name, reason='evicted')} {stats['evictions']}")
+        lines.append(f"{metric}{_labels(cache=name, reason='expired')} {stats['expirations']}")
+
+    metric = family("provider_retries_total", "counter", "Provider calls retried after a transient error")
+    for r in data["retries"]:
+        lines.append(f"{metric}{_labels(provider=r['provider'], chain=r['chain'])} {r['count']}")
+
+    metric = family("fallbacks_total", "counter", "Slower fallback paths taken")
+    for f in data["fallbacks"]:
+        lines.append(f"{metric}{_labels(name=f['name'], reason=f['reason'])} {f['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def to_statsd(prefix: str = "wallet_balance") -> Iterable[str]:
+    """
+    statsd lines (gauges of the running totals, so re-sending is harmless).
+    """
+    data = snapshot()
+
+    def name(*parts) -> str:
+        return ".".join([prefix, *(re.sub(r"[^A-Za-z0-9_]", "_", str(p)) for p in parts)])
+
+    for c in data["calls"]:
+        base = ("calls", c["provider"], c["chain"], c["method"])
+        yield f"{name(*base, 'count')}:{c['count']}|g"
+        yield f"{name(*base, 'errors')}:{c['errors']}|g"
+        yield f"{name(*base, 'avg_ms')}:{c['avg_ms']}|g"
+    for h in data["http"]:
+        base = ("http", h["provider"], h["chain"])
+        yield f"{name(*base, 'round_trips')}:{h['round_trips']}|g"
+        yield f"{name(*base, 'bytes_sent')}:{h['bytes_sent']}|g"
+        yield f"{name(*base, 'bytes_received')}:{h['bytes_received']}|g"
+    for cache, stats in data["caches"].items():
+        yield f"{name('cache', cache, 'hits')}:{stats['hits']}|g"
+        yield f"{name('cache', cache, 'misses')}:{stats['misses']}|g"
+        yield f"{name('cache', cache, 'evictions')}:{stats['evictions']}|g"
+    for r in data["retries"]:
+        yield f"{name('retries', r['provider'], r['chain'])}:{r['count']}|g"
+    for f in data["fallbacks"]:
+        yield f"{name('fallbacks', f['name'], f['reason'])}:{f['count']}|g"
+
+
+def send_statsd(address: Optional[str] = None, prefix: str = "wallet_balance") -> int:
+    """
+    Sends the current totals to a statsd agent over UDP ("host:port",
+    default STATSD_ADDRESS). Returns the number of lines sent, 0 if no
+    agent is configured or the address isn't host:port.
+    """
+    address = address or get_statsd_address()
+    if not address:
+        return 0
+
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        logging.warning("Ignoring STATSD_ADDRESS %r: expected host:port", address)
+        return 0
+    port = int(port)
+    lines = list(to_statsd(prefix))
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        # Stay under a typical 1432-byte UDP payload per packet
+        packet = ""
+        for line in lines:
+            if packet and len(packet) + len(line) + 1 > 1432:
+                sock.sendto(packet.encode(), (host, port))
+                packet = ""
+            packet = f"{packet}\n{line}" if packet else line
+        if packet:
+            sock.sendto(packet.encode(), (host, port))
+
+    return len(lines)
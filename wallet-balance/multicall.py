@@ -0,0 +1,248 @@
+from typing import Dict, List, Optional, Tuple
+
+import token_registry
+from erc20_calls import decode_aggregate3, decode_uint, encode_aggregate3, rpc_url_of
+from provider_examples import decode_symbol_return, execute_eth_call_raw
+from settings import get_multicall_max_calls
+
+# ============================================================
+# MULTICALL3
+# ============================================================
+#
+# Multicall3 is deployed at the same address on every EVM chain.
+# aggregate3() runs a list of calls inside one eth_call, so every
+# balanceOf/decimals/symbol for a wallet costs a single round trip
+# at the target block. allowFailure=True keeps one bad token from
+# reverting the whole batch.
+#
+# Calldata is built and decoded by hand (erc20_calls) rather than through
+# a web3 contract: callers pass an RPC URL (or a Web3 instance), and this
+# module never imports web3 or eth_abi.
+
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+# First block where Multicall3 exists. Older blocks must use plain eth_calls.
+MULTICALL3_DEPLOY_BLOCK = {
+    "eth": 14353601,
+    "bsc": 15921452,
+}
+
+# Reference only: erc20_calls.encode_aggregate3/decode_aggregate3 implement it
+MULTICALL3_ABI = [
+    {
+        "name": "aggregate3",
+        "type": "function",
+        "stateMutability": "payable",
+        "inputs": [
+            {
+                "name": "calls",
+                "type": "tuple[]",
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"},
+                ],
+            }
+        ],
+        "outputs": [
+            {
+                "name": "returnData",
+                "type": "tuple[]",
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"},
+                ],
+            }
+        ],
+    }
+]
+
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")  # balanceOf(address)
+DECIMALS_SELECTOR = bytes.fromhex("313ce567")    # decimals()
+SYMBOL_SELECTOR = bytes.fromhex("95d89b41")      # symbol()
+
+
+def is_multicall_available(chain: str, block: int) -> bool:
+    """
+    True if Multicall3 is deployed on chain at the given block.
+    """
+    deploy_block = MULTICALL3_DEPLOY_BLOCK.get(chain.lower())
+    return deploy_block is not None and block >= deploy_block
+
+
+def aggregate3(
+    rpc,
+    calls: List[Tuple[str, bytes]],
+    block: int
+) -> List[Tuple[bool, bytes]]:
+    """
+    Executes (target, calldata) pairs in one eth_call at block.
+    Returns (success, return_data) per call, in call order.
+    rpc is an RPC URL or a Web3 instance.
+    """
+    raw = execute_eth_call_raw(
+        rpc_url=rpc_url_of(rpc),
+        to_address=MULTICALL3_ADDRESS,
+        data=encode_aggregate3(calls),
+        block=block,
+    )
+    if raw is None:
+        raise RuntimeError("aggregate3 returned no data")
+    return decode_aggregate3(raw)
+
+
+# ============================================================
+# DECODING
+# ============================================================
+
+def _decode_uint(success: bool, data: bytes) -> Optional[int]:
+    if not success:
+        return None
+    return decode_uint(data)
+
+
+def _decode_symbol(success: bool, data: bytes) -> Optional[str]:
+    if not success or not data:
+        return None
+
+    # Older tokens (MKR, SAI) return bytes32 instead of string
+    return decode_symbol_return(data)
+
+
+# ============================================================
+# ERC20 BALANCES
+# ============================================================
+#
+# Balances for many wallets are planned together: decimals()/symbol()
+# once per token (skipped for tokens already in the shared metadata
+# dict), then one balanceOf per (wallet, token), packed into as few
+# aggregate3 calls as fit under max_calls sub-calls each. A batch always
+# holds whole wallets so each wallet's balances can be emitted as soon
+# as its batch returns.
+
+def plan_wallet_batches(
+    wallets: List[str],
+    tokens: List[str],
+    metadata: Optional[Dict[str, Dict]] = None,
+    max_calls: Optional[int] = None
+) -> List[List[str]]:
+    """
+    Splits wallets into batches of at most max_calls sub-calls. The first
+    batch also carries the metadata calls for tokens not yet known.
+    """
+    max_calls = max_calls or get_multicall_max_calls()
+    metadata = metadata or {}
+
+    used = 2 * sum(1 for token in tokens if token.lower() not in metadata)
+    batches: List[List[str]] = [[]]
+    for wallet in wallets:
+        if batches[-1] and used + len(tokens) > max_calls:
+            batches.append([])
+            used = 0
+        batches[-1].append(wallet)
+        used += len(tokens)
+
+    return [batch for batch in batches if batch]
+
+
+def get_multicall_wallet_balances(
+    rpc,
+    chain: str,
+    wallets: List[str],
+    tokens: List[str],
+    block: int,
+    metadata: Optional[Dict[str, Dict]] = None
+) -> Optional[Dict[str, List[Dict]]]:
+    """
+    Returns {wallet: [balance dict per token]} in one aggregate3 call.
+    Use plan_wallet_batches() to size the wallet list. rpc is an RPC URL
+    or a Web3 instance.
+
+    Returns None when Multicall3 is not deployed at block, so callers
+    can fall back to per-token calls. A token whose calls fail comes
+    back as {"token_address": ..., "error": ...}.
+
+    metadata is an optional {token_lower: {"decimals", "symbol"}} dict
+    shared across calls (e.g. batches, or the days of a range): tokens
+    already in it only get balanceOf, and newly fetched metadata is
+    added to it. It is filled from, and written to, the token registry.
+    """
+    if not is_multicall_available(chain, block):
+        return None
+
+    if metadata is None:
+        metadata = {}
+
+    for token in tokens:
+        if token.lower() not in metadata:
+            registered = token_registry.get_metadata(chain, token)
+            if registered:
+                metadata[token.lower()] = {"decimals": registered["decimals"], "symbol": registered["symbol"]}
+
+    calls = []
+    meta_index = {}
+    for token in tokens:
+        if token.lower() not in metadata:
+            meta_index[token.lower()] = len(calls)
+            calls.append((token, DECIMALS_SELECTOR))
+            calls.append((token, SYMBOL_SELECTOR))
+
+    balance_start = len(calls)
+    for wallet in wallets:
+        wallet_arg = bytes.fromhex(wallet[2:]).rjust(32, b"\x00")
+        for token in tokens:
+            calls.append((token, BALANCE_OF_SELECTOR + wallet_arg))
+
+    results = aggregate3(rpc, calls, block)
+
+    fetched = []
+    for token in tokens:
+        index = meta_index.get(token.lower())
+        if index is None:
+            continue
+        decimals = _decode_uint(*results[index])
+        if decimals is not None:
+            metadata[token.lower()] = {"decimals": decimals, "symbol": _decode_symbol(*results[index + 1])}
+            fetched.append({"chain": chain, "token": token, **metadata[token.lower()]})
+
+    token_registry.put_many(fetched, source="multicall")
+
+    balances: Dict[str, List[Dict]] = {}
+    for w, wallet in enumerate(wallets):
+        wallet_balances = []
+        for t, token in enumerate(tokens):
+            balance = _decode_uint(*results[balance_start + w * len(tokens) + t])
+            meta = metadata.get(token.lower())
+
+            if balance is None or meta is None:
+                wallet_balances.append({
+                    "token_address": token,
+                    "error": "balanceOf/decimals call failed",
+                })
+                continue
+
+            wallet_balances.append({
+                "token_address": token,
+                "symbol": meta["symbol"],
+                "balance": balance / (10 ** meta["decimals"]),
+                "raw_balance": balance,
+                "decimals": meta["decimals"]
+            })
+        balances[wallet] = wallet_balances
+
+    return balances
+
+
+def get_multicall_token_balances(
+    rpc,
+    chain: str,
+    wallet: str,
+    tokens: List[str],
+    block: int,
+    metadata: Optional[Dict[str, Dict]] = None
+) -> Optional[List[Dict]]:
+    """
+    Single-wallet form of get_multicall_wallet_balances.
+    """
+    balances = get_multicall_wallet_balances(rpc, chain, [wallet], tokens, block, metadata)
+    return None if balances is None else balances[wallet]
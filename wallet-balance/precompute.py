@@ -0,0 +1,98 @@
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict
+
+from common import get_datetime_now_pt
+from result_cache import get_result, get_snapshot, has_errors, is_incomplete, put_result
+from settings import CHAIN_CONFIG, get_provider_concurrency
+
+# ============================================================
+# DAILY PRECOMPUTATION
+# ============================================================
+#
+# Nearly every token_balances request is for yesterday. The
+# precompute_yesterday timer (function_app.py) runs just after midnight
+# PT and computes that day ahead of the first request:
+#   1. blocks and balances for every configured chain (balance_logic),
+#      stored in the result cache, so the HTTP path is a pure read
+#   2. token total supplies at the day's blocks (quicknode_provider3),
+#      stored as the day's "supplies" snapshot in the result cache
+#   3. token prices for the day (Moralis), stored in the price cache
+# Each step runs even if an earlier one failed; failures are reported
+# in the summary and the next request computes that part as usual.
+#
+# Run it by hand for any closed day:
+#   python precompute.py [YYYY-MM-DD]
+
+
+def previous_day_pt() -> str:
+    return (get_datetime_now_pt().date() - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+async def _balances(date: str) -> Dict:
+    if get_result(date):
+        return {"status": "cached"}
+
+    # Imported on first use: keeps web3/moralis out of cold start
+    from balance_logic import get_all_balances_by_date_async
+
+    data = await get_all_balances_by_date_async(date)
+    put_result(date, data)
+    # Results with errors are not stored: the first request retries them
+    return {"status": "incomplete" if has_errors(data) else "stored", "chains": len(data)}
+
+
+def _supplies(date: str) -> Dict:
+    if get_snapshot(date, "supplies") is not None:
+        return {"status": "cached"}
+
+    # Stores the snapshot itself
+    from quicknode_provider3 import get_all_token_total_supply_at_date
+
+    supplies = get_all_token_total_supply_at_date(date)
+    return {"status": "incomplete" if is_incomplete(supplies) else "stored", "tokens": sum(map(len, supplies.values()))}
+
+
+def _prices(date: str) -> Dict:
+    from quicknode_provider3 import get_token_price_at_date_moralis
+
+    # Each price is read through, and so stored in, the price cache
+    pairs = [(chain.lower(), token) for chain, config in CHAIN_CONFIG.items() for token in config.get("tokens", [])]
+    with ThreadPoolExecutor(max_workers=get_provider_concurrency("moralis")) as pool:
+        results = list(pool.map(lambda pair: get_token_price_at_date_moralis(pair[0], pair[1], date), pairs))
+
+    missing = sum(price is None for price in results)
+    return {"status": "incomplete" if missing else "stored", "tokens": len(pairs), "missing": missing}
+
+
+async def precompute_day(date: str) -> Dict:
+    """
+    Computes and stores balances, supplies and prices for date.
+    Returns a summary per step ({"status": ..., "seconds": ...}); a
+    failed step has {"status": "error", "error": ...}.
+    """
+    summary = {"date": date}
+    steps = (
+        ("balances", lambda: _balances(date)),
+        ("supplies", lambda: asyncio.to_thread(_supplies, date)),
+        ("prices", lambda: asyncio.to_thread(_prices, date)),
+    )
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            summary[name] = await step()
+        except Exception as e:
+            summary[name] = {"status": "error", "error": str(e)}
+        summary[name]["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print("usage: precompute.py [YYYY-MM-DD]  (default: yesterday, PT)")
+        sys.exit(2)
+    print(json.dumps(asyncio.run(precompute_day(sys.argv[1] if len(sys.argv) == 2 else previous_day_pt())), indent=2))
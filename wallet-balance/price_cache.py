@@ -0,0 +1,262 @@
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import metrics
+import resilience
+from block_index import is_day_closed
+from cache_manager import CACHES
+from common import get_date_range
+from settings import get_moralis_api_key, get_provider_concurrency
+from storage import connect
+
+# ============================================================
+# PERSISTENT HISTORICAL PRICE CACHE
+# ============================================================
+#
+# A token's daily price never changes once the day has closed, so
+# Moralis prices are stored per (chain, token, date, vs_currency) and
+# read through by get_token_price_at_date_moralis in provider_examples
+# and quicknode_provider3. Prices for a day still in progress, and
+# lookups Moralis could not price, are not stored.
+#
+# Fill whole ranges ahead of valuation / market-cap runs with:
+#   python price_cache.py backfill <chain> <start> <end> [tokens.json | token ...]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_price (
+    chain       TEXT NOT NULL,
+    token       TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    vs_currency TEXT NOT NULL,
+    price       REAL NOT NULL,
+    source      TEXT,
+    PRIMARY KEY (chain, token, date, vs_currency)
+);
+"""
+
+# Moralis only prices in USD (usdPrice)
+SUPPORTED_CURRENCIES = ("usd",)
+
+# Moralis chain names; chains missing here can't be priced
+MORALIS_CHAIN_MAP = {
+    "eth": "eth",
+    "bsc": "bsc",
+}
+
+# In-memory front: (chain, token_lower, date, vs_currency) -> price.
+# Its hits/misses count as "price_cache.memory"; "price_cache" counts SQLite lookups.
+_MEMORY = CACHES.namespace("price_cache.memory", max_entries=100_000)
+
+
+def _db():
+    return connect("price_cache", SCHEMA)
+
+
+def _check_currency(vs_currency: str) -> None:
+    if vs_currency.lower() not in SUPPORTED_CURRENCIES:
+        raise ValueError(f"Unsupported vs_currency for Moralis: {vs_currency}")
+
+
+def _moralis_chain(chain: str) -> str:
+    moralis_chain = MORALIS_CHAIN_MAP.get(chain.lower())
+    if not moralis_chain:
+        raise ValueError(f"Unsupported chain for Moralis: {chain}")
+    return moralis_chain
+
+
+def _is_no_price(error: BaseException) -> bool:
+    """
+    Moralis answers 404 when it has no price for the token at the date
+    (no pool, no liquidity); anything else is a failed call.
+    """
+    status = getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 404
+
+
+def _key(chain: str, token: str, date: str, vs_currency: str) -> tuple:
+    return (chain.lower(), token.lower(), date, vs_currency.lower())
+
+
+def get_price(chain: str, token: str, date: str, vs_currency: str = "usd") -> Optional[float]:
+    """
+    Stored price, or None.
+    """
+    key = _key(chain, token, date, vs_currency)
+
+    cached = _MEMORY.get(key)
+    if cached is not None:
+        return cached
+
+    row = _db().execute(
+        "SELECT price FROM token_price WHERE chain = ? AND token = ? AND date = ? AND vs_currency = ?",
+        key,
+    ).fetchone()
+
+    metrics.record_cache("price_cache", row is not None)
+    if row is None:
+        return None
+
+    _MEMORY.set(key, row["price"])
+    return row["price"]
+
+
+def put_price(chain: str, token: str, date: str, vs_currency: str, price: Optional[float], source: Optional[str] = None) -> bool:
+    """
+    Stores a price for a closed day. Returns whether it was stored.
+    """
+    if price is None or not is_day_closed(date):
+        return False
+
+    key = _key(chain, token, date, vs_currency)
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO token_price (chain, token, date, vs_currency, price, source) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (*key, float(price), source),
+        )
+    _MEMORY.set(key, float(price))
+    return True
+
+
+def fetch_moralis_price(chain: str, token: str, date: str, vs_currency: str = "usd") -> Optional[float]:
+    """
+    Price from Moralis (indexed DEX pricing, date-based), or None if
+    Moralis has no price for it. Not cached; see get_token_price().
+    Raises ValueError for a vs_currency other than "usd" or a chain
+    Moralis doesn't serve, and the call's error if it fails (timeout,
+    open breaker, bad API key, ...).
+    """
+    _check_currency(vs_currency)
+    chain = chain.lower()
+    moralis_chain = _moralis_chain(chain)
+
+    from moralis import evm_api
+
+    try:
+        with metrics.timed_call("moralis", chain, "getTokenPrice"):
+            result = resilience.call(
+                "moralis", chain, evm_api.token.get_token_price,
+                api_key=get_moralis_api_key(),
+                params={
+                    "chain": moralis_chain,
+                    "address": token,
+                    "to_date": date,
+                    "exchange": "uniswapv2",  # optional but recommended
+                    "vs_currency": vs_currency,
+                },
+            )
+    except Exception as e:
+        if _is_no_price(e):
+            return None
+        raise
+
+    price = result.get("usdPrice")
+    return float(price) if price is not None else None
+
+
+def get_token_price(chain: str, token: str, date: str, vs_currency: str = "usd") -> Optional[float]:
+    """
+    Read-through price: the cache first, then Moralis (stored if the day
+    has closed). None when Moralis has no price or the call failed.
+    """
+    _check_currency(vs_currency)
+    _moralis_chain(chain)
+    cached = get_price(chain, token, date, vs_currency)
+    if cached is not None:
+        return cached
+
+    try:
+        price = fetch_moralis_price(chain, token, date, vs_currency)
+    except Exception:
+        # Nothing is stored: the next call asks Moralis again
+        return None
+    put_price(chain, token, date, vs_currency, price, source="moralis")
+    return price
+
+
+def export_prices(chain: Optional[str] = None) -> List[Dict]:
+    query = "SELECT chain, token, date, vs_currency, price, source FROM token_price"
+    params: tuple = ()
+    if chain:
+        query += " WHERE chain = ?"
+        params = (chain.lower(),)
+    query += " ORDER BY chain, token, date, vs_currency"
+
+    return [dict(row) for row in _db().execute(query, params)]
+
+
+# ============================================================
+# BULK BACKFILL
+# ============================================================
+
+def backfill(
+    chain: str,
+    tokens: List[str],
+    start: str,
+    end: str,
+    vs_currency: str = "usd",
+    workers: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Fetches and stores the price of every token for every closed day
+    from start to end that isn't stored yet, at most workers
+    (MAX_CONCURRENCY_MORALIS) Moralis calls at a time.
+    Returns {"stored", "missing" (Moralis had no price), "errors" (the
+    call failed, e.g. a provider outage), "skipped" (already stored)}.
+    """
+    _check_currency(vs_currency)
+    chain = chain.lower()
+    tokens = list(dict.fromkeys(token.lower() for token in tokens))
+    dates = [date for date in get_date_range(start, end) if is_day_closed(date)]
+
+    known = set()
+    for token in tokens:
+        rows = _db().execute(
+            "SELECT date FROM token_price WHERE chain = ? AND token = ? AND vs_currency = ? AND date BETWEEN ? AND ?",
+            (chain, token, vs_currency.lower(), start, end),
+        )
+        known.update((token, row["date"]) for row in rows)
+
+    todo = [(token, date) for token in tokens for date in dates if (token, date) not in known]
+
+    def fill(pair) -> str:
+        token, date = pair
+        try:
+            price = fetch_moralis_price(chain, token, date, vs_currency)
+        except Exception:
+            return "errors"
+        return "stored" if put_price(chain, token, date, vs_currency, price, source="backfill") else "missing"
+
+    summary = {"stored": 0, "missing": 0, "errors": 0, "skipped": len(known)}
+    with ThreadPoolExecutor(max_workers=workers or get_provider_concurrency("moralis")) as pool:
+        for outcome in pool.map(fill, todo):
+            summary[outcome] += 1
+    return summary
+
+
+# python price_cache.py backfill <chain> <start> <end> [tokens.json | token ...]
+# python price_cache.py export [chain] > prices.json
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == "backfill" and len(sys.argv) >= 5:
+        chain, start, end, args = sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:]
+        if len(args) == 1 and args[0].endswith(".json"):
+            with open(args[0]) as f:
+                tokens = json.load(f)
+        elif args:
+            tokens = args
+        else:
+            from settings import CHAIN_CONFIG
+            tokens = CHAIN_CONFIG.get(chain, {}).get("tokens", [])
+        print(json.dumps(backfill(chain, tokens, start, end)))
+    elif command == "export":
+        json.dump(export_prices(sys.argv[2] if len(sys.argv) > 2 else None), sys.stdout, indent=2)
+    else:
+        print("usage: price_cache.py backfill <chain> <start> <end> [tokens.json | token ...] | export [chain]")
+        sys.exit(2)
@@ -1,54 +1,65 @@
-from web3 import Web3
+import json
+
+import price_cache
+import token_registry
+from cache_manager import CACHES
+from settings import CHAIN_CONFIG
+from singleflight import coalesce
+from transport import post_json
 
 RPC_URL = "https://YOUR_NODE_ENDPOINT"  # QuickNode, Ankr, etc.
 TOKEN_ADDRESS = "0xYourTokenAddress"
 
-w3 = Web3(Web3.HTTPProvider(RPC_URL))
-assert w3.is_connected()
+# Everything that talks to a node lives in functions: importing this
+# module must not connect, assert or issue eth_calls.
 
-ERC20_ABI = [
-    {
-        "name": "totalSupply",
-        "type": "function",
-        "stateMutability": "view",
-        "inputs": [],
-        "outputs": [{"type": "uint256"}],
-    }
-]
-contract = w3.eth.contract(
-    address=Web3.to_checksum_address(TOKEN_ADDRESS),
-    abi=ERC20_ABI,
-)
+def example_usage_web3_total_supply():
+    from web3 import Web3
 
-total_supply = contract.functions.totalSupply().call()  # latest by default
-print(total_supply)
+    w3 = Web3(Web3.HTTPProvider(RPC_URL))
+    assert w3.is_connected()
 
+    ERC20_ABI = [
+        {
+            "name": "totalSupply",
+            "type": "function",
+            "stateMutability": "view",
+            "inputs": [],
+            "outputs": [{"type": "uint256"}],
+        }
+    ]
+    contract = w3.eth.contract(
+        address=Web3.to_checksum_address(TOKEN_ADDRESS),
+        abi=ERC20_ABI,
+    )
 
+    total_supply = contract.functions.totalSupply().call()  # latest by default
+    print(total_supply)
 
-# =========================== 
 
 
-import requests
-import json
+# =========================== 
 
-payload = {
-    "jsonrpc": "2.0",
-    "method": "eth_call",
-    "params": [
-        {
-            "to": TOKEN_ADDRESS,
-            "data": "0x18160ddd"  # totalSupply()
-        },
-        "latest"
-    ],
-    "id": 1
-}
 
-response = requests.post(RPC_URL, json=payload)
-result = response.json()["result"]
+def example_usage_raw_json_rpc_total_supply():
+    payload = {
+        "jsonrpc": "2.0",
+        "method": "eth_call",
+        "params": [
+            {
+                "to": TOKEN_ADDRESS,
+                "data": "0x18160ddd"  # totalSupply()
+            },
+            "latest"
+        ],
+        "id": 1
+    }
+
+    response = post_json(RPC_URL, payload)
+    result = response.json()["result"]
 
-total_supply = int(result, 16)
-print(total_supply)
+    total_supply = int(result, 16)
+    print(total_supply)
 
 
 
@@ -94,8 +105,6 @@ def build_json_rpc_payload(
     }
 
 
-import requests
-
 def execute_eth_call(
     rpc_url: str,
     to_address: str,
@@ -116,7 +125,7 @@ def execute_eth_call(
         params=params,
     )
 
-    response = requests.post(rpc_url, json=payload, timeout=30)
+    response = post_json(rpc_url, payload)
     response.raise_for_status()
 
     result = response.json()
@@ -144,28 +153,26 @@ def get_total_supply_raw(
         block=block,
     )
 
-# Example usage - latest
-
-RPC_URL = "https://YOUR_RPC_ENDPOINT"
-TOKEN_ADDRESS = "0xYourTokenAddress"
+# Example usage - latest and historical block
 
-supply = get_total_supply_raw(
-    rpc_url=RPC_URL,
-    token_address=TOKEN_ADDRESS,
-)
+def example_usage_total_supply_raw():
+    supply = get_total_supply_raw(
+        rpc_url=RPC_URL,
+        token_address=TOKEN_ADDRESS,
+    )
 
-print("Raw totalSupply:", supply)
+    print("Raw totalSupply:", supply)
 
-# Example historical block
-block_number = 19000000  # example
+    # Example historical block
+    block_number = 19000000  # example
 
-supply_at_block = get_total_supply_raw(
-    rpc_url=RPC_URL,
-    token_address=TOKEN_ADDRESS,
-    block=block_number,
-)
+    supply_at_block = get_total_supply_raw(
+        rpc_url=RPC_URL,
+        token_address=TOKEN_ADDRESS,
+        block=block_number,
+    )
 
-print("Raw totalSupply at block:", supply_at_block)
+    print("Raw totalSupply at block:", supply_at_block)
 
 # -----------------------------------
 # get decimal for token
@@ -176,22 +183,9 @@ DECIMALS_SELECTOR = "0x313ce567"  # keccak256("decimals()")[:4]
 TOTAL_SUPPLY_SELECTOR = "0x18160ddd"  # keccak256("totalSupply()")[:4]
 SYMBOL_SELECTOR   = "0x95d89b41"  # keccak256("symbol()")[:4]
 
-DECIMALS_CACHE: dict[str, int] = {}
-
-# DECIMALS_CACHE = {
-#     "eth": {
-#         "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48": {
-#             "decimals": 6,
-#             "symbol": "USDC",
-#         }
-#     },
-#     "bsc": {
-#         "0x55d398326f99059ff775485246999027b3197955": {
-#             "decimals": 18,
-#             "symbol": "USDT",
-#         }
-#     }
-# }
+# Immutable token metadata, never evicted:
+# (chain, token_lower) -> {"decimals": 6, "symbol": "USDC"}
+DECIMALS_CACHE = CACHES.namespace("decimals", pin=True)
 
 
 
@@ -221,26 +215,11 @@ def get_bsc_token_decimals(
 ) -> int | None:
     """
     Returns ERC-20 decimals for a BSC token.
-    Cached after first successful call.
+    Cached (with the symbol) after first successful call.
     """
 
-    token_address = token_address.lower()
-
-    if token_address in DECIMALS_CACHE:
-        return DECIMALS_CACHE[token_address]
-
-    value = execute_eth_call(
-        rpc_url=rpc_url,
-        to_address=token_address,
-        data=DECIMALS_SELECTOR,
-        block="latest",
-    )
-
-    if value is None:
-        return None
-
-    DECIMALS_CACHE[token_address] = value
-    return value
+    metadata = get_token_metadata(rpc_url, "bsc", token_address)
+    return metadata["decimals"] if metadata else None
 
 
 def get_bsc_tokens_decimals(
@@ -453,11 +432,10 @@ def get_token_metadata(
     chain = chain.lower()
     token_key = token_address.lower()
 
-    DECIMALS_CACHE.setdefault(chain, {})
-
     # Cache hit
-    if token_key in DECIMALS_CACHE[chain]:
-        return DECIMALS_CACHE[chain][token_key]
+    cached = DECIMALS_CACHE.get((chain, token_key))
+    if cached:
+        return cached
 
     # --- decimals ---
     decimals = execute_eth_call(
@@ -502,7 +480,7 @@ def get_token_metadata(
     }
 
     # Cache it (immutable metadata)
-    DECIMALS_CACHE[chain][token_key] = metadata
+    DECIMALS_CACHE.set((chain, token_key), metadata)
 
     return metadata
 
@@ -515,17 +493,13 @@ def get_bsc_tokens_metadata(
     Returns decimals + symbol for all BSC tokens.
     """
 
-    results = {}
     tokens = chain_config.get("bsc", {}).get("tokens", [])
 
-    for token in tokens:
-        results[token] = get_token_metadata(
-            rpc_url=rpc_url,
-            chain="bsc",
-            token_address=token,
-        )
-
-    return results
+    return get_tokens_metadata_batch(
+        rpc_url=rpc_url,
+        chain="bsc",
+        token_addresses=tokens,
+    )
 
 def get_eth_tokens_metadata(
     rpc_url: str,
@@ -535,17 +509,13 @@ def get_eth_tokens_metadata(
     Returns decimals + symbol for all ETH tokens.
     """
 
-    results = {}
     tokens = chain_config.get("eth", {}).get("tokens", [])
 
-    for token in tokens:
-        results[token] = get_token_metadata(
-            rpc_url=rpc_url,
-            chain="eth",
-            token_address=token,
-        )
-
-    return results
+    return get_tokens_metadata_batch(
+        rpc_url=rpc_url,
+        chain="eth",
+        token_addresses=tokens,
+    )
 
 
 
@@ -607,17 +577,25 @@ def get_chain_tokens_total_supply(
 
     chain = chain.lower()
 
-    results: dict[str, int | None] = {}
+    if chain not in rpc_urls:
+        raise ValueError(f"No RPC URL configured for chain '{chain}'")
 
     tokens = chain_config.get(chain, {}).get("tokens", [])
 
-    for token in tokens:
-        results[token] = get_token_total_supply(
-            chain=chain,
-            rpc_urls=rpc_urls,
-            token_address=token,
-            block=block,
-        )
+    # One JSON-RPC batch for the whole chain instead of one POST per token
+    responses = execute_eth_call_batch(
+        rpc_url=rpc_urls[chain],
+        calls=[
+            {"to": token, "data": TOTAL_SUPPLY_SELECTOR}
+            for token in tokens
+        ],
+        block=block,
+    )
+
+    results: dict[str, int | None] = {}
+
+    for token, response in zip(tokens, responses):
+        results[token] = decode_eth_call_uint(response)
 
     return results
 
@@ -831,7 +809,10 @@ def example_usage_market_cap():
 #-----------------
 # Moralis Price Helper
 
+MORALIS_CHAIN_MAP = price_cache.MORALIS_CHAIN_MAP
+
 
+@coalesce("provider_examples.get_token_price_at_date_moralis")
 def get_token_price_at_date_moralis(
     chain: str,
     token: str,
@@ -844,27 +825,9 @@ def get_token_price_at_date_moralis(
     NOTE:
     - Date-based, not block-exact
     - Uses Moralis indexed DEX pricing
+    - Read through the persistent price cache (price_cache.py)
     """
-    chain = chain.lower()
-    moralis_chain = MORALIS_CHAIN_MAP.get(chain)
-
-    if not moralis_chain:
-        raise ValueError(f"Unsupported chain for Moralis: {chain}")
-
-    try:
-        result = evm_api.token.get_token_price(
-            api_key=MORALIS_API_KEY,
-            params={
-                "chain": moralis_chain,
-                "address": token,
-                "to_date": date_str,
-                "exchange": "uniswapv2",  # optional but recommended
-                "vs_currency": vs_currency,
-            },
-        )
-        return float(result["usdPrice"])
-    except Exception:
-        return None
+    return price_cache.get_token_price(chain, token, date_str, vs_currency)
 
 
 #==============================================
@@ -883,8 +846,6 @@ def decode_bytes32_symbol(b32: bytes) -> str | None:
     return s or None
 
 
-import requests
-
 def execute_eth_call_raw(
     rpc_url: str,
     to_address: str,
@@ -902,7 +863,7 @@ def execute_eth_call_raw(
         params=params,
     )
 
-    response = requests.post(rpc_url, json=payload, timeout=30)
+    response = post_json(rpc_url, payload)
     response.raise_for_status()
 
     result = response.json()   # ✅ convert to dict
@@ -973,37 +934,265 @@ def decode_symbol_return(ret: bytes) -> str | None:
 DECIMALS_SELECTOR = "0x313ce567"
 SYMBOL_SELECTOR   = "0x95d89b41"
 
-DECIMALS_CACHE: dict[str, dict[str, dict]] = {"eth": {}, "bsc": {}}
-
 def get_token_metadata(
     rpc_url: str,
     chain: str,
     token_address: str,
 ) -> dict | None:
-    chain = chain.lower()
-    token_key = token_address.lower()
-    DECIMALS_CACHE.setdefault(chain, {})
+    return get_tokens_metadata_batch(
+        rpc_url=rpc_url,
+        chain=chain,
+        token_addresses=[token_address],
+    )[token_address]
 
-    if token_key in DECIMALS_CACHE[chain]:
-        return DECIMALS_CACHE[chain][token_key]
 
-    decimals = execute_eth_call_uint(
+@coalesce("provider_examples.get_tokens_metadata_batch")
+def get_tokens_metadata_batch(
+    rpc_url: str,
+    chain: str,
+    token_addresses: list[str],
+) -> dict[str, dict | None]:
+    """
+    Returns decimals + symbol for many tokens.
+    Served from memory, then the persistent token registry; the rest are
+    fetched together (decimals() and symbol() for every token in a single
+    JSON-RPC batch) and registered.
+    """
+    chain = chain.lower()
+
+    known: dict[str, dict] = {}
+    missing = []
+    for token in dict.fromkeys(token_addresses):
+        meta = DECIMALS_CACHE.get((chain, token.lower()))
+        if meta is None:
+            registered = token_registry.get_metadata(chain, token)
+            if registered:
+                meta = {"decimals": registered["decimals"], "symbol": registered["symbol"]}
+                DECIMALS_CACHE.set((chain, token.lower()), meta)
+        if meta is None:
+            missing.append(token)
+        else:
+            known[token.lower()] = meta
+
+    calls = []
+    for token in missing:
+        calls.append({"to": token, "data": DECIMALS_SELECTOR})
+        calls.append({"to": token, "data": SYMBOL_SELECTOR})
+
+    responses = execute_eth_call_batch(
         rpc_url=rpc_url,
-        to_address=token_address,
-        data=DECIMALS_SELECTOR,
+        calls=calls,
         block="latest",
     )
-    if decimals is None:
-        return None
 
-    sym_bytes = execute_eth_call_raw(
+    fetched: dict[str, dict | None] = {}
+    for n, token in enumerate(missing):
+        decimals = decode_eth_call_uint(responses[2 * n])
+        if decimals is None:
+            fetched[token.lower()] = None
+            continue
+
+        symbol = decode_symbol_return(responses[2 * n + 1]["result"])
+
+        meta = {"decimals": decimals, "symbol": symbol}
+        DECIMALS_CACHE.set((chain, token.lower()), meta)
+        fetched[token.lower()] = meta
+
+    token_registry.put_many(
+        ({"chain": chain, "token": token, **meta} for token, meta in fetched.items() if meta),
+        source="rpc",
+    )
+
+    results: dict[str, dict | None] = {}
+    for token in token_addresses:
+        token_key = token.lower()
+        if token_key in fetched:
+            results[token] = fetched[token_key]
+        else:
+            results[token] = known[token_key]
+
+    return results
+
+
+#==============================================
+# JSON-RPC batch transport
+#
+# Providers accept a JSON array of requests in one POST and answer with
+# an array of responses (in any order, correlated by "id"). Batching N
+# eth_calls this way costs one round trip per batch instead of one per call.
+
+# Most providers cap batch length (QuickNode/Alchemy: 100-1000) and body size.
+DEFAULT_BATCH_MAX_ITEMS = 100
+DEFAULT_BATCH_MAX_BYTES = 512 * 1024
+
+
+def build_json_rpc_batch_payload(
+    calls: list[tuple[str, list]],
+    start_id: int = 1,
+) -> list[dict]:
+    """
+    Builds a JSON-RPC batch from (method, params) pairs.
+    Request ids are sequential starting at start_id.
+    """
+    return [
+        build_json_rpc_payload(
+            method=method,
+            params=params,
+            request_id=start_id + n,
+        )
+        for n, (method, params) in enumerate(calls)
+    ]
+
+
+def split_json_rpc_batch(
+    payloads: list[dict],
+    max_items: int = DEFAULT_BATCH_MAX_ITEMS,
+    max_bytes: int = DEFAULT_BATCH_MAX_BYTES,
+) -> list[list[dict]]:
+    """
+    Splits a batch into chunks that respect the provider's item and
+    body-size limits. A single oversized request still gets its own chunk.
+    """
+    chunks: list[list[dict]] = []
+    current: list[dict] = []
+    current_bytes = 2  # "[" + "]"
+
+    for payload in payloads:
+        size = len(json.dumps(payload, separators=(",", ":"))) + 1
+        if current and (
+            len(current) >= max_items
+            or current_bytes + size > max_bytes
+        ):
+            chunks.append(current)
+            current, current_bytes = [], 2
+
+        current.append(payload)
+        current_bytes += size
+
+    if current:
+        chunks.append(current)
+
+    return chunks
+
+
+def _post_json_rpc_batch(
+    rpc_url: str,
+    chunk: list[dict],
+    timeout: float | None,
+) -> dict[int, dict]:
+    """
+    POSTs one batch chunk and returns responses keyed by request id.
+    Chunks rejected as too large (HTTP 413) are halved and retried.
+    """
+    response = post_json(rpc_url, chunk, timeout=timeout)
+
+    if response.status_code == 413 and len(chunk) > 1:
+        half = len(chunk) // 2
+        results = _post_json_rpc_batch(rpc_url, chunk[:half], timeout)
+        results.update(_post_json_rpc_batch(rpc_url, chunk[half:], timeout))
+        return results
+
+    response.raise_for_status()
+    body = response.json()
+
+    # Some providers answer a rejected batch with a single error object
+    if isinstance(body, dict):
+        error = body.get("error") or {"code": -32603, "message": "Invalid batch response"}
+        return {payload["id"]: {"error": error} for payload in chunk}
+
+    return {item["id"]: item for item in body if "id" in item}
+
+
+def execute_json_rpc_batch(
+    rpc_url: str,
+    payloads: list[dict],
+    max_items: int = DEFAULT_BATCH_MAX_ITEMS,
+    max_bytes: int = DEFAULT_BATCH_MAX_BYTES,
+    timeout: float | None = None,
+) -> list[dict]:
+    """
+    Sends JSON-RPC payloads as batched POSTs (timeout defaults to
+    HTTP_TIMEOUT).
+
+    Returns one response object per payload, in payload order.
+    Each has either "result" or "error"; a failing item never fails
+    the rest of the batch.
+    """
+    by_id: dict[int, dict] = {}
+
+    for chunk in split_json_rpc_batch(payloads, max_items, max_bytes):
+        by_id.update(_post_json_rpc_batch(rpc_url, chunk, timeout))
+
+    return [
+        by_id.get(
+            payload["id"],
+            {"error": {"code": -32603, "message": "Missing response in batch"}},
+        )
+        for payload in payloads
+    ]
+
+
+def execute_eth_call_batch(
+    rpc_url: str,
+    calls: list[dict],
+    block: str | int = "latest",
+    max_items: int = DEFAULT_BATCH_MAX_ITEMS,
+    max_bytes: int = DEFAULT_BATCH_MAX_BYTES,
+) -> list[dict]:
+    """
+    Executes many eth_calls in as few round trips as possible.
+
+    calls: [{"to": "0x...", "data": "0x...", "block": optional override}, ...]
+
+    Returns a list aligned with calls:
+    [
+        {"result": b"...", "error": None},   # raw return data (None for "0x")
+        {"result": None, "error": {...}},    # per-call JSON-RPC error
+    ]
+    """
+    if not calls:
+        return []
+
+    payloads = build_json_rpc_batch_payload([
+        (
+            "eth_call",
+            build_eth_call_params(
+                to_address=call["to"],
+                data=call["data"],
+                block=call.get("block", block),
+            ),
+        )
+        for call in calls
+    ])
+
+    responses = execute_json_rpc_batch(
         rpc_url=rpc_url,
-        to_address=token_address,
-        data=SYMBOL_SELECTOR,
-        block="latest",
+        payloads=payloads,
+        max_items=max_items,
+        max_bytes=max_bytes,
     )
-    symbol = decode_symbol_return(sym_bytes)
 
-    meta = {"decimals": decimals, "symbol": symbol}
-    DECIMALS_CACHE[chain][token_key] = meta
-    return meta
+    results = []
+    for response in responses:
+        if "error" in response:
+            results.append({"result": None, "error": response["error"]})
+            continue
+
+        raw_hex = response.get("result")
+        results.append({
+            "result": None if raw_hex in (None, "0x") else bytes.fromhex(raw_hex[2:]),
+            "error": None,
+        })
+
+    return results
+
+
+def decode_eth_call_uint(response: dict) -> int | None:
+    """
+    Decodes a uint return value from an execute_eth_call_batch item.
+    Errors and empty return data decode to None.
+    """
+    raw = response["result"]
+    if response["error"] is not None or not raw:
+        return None
+    return int.from_bytes(raw, "big", signed=False)
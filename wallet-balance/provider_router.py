@@ -0,0 +1,345 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, List, Optional
+
+import requests
+
+import metrics
+import resilience
+import transport
+from settings import PROVIDERS, get_hedge_percentile, get_http_timeout, get_moralis_api_key, get_rpc_endpoints
+
+# ============================================================
+# MULTI-PROVIDER ROUTING
+# ============================================================
+#
+# A chain with RPC_ENDPOINTS_<CHAIN> set (e.g.
+# "alchemy=https://...,quicknode=https://...,moralis") can send block
+# resolution and JSON-RPC calls to any of its endpoints:
+#   - every endpoint keeps EWMAs of latency and error rate; calls go to
+#     the fastest healthy one (endpoints with no samples yet first)
+#   - if that call hasn't answered by its HEDGE_PERCENTILE latency, a
+#     duplicate goes to the next best endpoint and the first answer wins
+#   - a failed call (exception, 429, 5xx) fails over to the next one
+#
+# JSON-RPC reaches the router through transport: use route://<chain> as
+# the RPC URL (PROVIDERS[chain] = {"provider": "routed"} does this for
+# balance_logic). Provider-specific methods (alchemy_*, qn_*) only go to
+# that provider; Moralis only serves block resolution.
+
+ROUTE_SCHEME = "route://"
+
+EWMA_ALPHA = 0.2
+
+# error EWMA above which an endpoint is skipped while a healthier one exists
+UNHEALTHY_ERROR_RATE = 0.5
+
+# Latency samples kept per endpoint for the hedge percentile
+LATENCY_WINDOW = 200
+
+# Hedge never fires sooner than this, nor later than this with no samples
+MIN_HEDGE_DELAY = 0.05
+DEFAULT_HEDGE_DELAY = 1.0
+
+# Providers whose timestamp -> block call this module knows
+BLOCK_PROVIDERS = ("moralis", "alchemy", "quicknode")
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="provider-router")
+
+
+class RetryableResponse(Exception):
+    """
+    HTTP response that should fail over to another endpoint (429 / 5xx).
+    """
+
+    def __init__(self, response: requests.Response):
+        super().__init__(f"HTTP {response.status_code} from {response.url}")
+        self.response = response
+
+
+class Endpoint:
+    def __init__(self, chain: str, provider: str, url: Optional[str]):
+        self.chain = chain
+        self.provider = provider
+        self.url = url
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.hedges = 0
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.chain}"
+
+    def record(self, seconds: float, error: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.errors += int(error)
+            self.error_ewma += EWMA_ALPHA * (float(error) - self.error_ewma)
+            if not error:
+                self._latencies.append(seconds)
+                if self.latency_ewma is None:
+                    self.latency_ewma = seconds
+                else:
+                    self.latency_ewma += EWMA_ALPHA * (seconds - self.latency_ewma)
+
+    def healthy(self) -> bool:
+        return self.error_ewma < UNHEALTHY_ERROR_RATE
+
+    def score(self) -> float:
+        """
+        Lower is better. Unsampled endpoints score 0 so each gets tried.
+        """
+        if self.latency_ewma is None:
+            return 0.0
+        return self.latency_ewma * (1 + self.error_ewma)
+
+    def hedge_delay(self, percentile: float) -> float:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return DEFAULT_HEDGE_DELAY
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return max(MIN_HEDGE_DELAY, samples[index])
+
+    def stats(self) -> Dict:
+        return {
+            "provider": self.provider,
+            "chain": self.chain,
+            "latency_ewma_ms": None if self.latency_ewma is None else round(self.latency_ewma * 1000, 2),
+            "error_ewma": round(self.error_ewma, 4),
+            "healthy": self.healthy(),
+            "calls": self.calls,
+            "errors": self.errors,
+            "hedges": self.hedges,
+        }
+
+
+class ChainRouter:
+    """
+    Endpoints of one chain, ranked by latency/error EWMAs.
+    """
+
+    def __init__(self, chain: str, endpoints: List[Endpoint]):
+        self.chain = chain
+        self.endpoints = endpoints
+
+    def ranked(self, providers=None) -> List[Endpoint]:
+        """
+        Candidates best first: healthy endpoints by score, then the rest.
+        """
+        candidates = [e for e in self.endpoints if providers is None or e.provider in providers]
+        return sorted(candidates, key=lambda e: (not e.healthy(), e.score()))
+
+    def call(self, attempt: Callable[[Endpoint], object], providers=None):
+        """
+        Runs attempt(endpoint) on the best endpoint, hedging to the next one
+        after the first one's percentile latency and failing over on errors.
+        Returns the first successful result; raises the last error if all fail.
+        """
+        candidates = self.ranked(providers)
+        if not candidates:
+            raise RuntimeError(f"No endpoint for {self.chain} serves {providers}")
+
+        percentile = get_hedge_percentile()
+        pending: Dict[Future, Endpoint] = {}
+        next_index = 0
+        hedge_at = 0.0
+        last_error: Optional[BaseException] = None
+
+        def launch() -> None:
+            nonlocal next_index, hedge_at
+            endpoint = candidates[next_index]
+            next_index += 1
+            pending[_EXECUTOR.submit(_timed, endpoint, attempt)] = endpoint
+            if percentile:
+                hedge_at = time.monotonic() + endpoint.hedge_delay(percentile)
+
+        launch()
+        while pending:
+            timeout = None
+            if percentile and next_index < len(candidates):
+                timeout = max(0.0, hedge_at - time.monotonic())
+
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Latest call is past its percentile latency: hedge
+                candidates[next_index - 1].hedges += 1
+                launch()
+                continue
+
+            for future in done:
+                pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    last_error = e
+                    # Fail over right away
+                    if next_index < len(candidates):
+                        launch()
+
+        raise last_error
+
+    def stats(self) -> List[Dict]:
+        return [endpoint.stats() for endpoint in self.ranked()]
+
+
+def _timed(endpoint: Endpoint, attempt: Callable[[Endpoint], object]):
+    start = time.perf_counter()
+    try:
+        result = attempt(endpoint)
+    except Exception:
+        endpoint.record(time.perf_counter() - start, error=True)
+        raise
+    endpoint.record(time.perf_counter() - start, error=False)
+    return result
+
+
+# ============================================================
+# ROUTERS
+# ============================================================
+
+_ROUTERS: Dict[str, ChainRouter] = {}
+_LOCK = threading.Lock()
+
+
+def get_router(chain: str) -> Optional[ChainRouter]:
+    """
+    Router for chain, or None when it has no RPC_ENDPOINTS_<CHAIN>.
+    """
+    chain = chain.lower()
+    router = _ROUTERS.get(chain)
+    if router is not None:
+        return router
+
+    with _LOCK:
+        router = _ROUTERS.get(chain)
+        if router is None:
+            endpoints = [Endpoint(chain, provider, url) for provider, url in get_rpc_endpoints(chain)]
+            if not endpoints:
+                return None
+            for endpoint in endpoints:
+                if endpoint.url:
+                    metrics.register_endpoint(endpoint.url, endpoint.provider, chain)
+            router = _ROUTERS[chain] = ChainRouter(chain, endpoints)
+    return router
+
+
+def is_routed(chain: str) -> bool:
+    return get_router(chain) is not None
+
+
+def route_url(chain: str) -> str:
+    return f"{ROUTE_SCHEME}{chain.lower()}"
+
+
+def snapshot() -> Dict[str, List[Dict]]:
+    return {chain: router.stats() for chain, router in sorted(_ROUTERS.items())}
+
+
+# ============================================================
+# JSON-RPC
+# ============================================================
+
+def _rpc_providers(router: ChainRouter, payload) -> tuple:
+    """
+    Providers that can serve payload: any with a URL, or only the
+    provider that owns a provider-specific method.
+    """
+    methods = metrics.rpc_methods(payload)
+    if any(m.startswith("alchemy_") for m in methods):
+        return ("alchemy",)
+    if any(m.startswith("qn_") for m in methods):
+        return ("quicknode",)
+    return tuple(endpoint.provider for endpoint in router.endpoints if endpoint.url)
+
+
+def post_json(url: str, payload, timeout: Optional[float] = None) -> requests.Response:
+    """
+    transport.post_json for route://<chain> URLs.
+    """
+    router = get_router(url[len(ROUTE_SCHEME):])
+    if router is None:
+        raise ValueError(f"No RPC_ENDPOINTS configured for {url}")
+
+    def attempt(endpoint: Endpoint) -> requests.Response:
+        # A 429 fails over to the next endpoint instead of waiting here
+        with resilience.no_retry():
+            response = transport.get_session(endpoint.url).post(
+                endpoint.url, json=payload, timeout=timeout or get_http_timeout()
+            )
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableResponse(response)
+        return response
+
+    return router.call(attempt, providers=_rpc_providers(router, payload))
+
+
+# ============================================================
+# BLOCK RESOLUTION
+# ============================================================
+
+def _rpc(endpoint: Endpoint, method: str, params: list):
+    payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+    with resilience.no_retry():
+        response = transport.post_json(endpoint.url, payload)
+    if response.status_code == 429 or response.status_code >= 500:
+        raise RetryableResponse(response)
+    response.raise_for_status()
+    body = response.json()
+    if "error" in body:
+        raise RuntimeError(f"{endpoint.name}: {body['error']}")
+    return body["result"]
+
+
+def _block_from_endpoint(endpoint: Endpoint, date_str: str) -> int:
+    """
+    First block at or after the start of date_str (UTC). Every provider
+    must answer with the same block: whichever answers first is stored
+    in the block index for good.
+    """
+    ts = int(datetime.fromisoformat(date_str).replace(tzinfo=timezone.utc).timestamp())
+
+    if endpoint.provider == "moralis":
+        from moralis import evm_api
+
+        # dateToBlock returns the first block after the date
+        with metrics.timed_call("moralis", endpoint.chain, "getDateToBlock"), resilience.no_retry():
+            result = resilience.call(
+                "moralis", endpoint.chain, evm_api.block.get_date_to_block,
+                api_key=get_moralis_api_key(),
+                params={
+                    "chain": PROVIDERS.get(endpoint.chain, {}).get("moralis_chain", endpoint.chain),
+                    "date": f"{date_str}T00:00:00Z",
+                },
+            )
+        return int(result["block"])
+
+    if endpoint.provider == "quicknode":
+        return int(_rpc(endpoint, "qn_getBlockByTimestamp", [ts, "after"])["blockNumber"], 16)
+
+    # Alchemy answers with the last block at or before ts: step to the
+    # next one unless it is exactly at ts
+    result = _rpc(endpoint, "alchemy_getBlockByTimestamp", [hex(ts), "latest"])
+    block = int(result["number"], 16)
+    block_ts = result.get("timestamp")
+    if block_ts is None:
+        block_ts = _rpc(endpoint, "eth_getBlockByNumber", [hex(block), False])["timestamp"]
+    return block if int(block_ts, 16) >= ts else block + 1
+
+
+def get_block_by_date(chain: str, date_str: str) -> int:
+    """
+    First block of date_str (UTC) from whichever endpoint answers first.
+    """
+    router = get_router(chain)
+    if router is None:
+        raise ValueError(f"No RPC_ENDPOINTS configured for {chain}")
+    return router.call(lambda endpoint: _block_from_endpoint(endpoint, date_str), providers=BLOCK_PROVIDERS)
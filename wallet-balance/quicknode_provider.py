@@ -1,9 +1,21 @@
-from web3 import Web3
-import requests
-from datetime import datetime
-from typing import Optional, List, Dict
+from __future__ import annotations
 
-from settings import CHAIN_CONFIG, QUICKNODE_PROVIDER, BLOCK_HISTORY
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Optional, List, Dict, Union
+
+from settings import CHAIN_CONFIG, QUICKNODE_PROVIDER, get_chain_wallets
+import block_index
+import resilience
+from addresses import to_checksum_address
+from block_search import find_first_block_at_or_after
+from erc20_calls import read_token_balance
+from multicall import get_multicall_wallet_balances, plan_wallet_batches
+from singleflight import coalesce
+import transport
+
+# web3 is only loaded by transport.get_web3, on first use
+if TYPE_CHECKING:
+    from web3 import Web3
 
 
 QN_ERC20_ABI = [
@@ -50,24 +62,26 @@ def qn_get_block_by_timestamp2(chain: str, timestamp: int) -> Optional[int]:
         "apikey": explorer["api_key"]
     }
 
-    resp = requests.get(url, params=params).json()
+    resp = transport.get(url, params=params).json()
     if resp.get("status") == "1":
         return int(resp["result"])
     return None
 
 
+@coalesce("quicknode_provider.get_block_by_date", key=lambda chain, date_str: (chain.lower(), date_str))
 def get_block_by_date(chain: str, date_str: str) -> int:
     """
     Resolve block for a given chain + date.
 
     Resolution order:
-    1. In-memory BLOCK_HISTORY
-    2. QuickNode timestamp API
-    3. Binary search fallback
+    1. Persistent block index
+    2. QuickNode timestamp API (any RPC_ENDPOINTS_<CHAIN> endpoint when
+       the chain is routed, see provider_router.py)
+    3. Interpolation search fallback
     """
-    # --- 1️⃣ In-memory lookup ---
+    # --- 1️⃣ Block index lookup ---
     date_key = normalize_date(date_str)
-    cached = BLOCK_HISTORY.get(chain, {}).get(date_key)
+    cached = block_index.get_block(chain, date_key)
     if cached and cached > 0:
         return cached
 
@@ -77,82 +91,91 @@ def get_block_by_date(chain: str, date_str: str) -> int:
     )
     target_ts = int(dt.timestamp())
 
+    import provider_router
+
     try:
+        if provider_router.is_routed(chain):
+            # The router already fails over between endpoints
+            block = provider_router.get_block_by_date(chain, date_key)
+            return block_index.record_block(chain, date_key, block, source="routed")
+
         block = get_block_by_timestamp_quicknode(
             chain=chain,
             timestamp=target_ts,
             after=True,
         )
-        return block
-    except Exception:
-        pass  # fallback
+        return block_index.record_block(chain, date_key, block, source="quicknode")
+    except Exception as e:
+        resilience.record_fallback("quicknode_provider.get_block_by_date", e)
 
-    # --- 3️⃣ Binary search fallback ---
+    # --- 3️⃣ Interpolation search fallback ---
     w3 = get_web3(chain)
+    block = find_first_block_at_or_after(w3, chain, target_ts)
+    return block_index.record_block(chain, date_key, block, source="interpolation_search")
 
-    latest = w3.eth.block_number
-    low, high = 0, latest
-
-    while low <= high:
-        mid = (low + high) // 2
-        block = w3.eth.get_block(mid)
-        ts = block["timestamp"]
-
-        if ts < target_ts:
-            low = mid + 1
-        elif ts > target_ts:
-            high = mid - 1
-        else:
-            return mid
 
-    return high
-
-
-def qn_get_token_balance(w3: Web3, token: str, wallet: str, block: int) -> Optional[Dict]:
+def qn_get_token_balance(rpc, token: str, wallet: str, block: int, chain: Optional[str] = None) -> Optional[Dict]:
+    """
+    rpc is an RPC URL or a Web3 instance. Raw eth_calls (erc20_calls):
+    balanceOf, plus decimals/symbol unless chain's registry knows them.
+    """
     try:
-        contract = w3.eth.contract(address=Web3.to_checksum_address(token), abi=QN_ERC20_ABI)
-        balance = contract.functions.balanceOf(wallet).call(block_identifier=block)
-        decimals = contract.functions.decimals().call()
-        symbol = contract.functions.symbol().call()
-        return {
-            "token_address": token,
-            "symbol": symbol,
-            "balance": balance / (10 ** decimals),
-            "raw_balance": balance,
-            "decimals": decimals
-        }
+        return read_token_balance(rpc, chain, token, wallet, block)
     except Exception as e:
         print(f"❌ Error fetching {token} for {wallet}: {e}")
         return None
 
 
-def qn_get_all_balances_by_date(date_str: str) -> Dict[str, List[Dict]]:
+def qn_get_all_balances_by_date(date_str: str) -> Dict[str, Union[List[Dict], Dict[str, List[Dict]]]]:
+    """
+    {chain: [balances]} for one wallet per chain, or
+    {chain: {wallet: [balances]}} when a chain lists several "wallets".
+    """
     results = {}
-    target_ts = int(datetime.strptime(date_str, "%Y-%m-%d").timestamp())
 
     for chain in CHAIN_CONFIG:
         print(f"\n🔍 Checking {chain.upper()}...")
 
         rpc_url = QUICKNODE_PROVIDER[chain]["rpc_url"]
-        wallet = Web3.to_checksum_address(CHAIN_CONFIG[chain]["wallet"])
+        wallets = [to_checksum_address(w) for w in get_chain_wallets(CHAIN_CONFIG[chain])]
         tokens = CHAIN_CONFIG[chain]["tokens"]
 
-        block = qn_get_block_by_timestamp(chain, target_ts)
-        if block is None:
-            print(f"❌ Could not resolve block for {date_str} on {chain}")
+        try:
+            block = get_block_by_date(chain, date_str)
+        except Exception as e:
+            print(f"❌ Could not resolve block for {date_str} on {chain}: {e}")
             results[chain] = []
             continue
 
         print(f"📦 Block: {block}")
-        w3 = Web3(Web3.HTTPProvider(rpc_url))
-
-        balances = []
-        for token in tokens:
-            result = qn_get_token_balance(w3, token, wallet, block)
-            if result:
-                balances.append(result)
 
-        results[chain] = balances
+        by_wallet = {}
+        metadata = {}
+        for batch in plan_wallet_batches(wallets, tokens, metadata):
+            try:
+                multicall_balances = get_multicall_wallet_balances(rpc_url, chain, batch, tokens, block, metadata)
+            except Exception as e:
+                # One failed aggregate3 call shouldn't sink the batch: read it token by token
+                print(f"❌ Multicall failed on {chain}, falling back to per-token calls: {e}")
+                resilience.record_fallback("quicknode_provider.qn_get_all_balances_by_date", e)
+                multicall_balances = None
+
+            for wallet in batch:
+                balances = []
+                if multicall_balances is not None:
+                    for result in multicall_balances[wallet]:
+                        if "error" in result:
+                            print(f"❌ Error fetching {result['token_address']} for {wallet}: {result['error']}")
+                            continue
+                        balances.append(result)
+                else:
+                    for token in tokens:
+                        result = qn_get_token_balance(rpc_url, token, wallet, block, chain)
+                        if result:
+                            balances.append(result)
+                by_wallet[wallet] = balances
+
+        results[chain] = next(iter(by_wallet.values())) if len(by_wallet) == 1 else by_wallet
 
     return results
 
@@ -166,7 +189,7 @@ _PROVIDERS = {}
 def get_contract(chain: str, token_address: str):
     w3 = get_web3(chain)
     return w3.eth.contract(
-        address=Web3.to_checksum_address(token_address),
+        address=to_checksum_address(token_address),
         abi=QN_ERC20_ABI,
     )
 
@@ -188,16 +211,16 @@ def get_balance_at_block(
 ) -> int:
     contract = get_contract(chain, token_address)
     return contract.functions.balanceOf(
-        Web3.to_checksum_address(wallet)
+        to_checksum_address(wallet)
     ).call(block_identifier=block)
 
 
 def get_web3(chain: str) -> Web3:
     if chain not in _PROVIDERS :
-        rpc = QUICKNODE_PROVIDER.get(chain)
+        rpc = QUICKNODE_PROVIDER.get(chain, {}).get("rpc_url")
         if not rpc:
             raise ValueError(f"No RPC configured for chain: {chain}")
-        w3 = Web3(Web3.HTTPProvider(rpc))
+        w3 = transport.get_web3(rpc)
         if not w3.is_connected():
             raise RuntimeError(f"Failed to connect to QuickNode for {chain}")
         _PROVIDERS[chain] = w3
@@ -216,10 +239,10 @@ def normalize_date(date_str: str) -> str:
 
 def get_block_from_history(chain: str, date_str: str) -> int:
     """
-    Returns block from BLOCK_HISTORY or 0 if missing
+    Returns block from the block index or 0 if missing
     """
     date_key = normalize_date(date_str)
-    return BLOCK_HISTORY.get(chain, {}).get(date_key, 0)
+    return block_index.get_block(chain, date_key) or 0
 
 
 # -------------------------------
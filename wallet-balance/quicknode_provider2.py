@@ -1,6 +1,20 @@
-from web3 import Web3
+from __future__ import annotations
+
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import block_index
+import resilience
+import supply_index
+from addresses import to_checksum_address
+from cache_manager import CACHES
+from block_search import find_first_block_at_or_after
+from singleflight import coalesce
+import transport
+
+# web3 is only loaded by transport.get_web3, on first use
+if TYPE_CHECKING:
+    from web3 import Web3
 
 # ============================================================
 # CONFIG (inline to keep this file self-contained)
@@ -20,34 +34,14 @@ CHAIN_CONFIG = {
     }
 }
 
-BLOCK_HISTORY = {
-    "bsc": {
-        "2026-01-01": 1111111,
-        "2026-01-02": 1111112,
-    },
-    "eth": {
-        "2026-01-01": 546111,
-        "2026-01-02": 547111,
-    }
-}
-
 # ------------------------------------------------------------
-# Token contract cache (per chain)
+# Token contract cache: (chain, checksum token) -> contract
+# e.g. eth USDC 0xA0b86991c6218b36c1d19d4a2e9eb0ce3606eb48,
+#      eth DAI 0x6B175474E89094C44Da98b954EedeAC495271d0F,
+#      bsc BUSD 0xe9e7cea3dedca5984780bafc599bd69add087d56,
+#      bsc USDT 0x55d398326f99059fF775485246999027B3197955
 # ------------------------------------------------------------
-TOKEN_CONTRACT = {
-    "eth": {
-        # USDC
-        "0xA0b86991c6218b36c1d19d4a2e9eb0ce3606eb48": None,
-        # DAI
-        "0x6B175474E89094C44Da98b954EedeAC495271d0F": None,
-    },
-    "bsc": {
-        # BUSD
-        "0xe9e7cea3dedca5984780bafc599bd69add087d56": None,
-        # USDT
-        "0x55d398326f99059fF775485246999027B3197955": None,
-    }
-}
+TOKEN_CONTRACT = CACHES.namespace("qp2.token_contract", max_entries=2048)
 
 
 
@@ -81,9 +75,8 @@ ERC20_ABI = [
     },
 ]
 
-TRANSFER_EVENT_SIG = Web3.keccak(
-    text="Transfer(address,address,uint256)"
-).hex()
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_EVENT_SIG = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
 
 # ============================================================
 # WEB3 PROVIDER CACHE
@@ -96,7 +89,7 @@ def get_web3(chain: str) -> Web3:
         rpc = QUICKNODE_RPC.get(chain)
         if not rpc:
             raise ValueError(f"No RPC configured for chain {chain}")
-        w3 = Web3(Web3.HTTPProvider(rpc))
+        w3 = transport.get_web3(rpc)
         if not w3.is_connected():
             raise RuntimeError(f"Failed to connect to QuickNode for {chain}")
         _PROVIDERS[chain] = w3
@@ -108,10 +101,10 @@ def get_contract(chain: str, token: str):
     Creates and caches it on first use.
     """
     chain = chain.lower()
-    token = Web3.to_checksum_address(token)
+    token = to_checksum_address(token)
 
     # --- Return cached contract if present ---
-    cached = TOKEN_CONTRACT.get(chain, {}).get(token)
+    cached = TOKEN_CONTRACT.get((chain, token))
     if cached:
         return cached
 
@@ -123,7 +116,7 @@ def get_contract(chain: str, token: str):
     )
 
     # --- Cache and return ---
-    TOKEN_CONTRACT.setdefault(chain, {})[token] = contract
+    TOKEN_CONTRACT.set((chain, token), contract)
     return contract
 
 
@@ -155,16 +148,17 @@ def get_block_by_timestamp_quicknode(
 
     return int(resp["result"]["blockNumber"], 16)
 
+@coalesce("quicknode_provider2.get_block_by_date", key=lambda chain, date_str: (chain.lower(), date_str))
 def get_block_by_date(chain: str, date_str: str) -> int:
     """
     Resolution order:
-    1. In-memory BLOCK_HISTORY
+    1. Persistent block index
     2. QuickNode timestamp API
-    3. Binary search fallback
+    3. Interpolation search fallback
     """
     date_key = normalize_date(date_str)
 
-    cached = BLOCK_HISTORY.get(chain, {}).get(date_key)
+    cached = block_index.get_block(chain, date_key)
     if cached:
         return cached
 
@@ -176,26 +170,14 @@ def get_block_by_date(chain: str, date_str: str) -> int:
 
     try:
         block = get_block_by_timestamp_quicknode(chain, ts, after=True)
-        BLOCK_HISTORY.setdefault(chain, {})[date_key] = block
-        return block
-    except Exception:
-        pass
+        return block_index.record_block(chain, date_key, block, source="quicknode")
+    except Exception as e:
+        resilience.record_fallback("quicknode_provider2.get_block_by_date", e)
 
-    # --- fallback binary search ---
+    # --- fallback interpolation search ---
     w3 = get_web3(chain)
-    low, high = 0, w3.eth.block_number
-
-    while low <= high:
-        mid = (low + high) // 2
-        ts_mid = w3.eth.get_block(mid)["timestamp"]
-        if ts_mid < ts:
-            low = mid + 1
-        elif ts_mid > ts:
-            high = mid - 1
-        else:
-            return mid
-
-    return high
+    block = find_first_block_at_or_after(w3, chain, ts)
+    return block_index.record_block(chain, date_key, block, source="interpolation_search")
 
 # ============================================================
 # TOTAL SUPPLY (PRIMARY + RECONSTRUCTION)
@@ -213,7 +195,8 @@ def get_total_supply_at_date(
         return contract.functions.totalSupply().call(
             block_identifier=block
         )
-    except Exception:
+    except Exception as e:
+        resilience.record_fallback("quicknode_provider2.get_total_supply_at_date", e)
         return reconstruct_total_supply(chain, token, block)
 
 def reconstruct_total_supply(
@@ -223,28 +206,9 @@ def reconstruct_total_supply(
 ) -> int:
     """
     Mint/Burn reconstruction (fallback only).
+    Only scans blocks after the token's stored checkpoint.
     """
-    w3 = get_web3(chain)
-
-    logs = w3.eth.get_logs({
-        "fromBlock": 0,
-        "toBlock": to_block,
-        "address": Web3.to_checksum_address(token),
-        "topics": [TRANSFER_EVENT_SIG],
-    })
-
-    supply = 0
-    for log in logs:
-        from_addr = "0x" + log["topics"][1].hex()[-40:]
-        to_addr = "0x" + log["topics"][2].hex()[-40:]
-        value = int(log["data"], 16)
-
-        if from_addr.lower() == ZERO_ADDRESS:
-            supply += value
-        elif to_addr.lower() == ZERO_ADDRESS:
-            supply -= value
-
-    return supply
+    return supply_index.reconstruct_total_supply(get_web3(chain), chain, token, to_block)
 
 # ============================================================
 # WALLET BALANCE AT DATE
@@ -260,7 +224,7 @@ def get_wallet_token_balance_at_date(
     contract = get_contract(chain, token)
 
     return contract.functions.balanceOf(
-        Web3.to_checksum_address(wallet)
+        to_checksum_address(wallet)
     ).call(block_identifier=block)
 
 def get_wallet_total_balance_at_date(
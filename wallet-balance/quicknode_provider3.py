@@ -1,6 +1,24 @@
-from web3 import Web3
+from __future__ import annotations
+
 from datetime import datetime, timezone
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, Optional
+
+import block_index
+import price_cache
+import resilience
+import result_cache
+from addresses import to_checksum_address
+import token_registry
+from cache_manager import CACHES
+from settings import CHAIN_CONFIG
+import supply_index
+from block_search import find_first_block_at_or_after, get_block_timestamp
+from singleflight import coalesce
+import transport
+
+# web3 is only loaded by transport.get_web3, on first use
+if TYPE_CHECKING:
+    from web3 import Web3
 
 # ============================================================
 # CONFIG
@@ -11,11 +29,6 @@ QUICKNODE_RPC = {
     "bsc": "https://YOUR-BSC-ENDPOINT.quiknode.pro/YOUR_KEY/",
 }
 
-BLOCK_HISTORY = {
-    "eth": {},
-    "bsc": {},
-}
-
 ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 
 # ============================================================
@@ -23,20 +36,16 @@ ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 # ============================================================
 
 # Contract interface cache
-TOKEN_CONTRACT: Dict[str, Dict[str, object]] = {
-    "eth": {},
-    "bsc": {},
-}
+# (chain, token) -> contract
+TOKEN_CONTRACT = CACHES.namespace("qp3.token_contract", max_entries=2048)
 
-# Immutable metadata cache (once per token)
-TOKEN_IMMUTABLE_CACHE: Dict[str, Dict[str, Dict]] = {
-    "eth": {},
-    "bsc": {},
-}
+# Immutable metadata cache (once per token, never evicted)
+# (chain, token) -> metadata
+TOKEN_IMMUTABLE_CACHE = CACHES.namespace("qp3.token_immutable", pin=True)
 
 # Mutable snapshot cache (block-aware)
 # (chain, token, block) -> snapshot
-TOKEN_SNAPSHOT_CACHE: Dict[tuple, Dict] = {}
+TOKEN_SNAPSHOT_CACHE = CACHES.namespace("qp3.token_snapshot", max_entries=10_000)
 
 # Web3 provider cache
 _PROVIDERS: Dict[str, Web3] = {}
@@ -86,14 +95,11 @@ ERC20_IMMUTABLE_ABI = [
     },
 ]
 
-TRANSFER_EVENT_SIG = Web3.keccak(
-    text="Transfer(address,address,uint256)"
-).hex()
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_EVENT_SIG = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
 
-# EIP-1967 implementation slot
-EIP1967_IMPL_SLOT = Web3.to_hex(
-    int(Web3.keccak(text="eip1967.proxy.implementation").hex(), 16) - 1
-)
+# EIP-1967 implementation slot: keccak256("eip1967.proxy.implementation") - 1
+EIP1967_IMPL_SLOT = "0x360894a13ba1a3210667c828492db98dca3e2076cc3735a920a3ca505d382bbc"
 
 # ============================================================
 # WEB3 / CONTRACT HELPERS
@@ -105,7 +111,7 @@ def get_web3(chain: str) -> Web3:
         rpc = QUICKNODE_RPC.get(chain)
         if not rpc:
             raise ValueError(f"No RPC configured for {chain}")
-        w3 = Web3(Web3.HTTPProvider(rpc))
+        w3 = transport.get_web3(rpc)
         if not w3.is_connected():
             raise RuntimeError(f"Failed to connect to QuickNode ({chain})")
         _PROVIDERS[chain] = w3
@@ -117,9 +123,9 @@ def get_contract(chain: str, token: str):
     Cached ERC20 contract interface (ABI + address only)
     """
     chain = chain.lower()
-    token = Web3.to_checksum_address(token)
+    token = to_checksum_address(token)
 
-    cached = TOKEN_CONTRACT.get(chain, {}).get(token)
+    cached = TOKEN_CONTRACT.get((chain, token))
     if cached:
         return cached
 
@@ -128,7 +134,7 @@ def get_contract(chain: str, token: str):
         abi=ERC20_ABI,
     )
 
-    TOKEN_CONTRACT.setdefault(chain, {})[token] = contract
+    TOKEN_CONTRACT.set((chain, token), contract)
     return contract
 
 # ============================================================
@@ -161,11 +167,12 @@ def get_block_by_timestamp_quicknode(
     return int(resp["result"]["blockNumber"], 16)
 
 
+@coalesce("quicknode_provider3.get_block_by_date", key=lambda chain, date_str: (chain.lower(), date_str))
 def get_block_by_date(chain: str, date_str: str) -> int:
     chain = chain.lower()
     date_key = normalize_date(date_str)
 
-    cached = BLOCK_HISTORY.get(chain, {}).get(date_key)
+    cached = block_index.get_block(chain, date_key)
     if cached:
         return cached
 
@@ -177,39 +184,41 @@ def get_block_by_date(chain: str, date_str: str) -> int:
 
     try:
         block = get_block_by_timestamp_quicknode(chain, ts, after=True)
-        BLOCK_HISTORY.setdefault(chain, {})[date_key] = block
-        return block
-    except Exception:
-        pass
+        return block_index.record_block(chain, date_key, block, source="quicknode")
+    except Exception as e:
+        resilience.record_fallback("quicknode_provider3.get_block_by_date", e)
 
-    # Binary search fallback (last resort)
+    # Interpolation search fallback (last resort)
     w3 = get_web3(chain)
-    low, high = 0, w3.eth.block_number
-
-    while low <= high:
-        mid = (low + high) // 2
-        mid_ts = w3.eth.get_block(mid)["timestamp"]
-        if mid_ts < ts:
-            low = mid + 1
-        elif mid_ts > ts:
-            high = mid - 1
-        else:
-            return mid
-
-    return high
+    block = find_first_block_at_or_after(w3, chain, ts)
+    return block_index.record_block(chain, date_key, block, source="interpolation_search")
 
 # ============================================================
 # IMMUTABLE METADATA (CACHE ONCE)
 # ============================================================
 
+@coalesce("quicknode_provider3.get_immutable_token_metadata", key=lambda chain, token: (chain.lower(), token.lower()))
 def get_immutable_token_metadata(chain: str, token: str) -> Dict:
     chain = chain.lower()
-    token = Web3.to_checksum_address(token)
+    token = to_checksum_address(token)
 
-    cached = TOKEN_IMMUTABLE_CACHE.get(chain, {}).get(token)
+    cached = TOKEN_IMMUTABLE_CACHE.get((chain, token))
     if cached:
         return cached
 
+    # name is NULL when another module registered the token without it
+    registered = token_registry.get_metadata(chain, token)
+    if registered and registered["name"] is not None:
+        meta = {
+            "chain": chain,
+            "token": token,
+            "decimals": registered["decimals"],
+            "symbol": registered["symbol"],
+            "name": registered["name"] or None,
+        }
+        TOKEN_IMMUTABLE_CACHE.set((chain, token), meta)
+        return meta
+
     w3 = get_web3(chain)
     contract = w3.eth.contract(
         address=token,
@@ -230,7 +239,10 @@ def get_immutable_token_metadata(chain: str, token: str) -> Dict:
         "name": safe_call(contract.functions.name().call),
     }
 
-    TOKEN_IMMUTABLE_CACHE.setdefault(chain, {})[token] = meta
+    TOKEN_IMMUTABLE_CACHE.set((chain, token), meta)
+    token_registry.put_metadata(
+        chain, token, meta["decimals"], meta["symbol"], meta["name"] or "", source="quicknode"
+    )
     return meta
 
 # ============================================================
@@ -239,18 +251,18 @@ def get_immutable_token_metadata(chain: str, token: str) -> Dict:
 
 def detect_proxy(chain: str, token: str) -> Dict:
     w3 = get_web3(chain)
-    token = Web3.to_checksum_address(token)
+    token = to_checksum_address(token)
 
     try:
         raw = w3.eth.get_storage_at(token, EIP1967_IMPL_SLOT)
-        impl = Web3.to_checksum_address(raw[-20:].hex())
+        impl = to_checksum_address("0x" + bytes(raw[-20:]).hex())
         if int(impl, 16) != 0:
             return {
                 "is_proxy": True,
                 "implementation": impl,
             }
-    except Exception:
-        pass
+    except Exception as e:
+        resilience.record_fallback("quicknode_provider3.detect_proxy", e)
 
     return {
         "is_proxy": False,
@@ -262,46 +274,34 @@ def detect_proxy(chain: str, token: str) -> Dict:
 # ============================================================
 
 def reconstruct_total_supply(chain: str, token: str, to_block: int) -> int:
-    w3 = get_web3(chain)
-    token = Web3.to_checksum_address(token)
-
-    logs = w3.eth.get_logs({
-        "fromBlock": 0,
-        "toBlock": to_block,
-        "address": token,
-        "topics": [TRANSFER_EVENT_SIG],
-    })
-
-    supply = 0
-    for log in logs:
-        from_addr = "0x" + log["topics"][1].hex()[-40:]
-        to_addr = "0x" + log["topics"][2].hex()[-40:]
-        value = int(log["data"], 16)
-
-        if from_addr.lower() == ZERO_ADDRESS:
-            supply += value
-        elif to_addr.lower() == ZERO_ADDRESS:
-            supply -= value
-
-    return supply
+    """
+    Mint/Burn reconstruction from the checkpointed supply index.
+    Only scans blocks after the token's stored checkpoint.
+    """
+    return supply_index.reconstruct_total_supply(get_web3(chain), chain, token, to_block)
 
 # ============================================================
 # MUTABLE SNAPSHOT METADATA (BLOCK-AWARE)
 # ============================================================
 
+@coalesce(
+    "quicknode_provider3.snapshot_token_mutable_metadata",
+    key=lambda chain, token, date_str: (chain.lower(), token.lower(), date_str),
+)
 def snapshot_token_mutable_metadata(
     chain: str,
     token: str,
     date_str: str
 ) -> Dict:
     chain = chain.lower()
-    token = Web3.to_checksum_address(token)
+    token = to_checksum_address(token)
 
     block = get_block_by_date(chain, date_str)
     cache_key = (chain, token, block)
 
-    if cache_key in TOKEN_SNAPSHOT_CACHE:
-        return TOKEN_SNAPSHOT_CACHE[cache_key]
+    cached = TOKEN_SNAPSHOT_CACHE.get(cache_key)
+    if cached:
+        return cached
 
     w3 = get_web3(chain)
     contract = get_contract(chain, token)
@@ -310,7 +310,8 @@ def snapshot_token_mutable_metadata(
         total_supply = contract.functions.totalSupply().call(
             block_identifier=block
         )
-    except Exception:
+    except Exception as e:
+        resilience.record_fallback("quicknode_provider3.snapshot_token_mutable_metadata", e)
         total_supply = reconstruct_total_supply(chain, token, block)
 
     proxy_info = detect_proxy(chain, token)
@@ -320,13 +321,13 @@ def snapshot_token_mutable_metadata(
         "token": token,
         "date": normalize_date(date_str),
         "block": block,
-        "timestamp": w3.eth.get_block(block)["timestamp"],
+        "timestamp": get_block_timestamp(w3, chain, block),
         "total_supply": total_supply,
         "is_proxy": proxy_info["is_proxy"],
         "implementation": proxy_info["implementation"],
     }
 
-    TOKEN_SNAPSHOT_CACHE[cache_key] = snapshot
+    TOKEN_SNAPSHOT_CACHE.set(cache_key, snapshot)
     return snapshot
 
 # ============================================================
@@ -370,7 +371,8 @@ def get_token_total_supply_at_date(
         return contract.functions.totalSupply().call(
             block_identifier=block
         )
-    except Exception:
+    except Exception as e:
+        resilience.record_fallback("quicknode_provider3.get_token_total_supply_at_date", e)
         return reconstruct_total_supply(chain, token, block)
 
 
@@ -388,7 +390,7 @@ def get_token_balance_at_date(
     contract = get_contract(chain, token)
 
     return contract.functions.balanceOf(
-        Web3.to_checksum_address(wallet)
+        to_checksum_address(wallet)
     ).call(block_identifier=block)
 
 def get_token_balance_human_at_date(
@@ -430,7 +432,14 @@ def get_all_token_total_supply_at_date(date_str: str) -> dict:
             "0xToken2BSC": 999999,
         }
     }
+
+    Closed days are read from (and stored as) the "supplies" daily
+    snapshot in the result cache.
     """
+    cached = result_cache.get_snapshot(date_str, "supplies")
+    if cached is not None:
+        return cached
+
     results = {}
 
     for chain, cfg in CHAIN_CONFIG.items():
@@ -445,6 +454,7 @@ def get_all_token_total_supply_at_date(date_str: str) -> dict:
             )
             results[chain][token] = supply
 
+    result_cache.put_snapshot(date_str, "supplies", results)
     return results
 
 # ================================================================
@@ -514,19 +524,14 @@ def get_all_token_prices_at_date(date_str: str) -> dict:
 
 # ======================================================
 # Moralis pricing helper
-MORALIS_CHAIN_MAP = {
-    "eth": "eth",
-    "bsc": "bsc",
-}
-
-from datetime import datetime, timezone
+MORALIS_CHAIN_MAP = price_cache.MORALIS_CHAIN_MAP
 
 def block_to_utc_date(chain: str, block: int) -> str:
     """
     Converts block number to YYYY-MM-DD (UTC)
     """
     w3 = get_web3(chain)
-    ts = w3.eth.get_block(block)["timestamp"]
+    ts = get_block_timestamp(w3, chain, block)
 
     return datetime.fromtimestamp(
         ts, tz=timezone.utc
@@ -588,6 +593,7 @@ def get_all_token_prices_normalized_to_block(
 
     return results
 
+@coalesce("quicknode_provider3.get_token_price_at_date_moralis")
 def get_token_price_at_date_moralis(
     chain: str,
     token: str,
@@ -600,24 +606,6 @@ def get_token_price_at_date_moralis(
     NOTE:
     - Date-based, not block-exact
     - Uses Moralis indexed DEX pricing
+    - Read through the persistent price cache (price_cache.py)
     """
-    chain = chain.lower()
-    moralis_chain = MORALIS_CHAIN_MAP.get(chain)
-
-    if not moralis_chain:
-        raise ValueError(f"Unsupported chain for Moralis: {chain}")
-
-    try:
-        result = evm_api.token.get_token_price(
-            api_key=MORALIS_API_KEY,
-            params={
-                "chain": moralis_chain,
-                "address": token,
-                "to_date": date_str,
-                "exchange": "uniswapv2",  # optional but recommended
-                "vs_currency": vs_currency,
-            },
-        )
-        return float(result["usdPrice"])
-    except Exception:
-        return None
+    return price_cache.get_token_price(chain, token, date_str, vs_currency)
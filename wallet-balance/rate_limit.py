@@ -0,0 +1,252 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from settings import get_http_pool_maxsize, get_provider_concurrency, get_provider_rate_limit, get_rate_limit_retries
+
+# ============================================================
+# ADAPTIVE RATE LIMITING
+# ============================================================
+#
+# One limiter per provider (QuickNode, Moralis, Alchemy, ...), shared by
+# every thread; the async engine's calls run on worker threads
+# (asyncio.to_thread) and so share it too. Each limiter has:
+#   - a token bucket: at most RATE_LIMIT_<PROVIDER> calls per second
+#     (unset: no bucket)
+#   - an AIMD concurrency window: starts at MAX_CONCURRENCY_<PROVIDER>,
+#     grows by ~1 per window of successful calls up to HTTP_POOL_MAXSIZE,
+#     and halves on a 429 or a timeout (once per window: the other
+#     calls of the same window don't halve it again)
+# A 429 is retried (RATE_LIMIT_RETRIES times) after the provider's
+# Retry-After, or a jittered backoff; meanwhile the whole provider is
+# paused so other threads don't pile on. Timeouts only shrink the window.
+#
+# transport wraps every HTTP call in its provider's limiter; SDK calls
+# (Moralis) go through call().
+
+AIMD_BACKOFF = 0.5
+AIMD_INCREASE = 1.0
+MIN_CONCURRENCY = 1
+
+THROTTLE_BACKOFF = 0.25      # seconds, doubled per retry
+MAX_THROTTLE_WAIT = 30.0
+
+OK = "ok"
+THROTTLED = "throttled"
+TIMED_OUT = "timed_out"
+FAILED = "failed"
+
+_LOCAL = threading.local()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes one token, sleeping until it is available. Returns the wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now (possibly going negative) so waiters queue up
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class AIMDLimiter:
+    """
+    Concurrency window, additive increase / multiplicative decrease.
+    """
+
+    def __init__(self, initial: float, maximum: float, minimum: float = MIN_CONCURRENCY):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = min(self.maximum, max(minimum, initial))
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> float:
+        """
+        Waits for a free slot. Returns the start time to pass to release().
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started: float, outcome: str) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == OK:
+                self.limit = min(self.maximum, self.limit + AIMD_INCREASE / self.limit)
+            elif outcome in (THROTTLED, TIMED_OUT) and started >= self._last_decrease:
+                # Calls started before the last decrease saw the old window
+                self.limit = max(self.minimum, self.limit * AIMD_BACKOFF)
+                self._last_decrease = time.monotonic()
+            self._cond.notify_all()
+
+
+class ProviderLimiter:
+    def __init__(self, provider: str):
+        self.provider = provider
+        rate = get_provider_rate_limit(provider)
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        self.window = AIMDLimiter(get_provider_concurrency(provider), get_http_pool_maxsize())
+        self.retries = get_rate_limit_retries()
+        self.throttled = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.waited_seconds = 0.0
+        self._paused_until = 0.0
+
+    def _acquire(self) -> float:
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+            self.waited_seconds += pause
+        if self.bucket:
+            self.waited_seconds += self.bucket.acquire()
+        return self.window.acquire()
+
+    def _pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """
+        fn(*args, **kwargs) within the limits, retrying throttled calls.
+        A 429 response is returned as is once the retries are used up.
+        """
+        retries = 0 if getattr(_LOCAL, "no_retry", False) else self.retries
+        attempt = 0
+        while True:
+            started = self._acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                outcome = _classify_error(e)
+                self._count(outcome)
+                self.window.release(started, outcome)
+                if outcome != THROTTLED or attempt >= retries:
+                    raise
+                delay = _retry_after(getattr(e, "headers", None))
+            else:
+                if getattr(result, "status_code", None) != 429:
+                    self.window.release(started, OK)
+                    return result
+                self._count(THROTTLED)
+                self.window.release(started, THROTTLED)
+                if attempt >= retries:
+                    return result
+                delay = _retry_after(result.headers)
+
+            if delay is None:
+                delay = THROTTLE_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            self._pause(min(delay, MAX_THROTTLE_WAIT))
+            self.retried += 1
+            attempt += 1
+
+    def _count(self, outcome: str) -> None:
+        if outcome == THROTTLED:
+            self.throttled += 1
+        elif outcome == TIMED_OUT:
+            self.timeouts += 1
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency_limit": round(self.window.limit, 2),
+            "in_flight": self.window.in_flight,
+            "rate_per_second": self.bucket.rate if self.bucket else None,
+            "throttled": self.throttled,
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+            "waited_seconds": round(self.waited_seconds, 3),
+        }
+
+
+def _is_timeout(error: BaseException) -> bool:
+    if isinstance(error, TimeoutError):
+        return True
+    # requests.Timeout / urllib3 timeouts, without importing either here
+    return any(cls.__name__.endswith("Timeout") or cls.__name__.endswith("TimeoutError") for cls in type(error).__mro__)
+
+
+def _classify_error(error: BaseException) -> str:
+    """
+    THROTTLED for 429s (requests HTTPError or an SDK ApiException with
+    .status), TIMED_OUT for timeouts, FAILED otherwise.
+    """
+    status = getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return THROTTLED
+    if _is_timeout(error):
+        return TIMED_OUT
+    return FAILED
+
+
+def _retry_after(headers) -> Optional[float]:
+    value = (headers or {}).get("Retry-After")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# ============================================================
+# LIMITERS
+# ============================================================
+
+_LIMITERS: Dict[str, ProviderLimiter] = {}
+_LOCK = threading.Lock()
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    limiter = _LIMITERS.get(provider)
+    if limiter is not None:
+        return limiter
+
+    with _LOCK:
+        limiter = _LIMITERS.get(provider)
+        if limiter is None:
+            limiter = _LIMITERS[provider] = ProviderLimiter(provider)
+    return limiter
+
+
+def call(provider: str, fn: Callable, *args, **kwargs):
+    """
+    fn(*args, **kwargs) under provider's limiter, retrying throttled calls.
+    """
+    return get_limiter(provider).run(fn, *args, **kwargs)
+
+
+@contextmanager
+def no_retry():
+    """
+    Throttled calls made in this block (this thread) come back at once,
+    for callers that fail over elsewhere instead (provider_router).
+    """
+    previous = getattr(_LOCAL, "no_retry", False)
+    _LOCAL.no_retry = True
+    try:
+        yield
+    finally:
+        _LOCAL.no_retry = previous
+
+
+def snapshot() -> Dict[str, Dict]:
+    return {provider: limiter.stats() for provider, limiter in sorted(_LIMITERS.items())}
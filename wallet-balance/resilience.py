@@ -0,0 +1,220 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import metrics
+import rate_limit
+from settings import get_breaker_cooldown, get_breaker_failures, get_retry_attempts
+
+# ============================================================
+# RETRIES + CIRCUIT BREAKERS
+# ============================================================
+#
+# Every provider call (HTTP through transport, Moralis SDK calls) goes
+# through call():
+#   - transient errors (connection errors, timeouts, 5xx) are retried
+#     up to RETRY_ATTEMPTS times with full-jitter exponential backoff;
+#     anything else (4xx, reverts, bad params) fails at once
+#   - each endpoint has a circuit breaker: after BREAKER_FAILURES
+#     consecutive transient failures it opens and calls fail fast with
+#     CircuitOpenError for BREAKER_COOLDOWN seconds, then one probe call
+#     is let through to close it again. HTTP endpoints are told apart by
+#     URL (transport, call_endpoint()), SDK calls by (provider, chain).
+#   - inside, the call runs under the provider's rate limiter (429s are
+#     retried there, see rate_limit.py)
+#
+# Call sites that fall back to a slower path (interpolation search,
+# supply reconstruction, ...) record it with record_fallback(), so
+# fallbacks show up in the metrics.
+
+BACKOFF_BASE = 0.2    # seconds, doubled per attempt
+BACKOFF_MAX = 5.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_LOCAL = threading.local()
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling an endpoint whose breaker is open.
+    """
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int, cooldown: float):
+        self.name = name
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.state = CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.max_failures:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_LOCK = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Breaker for an endpoint name: "provider:chain", or transport's
+    per-URL name.
+    """
+    breaker = _BREAKERS.get(name)
+    if breaker is not None:
+        return breaker
+
+    with _LOCK:
+        breaker = _BREAKERS.get(name)
+        if breaker is None:
+            breaker = _BREAKERS[name] = CircuitBreaker(name, get_breaker_failures(), get_breaker_cooldown())
+    return breaker
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Connection errors, timeouts and 5xx (requests or SDK ApiException).
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+
+    status = getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500
+
+    # requests / urllib3 connection errors and timeouts, without importing them here
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {"ConnectionError", "Timeout", "TimeoutError", "ProtocolError", "NewConnectionError"})
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def call(provider: str, chain: str, fn: Callable, *args, **kwargs):
+    """
+    fn(*args, **kwargs) for the (provider, chain) endpoint: behind its
+    breaker, under the provider's rate limiter, retrying transient
+    errors. A 5xx response that is returned rather than raised is
+    retried the same way and returned as is if it persists.
+    """
+    return _call(get_breaker(f"{provider}:{chain}"), provider, chain, fn, *args, **kwargs)
+
+
+def call_endpoint(endpoint: str, provider: str, chain: str, fn: Callable, *args, **kwargs):
+    """
+    call() behind the breaker of one HTTP endpoint (see
+    transport.endpoint_name), so URLs that share a (provider, chain)
+    label don't trip each other's breaker.
+    """
+    return _call(get_breaker(endpoint), provider, chain, fn, *args, **kwargs)
+
+
+def _call(breaker: CircuitBreaker, provider: str, chain: str, fn: Callable, *args, **kwargs):
+    attempts = 1 if getattr(_LOCAL, "no_retry", False) else max(1, get_retry_attempts())
+
+    error: Optional[Exception] = None
+    result = None
+    for attempt in range(attempts):
+        if attempt:
+            metrics.record_retry(provider, chain)
+            time.sleep(_backoff(attempt - 1))
+
+        if not breaker.allow():
+            if attempt:
+                # Opened by our own failures: report what actually went wrong
+                break
+            raise CircuitOpenError(f"Circuit open for {breaker.name}")
+
+        try:
+            result, error = rate_limit.call(provider, fn, *args, **kwargs), None
+        except Exception as e:
+            if not is_transient(e):
+                # The endpoint answered; the call itself was bad
+                breaker.record(ok=True)
+                raise
+            breaker.record(ok=False)
+            error = e
+            continue
+
+        if getattr(result, "status_code", 0) < 500:
+            breaker.record(ok=True)
+            return result
+        breaker.record(ok=False)
+
+    if error is not None:
+        raise error
+    return result
+
+
+def record_fallback(name: str, error: Optional[BaseException] = None) -> None:
+    """
+    Records that name fell back to its slower path, and why.
+    """
+    metrics.record_fallback(name, type(error).__name__ if error is not None else "none")
+
+
+@contextmanager
+def no_retry():
+    """
+    Calls made in this block (this thread) are tried once, 429s included,
+    for callers that fail over elsewhere instead (provider_router).
+    Breakers still apply.
+    """
+    previous = getattr(_LOCAL, "no_retry", False)
+    _LOCAL.no_retry = True
+    try:
+        with rate_limit.no_retry():
+            yield
+    finally:
+        _LOCAL.no_retry = previous
+
+
+def snapshot() -> Dict[str, Dict]:
+    return {name: breaker.stats() for name, breaker in sorted(_BREAKERS.items())}
@@ -0,0 +1,188 @@
+import hashlib
+import json
+from typing import Dict, Optional
+
+import metrics
+from block_index import is_day_closed
+from cache_manager import CACHES
+from settings import CHAIN_CONFIG, PROVIDERS
+from storage import connect
+
+# ============================================================
+# IMMUTABLE RESULT CACHE
+# ============================================================
+#
+# token_balances for a closed day never changes: the block is final and
+# so is every balance at it. Results are stored per (date, config
+# fingerprint), so editing CHAIN_CONFIG/PROVIDERS or the result version
+# naturally misses the old entries. Results that contain errors, or that
+# are for a day still in progress, are never stored.
+#
+# daily_snapshot holds other per-day results by kind under the same
+# rules, a missing (None) value counting as an error: token supplies
+# ("supplies", quicknode_provider3), filled ahead of requests by
+# precompute.py.
+
+RESULT_VERSION = "v1.0"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    date        TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    etag        TEXT NOT NULL,
+    body        TEXT NOT NULL,
+    PRIMARY KEY (date, fingerprint)
+);
+
+CREATE TABLE IF NOT EXISTS daily_snapshot (
+    date        TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    body        TEXT NOT NULL,
+    PRIMARY KEY (date, kind, fingerprint)
+);
+"""
+
+# In-memory front: (date, fingerprint) -> {"etag", "data"}.
+# Bodies can be large and are always in SQLite, so this one is evictable.
+_MEMORY = CACHES.namespace("result_cache.memory", max_entries=256)
+
+
+def _db():
+    return connect("result_cache", SCHEMA)
+
+
+def config_fingerprint() -> str:
+    config = json.dumps(
+        {"version": RESULT_VERSION, "providers": PROVIDERS, "chains": CHAIN_CONFIG},
+        sort_keys=True,
+    )
+    return hashlib.sha256(config.encode()).hexdigest()[:16]
+
+
+def make_etag(data: Dict) -> str:
+    body = json.dumps(data, sort_keys=True)
+    return '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison per RFC 9110: W/ prefixes are ignored.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def strip_weak(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return strip_weak(etag) in {strip_weak(tag) for tag in if_none_match.split(",")}
+
+
+def has_errors(data: Dict) -> bool:
+    """
+    True if any chain (or, for multi-wallet chains, any wallet) has an
+    error entry.
+    """
+    def lists(value):
+        if isinstance(value, list):
+            yield value
+        elif isinstance(value, dict):
+            yield from (v for v in value.values() if isinstance(v, list))
+
+    return any(
+        isinstance(item, dict) and "error" in item
+        for balances in data.values()
+        for items in lists(balances)
+        for item in items
+    )
+
+
+def is_incomplete(data) -> bool:
+    """
+    True if any value in a snapshot is missing (None) or an error entry.
+    """
+    if data is None:
+        return True
+    if isinstance(data, dict):
+        return "error" in data or any(is_incomplete(value) for value in data.values())
+    if isinstance(data, list):
+        return any(is_incomplete(value) for value in data)
+    return False
+
+
+def get_result(date: str) -> Optional[Dict]:
+    """
+    Returns {"etag", "data"} for a stored result, or None.
+    """
+    key = (date, config_fingerprint())
+
+    cached = _MEMORY.get(key)
+    if cached is not None:
+        metrics.cache_hit("result_cache")
+        return cached
+
+    row = _db().execute(
+        "SELECT etag, body FROM result_cache WHERE date = ? AND fingerprint = ?",
+        key,
+    ).fetchone()
+
+    metrics.record_cache("result_cache", row is not None)
+    if row is None:
+        return None
+
+    cached = {"etag": row["etag"], "data": json.loads(row["body"])}
+    _MEMORY.set(key, cached)
+    return cached
+
+
+def put_result(date: str, data: Dict) -> str:
+    """
+    Stores data if it is final and error-free. Returns its ETag either way.
+    """
+    etag = make_etag(data)
+
+    if is_day_closed(date) and not has_errors(data):
+        key = (date, config_fingerprint())
+        conn = _db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache (date, fingerprint, etag, body) "
+                "VALUES (?, ?, ?, ?)",
+                (*key, etag, json.dumps(data)),
+            )
+        _MEMORY.set(key, {"etag": etag, "data": data})
+
+    return etag
+
+
+def get_snapshot(date: str, kind: str) -> Optional[Dict]:
+    """
+    Stored daily snapshot of kind ("supplies") for date, or None.
+    """
+    row = _db().execute(
+        "SELECT body FROM daily_snapshot WHERE date = ? AND kind = ? AND fingerprint = ?",
+        (date, kind, config_fingerprint()),
+    ).fetchone()
+
+    metrics.record_cache(f"result_cache.{kind}", row is not None)
+    return json.loads(row["body"]) if row else None
+
+
+def put_snapshot(date: str, kind: str, data: Dict) -> bool:
+    """
+    Stores a daily snapshot if the day is closed and nothing in it is
+    missing. Returns whether it was stored.
+    """
+    if not is_day_closed(date) or is_incomplete(data):
+        return False
+
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO daily_snapshot (date, kind, fingerprint, body) VALUES (?, ?, ?, ?)",
+            (date, kind, config_fingerprint(), json.dumps(data)),
+        )
+    return True
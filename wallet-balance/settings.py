@@ -6,6 +6,104 @@ def get_moralis_api_key():
 def get_alchemy_eth_url():
     return os.getenv('ALCHEMY_ETH_URL', '')
 
+# Directory for local SQLite stores (block index, caches).
+# Defaults under $HOME, which is the persistent /home share on Azure Functions.
+def get_data_dir() -> str:
+    return os.getenv('WALLET_BALANCE_DATA_DIR', os.path.join(os.path.expanduser('~'), '.wallet-balance'))
+
+# Keep-alive connections kept per provider host (see transport.py)
+def get_http_pool_maxsize() -> int:
+    return int(os.getenv('HTTP_POOL_MAXSIZE', '16'))
+
+# Seconds before an outbound RPC/REST call is abandoned
+def get_http_timeout() -> float:
+    return float(os.getenv('HTTP_TIMEOUT', '30'))
+
+# Parallel eth_getLogs shards per scan (see log_scanner.py)
+def get_log_scan_workers() -> int:
+    return int(os.getenv('LOG_SCAN_WORKERS', '4'))
+
+# Starting size of a provider's rate limiter window (grows up to HTTP_POOL_MAXSIZE), and the
+# worker count of precompute/price_cache Moralis pools, e.g. MAX_CONCURRENCY_MORALIS=8
+def get_provider_concurrency(provider: str) -> int:
+    return int(os.getenv(f'MAX_CONCURRENCY_{provider.upper()}', '4'))
+
+# Calls per second allowed per provider (rate_limit.py), e.g. RATE_LIMIT_QUICKNODE=25; 0 = no cap
+def get_provider_rate_limit(provider: str) -> float:
+    return float(os.getenv(f'RATE_LIMIT_{provider.upper()}', '0'))
+
+# Times a call answered with HTTP 429 is retried after backing off
+def get_rate_limit_retries() -> int:
+    return int(os.getenv('RATE_LIMIT_RETRIES', '3'))
+
+# Tries per provider call on transient errors (connection, timeout, 5xx), see resilience.py
+def get_retry_attempts() -> int:
+    return int(os.getenv('RETRY_ATTEMPTS', '3'))
+
+# Consecutive transient failures that open an endpoint's circuit breaker
+def get_breaker_failures() -> int:
+    return int(os.getenv('BREAKER_FAILURES', '5'))
+
+# Seconds an open circuit breaker fails fast before letting a probe call through
+def get_breaker_cooldown() -> float:
+    return float(os.getenv('BREAKER_COOLDOWN', '30'))
+
+# Longest start/end range accepted by token_balances, in days
+def get_max_range_days() -> int:
+    return int(os.getenv('MAX_RANGE_DAYS', '366'))
+
+# Longest range token_balances builds in memory; longer ones go to token_balances_stream
+def get_max_buffered_range_days() -> int:
+    return int(os.getenv('MAX_BUFFERED_RANGE_DAYS', '31'))
+
+# Days of a start/end range computed concurrently ahead of the one being streamed
+def get_range_window_days() -> int:
+    return int(os.getenv('RANGE_WINDOW_DAYS', '4'))
+
+# Sub-calls per Multicall3 aggregate3 eth_call (keeps each call under node gas/size limits)
+def get_multicall_max_calls() -> int:
+    return int(os.getenv('MULTICALL_MAX_CALLS', '500'))
+
+# Most wallets a single token_balances request may ask for
+def get_max_wallets_per_request() -> int:
+    return int(os.getenv('MAX_WALLETS_PER_REQUEST', '1000'))
+
+# Most wallets token_balances builds in memory; more go to token_balances_stream
+def get_max_buffered_wallets() -> int:
+    return int(os.getenv('MAX_BUFFERED_WALLETS', '100'))
+
+# Routed endpoints of a chain (provider_router.py), e.g.
+# RPC_ENDPOINTS_ETH="alchemy=https://eth-mainnet.g.alchemy.com/v2/KEY,quicknode=https://...,moralis"
+# Moralis takes no URL (SDK). Unset: the chain is not routed.
+def get_rpc_endpoints(chain: str) -> list:
+    endpoints = []
+    for item in os.getenv(f'RPC_ENDPOINTS_{chain.upper()}', '').split(','):
+        provider, _, url = item.strip().partition('=')
+        if provider:
+            endpoints.append((provider.strip().lower(), url.strip() or None))
+    return endpoints
+
+# Latency percentile after which a routed call is hedged to the next endpoint; 0 disables hedging
+def get_hedge_percentile() -> float:
+    return float(os.getenv('HEDGE_PERCENTILE', '95'))
+
+# Byte budget shared by all in-memory caches (cache_manager.py)
+def get_cache_max_bytes() -> int:
+    return int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# statsd agent for metrics.send_statsd(), e.g. "127.0.0.1:8125"; unset disables it
+def get_statsd_address() -> str:
+    return os.getenv('STATSD_ADDRESS', '')
+
+def get_chain_wallets(chain_config: dict) -> list:
+    """
+    Wallets of one CHAIN_CONFIG entry: "wallets" (list) and/or "wallet".
+    """
+    wallets = list(chain_config.get("wallets", []))
+    if chain_config.get("wallet"):
+        wallets.insert(0, chain_config["wallet"])
+    return list(dict.fromkeys(wallets))
+
 # Provider + Wallet Config (unchanged)
 # PROVIDERS = {
 #     "eth": {
@@ -43,6 +141,12 @@ PROVIDERS = {
 #         "tokens": ["0xToken1BSC", "0xToken2BSC"]
 #     }
 # }
+#
+# Several wallets per chain: use "wallets" instead of "wallet"
+#     "bsc": {
+#         "wallets": ["0xTreasuryWallet", "0xCustomerWallet1", ...],
+#         "tokens": [...]
+#     }
 
 CHAIN_CONFIG = {
 
@@ -117,7 +221,6 @@ QUICKNODE_PROVIDER = {
 # QUICKNODE config/settings
 
 
-from typing import Dict
 
 # -------------------------------
 # QuickNode RPC URLs
@@ -130,31 +233,27 @@ QUICKNODE_RPC = {
 # -------------------------------
 # Chain → Tokens
 # -------------------------------
-CHAIN_CONFIG = {
-    "eth": {
-        "tokens": [
-            "0xToken1ETH",
-            "0xToken2ETH",
-        ]
-    },
-    "bsc": {
-        "tokens": [
-            "0xToken1BSC",
-            "0xToken2BSC",
-        ]
-    }
-}
+# The QuickNode modules read the CHAIN_CONFIG above (only "tokens" is
+# used there). Redefining it here used to replace the wallet config for
+# every module.
+# CHAIN_CONFIG = {
+#     "eth": {
+#         "tokens": [
+#             "0xToken1ETH",
+#             "0xToken2ETH",
+#         ]
+#     },
+#     "bsc": {
+#         "tokens": [
+#             "0xToken1BSC",
+#             "0xToken2BSC",
+#         ]
+#     }
+# }
 
 # -------------------------------
 # Known block history
 # -------------------------------
-BLOCK_HISTORY: Dict[str, Dict[str, int]] = {
-    "bsc": {
-        "2026-01-01": 1111111,
-        "2026-01-02": 1111112,
-    },
-    "eth": {
-        "2026-01-01": 546111,
-        "2026-01-02": 547111,
-    }
-}
+# Date → block lookups are persisted in block_index.py (SQLite under
+# get_data_dir()). Seed known days with:
+#   python block_index.py import blocks.json
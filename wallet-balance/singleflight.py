@@ -0,0 +1,146 @@
+import asyncio
+import functools
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import metrics
+
+# ============================================================
+# SINGLE-FLIGHT CALL COALESCING
+# ============================================================
+#
+# When several callers ask for the same thing at the same time (e.g. a
+# burst of requests for one uncached date), only the first one calls the
+# provider; the others wait for it and get the same result, or the same
+# exception. Nothing is kept once the call finishes: caching is the job
+# of block_index / token_registry / cache_manager.
+#
+# Provider work runs in worker threads (asyncio.to_thread), so flights
+# are thread-based; do_async() is the equivalent for coroutines on one
+# event loop.
+#
+#     @coalesce("qp3.get_block_by_date", key=lambda chain, date_str: (chain.lower(), date_str))
+#     def get_block_by_date(chain, date_str): ...
+#
+# Coalesced calls are counted as hits of the "singleflight.<name>" cache
+# in metrics (misses are calls that went out).
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def default_key(*args, **kwargs) -> Hashable:
+    """
+    Hashable key from call arguments (lists and dicts are frozen).
+    """
+    return (_freeze(args), _freeze(kwargs))
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    One group of coalesced calls (one per wrapped function).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._async_flights: Dict[Hashable, "asyncio.Future"] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) unless a call with the same key is already
+        in flight, in which case waits for that call's outcome.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        metrics.record_cache(f"singleflight.{self.name}", not leader)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    async def do_async(self, key: Hashable, fn: Callable[..., Awaitable], *args, **kwargs):
+        """
+        Coroutine version of do(), for callers on the same event loop.
+        """
+        future = self._async_flights.get(key)
+        metrics.record_cache(f"singleflight.{self.name}", future is not None)
+        if future is not None:
+            # shield: a cancelled waiter must not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_flights[key] = future
+        try:
+            result = await fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here so an exception nobody else awaited isn't logged
+            future.exception()
+            raise
+        finally:
+            self._async_flights.pop(key, None)
+
+    def in_flight(self) -> int:
+        return len(self._flights) + len(self._async_flights)
+
+
+def coalesce(name: str, key: Optional[Callable[..., Hashable]] = None):
+    """
+    Decorator: concurrent calls with the same key (default: all
+    arguments) share one execution. Works on plain and async functions.
+    """
+    group = SingleFlight(name)
+    make_key = key or default_key
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                return await group.do_async(make_key(*args, **kwargs), fn, *args, **kwargs)
+            async_wrapper.flight = group
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return group.do(make_key(*args, **kwargs), fn, *args, **kwargs)
+        wrapper.flight = group
+        return wrapper
+
+    return decorator
@@ -0,0 +1,43 @@
+import os
+import sqlite3
+import threading
+
+from settings import get_data_dir
+
+# ============================================================
+# LOCAL SQLITE STORAGE
+# ============================================================
+#
+# Small file-backed stores (block index, caches) live in SQLite files
+# under get_data_dir(). On Azure Functions (Linux) the default under
+# $HOME is the persistent /home share, so data survives cold starts.
+# Connections are per thread; sqlite3 connections must not be shared.
+
+_LOCAL = threading.local()
+
+
+def get_db_path(name: str) -> str:
+    data_dir = get_data_dir()
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, f"{name}.sqlite3")
+
+
+def connect(name: str, schema: str) -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the named store,
+    creating the file and schema on first use.
+    """
+    connections = getattr(_LOCAL, "connections", None)
+    if connections is None:
+        connections = _LOCAL.connections = {}
+
+    conn = connections.get(name)
+    if conn is None:
+        conn = sqlite3.connect(get_db_path(name), timeout=30)
+        conn.row_factory = sqlite3.Row
+        # WAL needs shared memory, which network shares like /home don't offer
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.executescript(schema)
+        connections[name] = conn
+
+    return conn
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from addresses import to_checksum_address
+from log_scanner import TRANSFER_EVENT_SIG, iter_logs
+from storage import connect
+
+# web3 and numpy (transfer_decoder) are only needed once a scan runs
+if TYPE_CHECKING:
+    from web3 import Web3
+
+# ============================================================
+# CHECKPOINTED TOTAL SUPPLY INDEX
+# ============================================================
+#
+# Mint/burn reconstruction of totalSupply, for tokens whose archive
+# totalSupply() call is unavailable. Instead of scanning Transfer logs
+# from block 0 on every call, the running mint and burn totals are stored
+# per token at a checkpoint block. A later query only scans the blocks
+# between the checkpoint and the requested block.
+#
+# Checkpoints only advance to blocks past FINALITY_DEPTH, so a reorg can
+# never leave a wrong total in the index.
+
+ZERO_TOPIC = "0x" + "00" * 32
+
+FINALITY_DEPTH: Dict[str, int] = {
+    "eth": 64,
+    "bsc": 15,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS supply_checkpoint (
+    chain  TEXT    NOT NULL,
+    token  TEXT    NOT NULL,
+    block  INTEGER NOT NULL,
+    minted TEXT    NOT NULL,
+    burned TEXT    NOT NULL,
+    PRIMARY KEY (chain, token)
+);
+"""
+
+
+def _db():
+    return connect("supply_index", SCHEMA)
+
+
+def get_checkpoint(chain: str, token: str) -> Optional[Dict]:
+    """
+    Returns {"block", "minted", "burned"} or None.
+    Totals are uint256, stored as decimal text.
+    """
+    row = _db().execute(
+        "SELECT block, minted, burned FROM supply_checkpoint WHERE chain = ? AND token = ?",
+        (chain.lower(), token.lower()),
+    ).fetchone()
+
+    if row is None:
+        return None
+
+    return {
+        "block": row["block"],
+        "minted": int(row["minted"]),
+        "burned": int(row["burned"]),
+    }
+
+
+def save_checkpoint(chain: str, token: str, block: int, minted: int, burned: int) -> None:
+    conn = _db()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO supply_checkpoint (chain, token, block, minted, burned) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (chain.lower(), token.lower(), block, str(minted), str(burned)),
+        )
+
+
+# ============================================================
+# LOG SCANNING
+# ============================================================
+
+def scan_mints_and_burns(
+    w3: Web3,
+    chain: str,
+    token: str,
+    from_block: int,
+    to_block: int
+) -> Tuple[int, int]:
+    """
+    Sums minted and burned amounts in [from_block, to_block].
+
+    Filters on the indexed from/to topics so only mints (from = 0x0)
+    and burns (to = 0x0) are fetched, not every transfer. Logs are
+    streamed through the sharded scanner and summed per decoded batch.
+    """
+    if from_block > to_block:
+        return 0, 0
+
+    from transfer_decoder import iter_transfer_batches, mint_burn_totals
+
+    def batches(topics):
+        logs = iter_logs(w3, {"address": token, "topics": topics}, from_block, to_block, chain=chain)
+        return iter_transfer_batches(logs)
+
+    # A 0x0 -> 0x0 transfer matches both filters; mint_burn_totals counts
+    # it as a mint only, so each scan keeps just its own side.
+    minted = sum(mint_burn_totals(batch)[0] for batch in batches([TRANSFER_EVENT_SIG, ZERO_TOPIC]))
+    burned = sum(mint_burn_totals(batch)[1] for batch in batches([TRANSFER_EVENT_SIG, None, ZERO_TOPIC]))
+
+    return minted, burned
+
+
+# ============================================================
+# RECONSTRUCTION
+# ============================================================
+
+def reconstruct_total_supply(w3: Web3, chain: str, token: str, to_block: int) -> int:
+    """
+    totalSupply at to_block from minted - burned.
+
+    1. Advance the token's checkpoint to min(to_block, finalized block),
+       scanning only the blocks after the previous checkpoint.
+    2. Adjust from the checkpoint to to_block (forward or backward).
+    """
+    chain = chain.lower()
+    token = to_checksum_address(token)
+
+    checkpoint = get_checkpoint(chain, token) or {"block": -1, "minted": 0, "burned": 0}
+
+    safe_block = min(to_block, w3.eth.block_number - FINALITY_DEPTH.get(chain, 64))
+
+    if safe_block > checkpoint["block"]:
+        minted, burned = scan_mints_and_burns(w3, chain, token, checkpoint["block"] + 1, safe_block)
+        checkpoint = {
+            "block": safe_block,
+            "minted": checkpoint["minted"] + minted,
+            "burned": checkpoint["burned"] + burned,
+        }
+        save_checkpoint(chain, token, **checkpoint)
+
+    if to_block == checkpoint["block"]:
+        return checkpoint["minted"] - checkpoint["burned"]
+
+    if to_block > checkpoint["block"]:
+        minted, burned = scan_mints_and_burns(w3, chain, token, checkpoint["block"] + 1, to_block)
+        return (checkpoint["minted"] + minted) - (checkpoint["burned"] + burned)
+
+    # Older than the checkpoint: walk back, unless scanning from genesis is shorter
+    if to_block < checkpoint["block"] - to_block:
+        minted, burned = scan_mints_and_burns(w3, chain, token, 0, to_block)
+        return minted - burned
+
+    minted, burned = scan_mints_and_burns(w3, chain, token, to_block + 1, checkpoint["block"])
+    return (checkpoint["minted"] - minted) - (checkpoint["burned"] - burned)
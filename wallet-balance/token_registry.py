@@ -0,0 +1,213 @@
+import json
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from cache_manager import CACHES
+from storage import connect
+
+# ============================================================
+# PERSISTENT TOKEN METADATA REGISTRY
+# ============================================================
+#
+# decimals / symbol / name never change for a deployed ERC-20, so they
+# are stored once per (chain, token) and shared by every module and
+# every cold start. The whole table is read into memory on first use
+# (it is small: one row per token) and written through on every new
+# token.
+#
+# name is NULL when the writer did not read name() (e.g. multicall
+# balance reads); "" means name() was read and the token has none.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_metadata (
+    chain    TEXT    NOT NULL,
+    token    TEXT    NOT NULL,
+    decimals INTEGER NOT NULL,
+    symbol   TEXT,
+    name     TEXT,
+    source   TEXT,
+    PRIMARY KEY (chain, token)
+);
+"""
+
+# In-memory copy of the table: (chain, token_lower) -> {"decimals", "symbol", "name"}.
+# Pinned: the table is the source of truth and small.
+_MEMORY = CACHES.namespace("token_registry", pin=True)
+_LOADED = False
+_LOCK = threading.Lock()
+
+NAME_SELECTOR = "0x06fdde03"
+
+
+def _db():
+    return connect("token_registry", SCHEMA)
+
+
+def _key(chain: str, token: str) -> tuple:
+    return (chain.lower(), token.lower())
+
+
+def load() -> int:
+    """
+    Reads the whole registry into memory. Runs once per worker; later
+    calls are no-ops. Returns the number of tokens in memory.
+    """
+    global _LOADED
+    if _LOADED:
+        return len(_MEMORY)
+
+    with _LOCK:
+        if not _LOADED:
+            for row in _db().execute("SELECT chain, token, decimals, symbol, name FROM token_metadata"):
+                _MEMORY.set((row["chain"], row["token"]), {
+                    "decimals": row["decimals"],
+                    "symbol": row["symbol"],
+                    "name": row["name"],
+                })
+            _LOADED = True
+
+    return len(_MEMORY)
+
+
+def get_metadata(chain: str, token: str) -> Optional[Dict]:
+    """
+    Returns {"decimals", "symbol", "name"} or None.
+    """
+    load()
+    return _MEMORY.get(_key(chain, token))
+
+
+def put_many(records: Iterable[Dict], source: Optional[str] = None) -> int:
+    """
+    Stores {"chain", "token", "decimals", "symbol", "name"} records.
+    Records without decimals are skipped; a known name is never replaced
+    by NULL.
+    """
+    load()
+
+    rows = []
+    for record in records:
+        if record.get("decimals") is None:
+            continue
+        key = _key(record["chain"], record["token"])
+        name = record.get("name")
+        if name is None:
+            name = (_MEMORY.peek(key) or {}).get("name")
+        rows.append((*key, int(record["decimals"]), record.get("symbol"), name, record.get("source", source)))
+
+    if not rows:
+        return 0
+
+    conn = _db()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO token_metadata (chain, token, decimals, symbol, name, source) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    for chain, token, decimals, symbol, name, _ in rows:
+        _MEMORY.set((chain, token), {"decimals": decimals, "symbol": symbol, "name": name})
+
+    return len(rows)
+
+
+def put_metadata(
+    chain: str,
+    token: str,
+    decimals: Optional[int],
+    symbol: Optional[str],
+    name: Optional[str] = None,
+    source: Optional[str] = None
+) -> None:
+    put_many([{"chain": chain, "token": token, "decimals": decimals, "symbol": symbol, "name": name}], source)
+
+
+def export_metadata(chain: Optional[str] = None) -> List[Dict]:
+    query = "SELECT chain, token, decimals, symbol, name, source FROM token_metadata"
+    params: tuple = ()
+    if chain:
+        query += " WHERE chain = ?"
+        params = (chain.lower(),)
+    query += " ORDER BY chain, token"
+
+    return [dict(row) for row in _db().execute(query, params)]
+
+
+# ============================================================
+# BULK PRELOAD
+# ============================================================
+
+def preload(chain: str, rpc_url: str, tokens: List[str]) -> int:
+    """
+    Reads decimals/symbol/name for every token not yet registered (or
+    registered without a name) in JSON-RPC batches, and stores them.
+    Returns the number of tokens written.
+    """
+    from provider_examples import (
+        DECIMALS_SELECTOR,
+        SYMBOL_SELECTOR,
+        decode_eth_call_uint,
+        decode_symbol_return,
+        execute_eth_call_batch,
+    )
+
+    load()
+    missing = [
+        token for token in dict.fromkeys(tokens)
+        if (_MEMORY.peek(_key(chain, token)) or {}).get("name") is None
+    ]
+    if not missing:
+        return 0
+
+    calls = []
+    for token in missing:
+        calls.append({"to": token, "data": DECIMALS_SELECTOR})
+        calls.append({"to": token, "data": SYMBOL_SELECTOR})
+        calls.append({"to": token, "data": NAME_SELECTOR})
+
+    responses = execute_eth_call_batch(rpc_url=rpc_url, calls=calls, block="latest")
+
+    records = []
+    for n, token in enumerate(missing):
+        decimals = decode_eth_call_uint(responses[3 * n])
+        if decimals is None:
+            print(f"Skipping {chain}:{token}: decimals() failed", file=sys.stderr)
+            continue
+        records.append({
+            "chain": chain,
+            "token": token,
+            "decimals": decimals,
+            "symbol": decode_symbol_return(responses[3 * n + 1]["result"]),
+            "name": decode_symbol_return(responses[3 * n + 2]["result"]) or "",
+        })
+
+    return put_many(records, source="preload")
+
+
+# python token_registry.py preload <chain> <rpc_url> [tokens.json | token ...]
+# python token_registry.py export [chain] > tokens.json
+# python token_registry.py import tokens.json
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == "preload" and len(sys.argv) >= 4:
+        chain, rpc_url, args = sys.argv[2], sys.argv[3], sys.argv[4:]
+        if len(args) == 1 and args[0].endswith(".json"):
+            with open(args[0]) as f:
+                tokens = json.load(f)
+        elif args:
+            tokens = args
+        else:
+            from settings import CHAIN_CONFIG
+            tokens = CHAIN_CONFIG.get(chain, {}).get("tokens", [])
+        print(f"Preloaded {preload(chain, rpc_url, tokens)} of {len(tokens)} tokens")
+    elif command == "export":
+        json.dump(export_metadata(sys.argv[2] if len(sys.argv) > 2 else None), sys.stdout, indent=2)
+    elif command == "import" and len(sys.argv) == 3:
+        with open(sys.argv[2]) as f:
+            print(f"Imported {put_many(json.load(f), source='import')} tokens")
+    else:
+        print("usage: token_registry.py preload <chain> <rpc_url> [tokens.json | token ...] | export [chain] | import <file.json>")
+        sys.exit(2)
@@ -0,0 +1,343 @@
+"""
+Local stand-in for the providers the app talks to, for benchmarks.
+
+One ThreadingHTTPServer serves:
+  POST /rpc/<chain>             JSON-RPC (single or batch): eth_call (ERC-20 +
+                                Multicall3 aggregate3), eth_blockNumber,
+                                eth_getBlockByNumber, eth_getLogs,
+                                eth_getStorageAt, qn_getBlockByTimestamp,
+                                alchemy_getBlockByTimestamp, ...
+  GET  /moralis/api/v2.2/...    Moralis REST: dateToBlock, {address}/erc20,
+                                erc20/{address}/price
+  GET  /__stats                 counters since the last reset
+  POST /__stats/reset
+
+Chains are synthetic and deterministic: block b has timestamp
+GENESIS_TS + b * BLOCK_TIME, and balances/supplies are derived from
+addresses, so every run sees the same data.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from eth_abi import decode, encode
+
+CHAINS = {
+    "eth": {"chain_id": 1, "genesis_ts": 1438269973, "block_time": 12},
+    "bsc": {"chain_id": 56, "genesis_ts": 1598671449, "block_time": 3},
+}
+
+MORALIS_PREFIX = "/moralis/api/v2.2"
+
+# Non-archive nodes only keep recent state
+ARCHIVE_DEPTH = 128
+
+SELECTORS = {
+    "70a08231": "balanceOf",
+    "313ce567": "decimals",
+    "95d89b41": "symbol",
+    "06fdde03": "name",
+    "18160ddd": "totalSupply",
+    "82ad56cb": "aggregate3",
+}
+
+
+class RpcError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _digest(*parts: str) -> int:
+    return int.from_bytes(hashlib.sha256("|".join(parts).lower().encode()).digest()[:8], "big")
+
+
+class MockChainState:
+    """
+    Deterministic chain data plus request counters.
+    """
+
+    def __init__(self, latency_ms: float = 0, rate_limit: float = 0, archive: bool = True,
+                 qn_timestamp_api: bool = True):
+        self.latency_ms = latency_ms
+        self.rate_limit = rate_limit
+        self.archive = archive
+        self.qn_timestamp_api = qn_timestamp_api
+
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.round_trips = 0
+            self.throttled = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.calls: Counter = Counter()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "round_trips": self.round_trips,
+                "rpc_calls": sum(self.calls.values()),
+                "throttled": self.throttled,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "calls": dict(self.calls),
+            }
+
+    def admit(self, bytes_in: int) -> bool:
+        """
+        Counts an HTTP round trip; False when it is over the rate limit.
+        """
+        with self._lock:
+            self.round_trips += 1
+            self.bytes_in += bytes_in
+
+            if self.rate_limit:
+                now = time.monotonic()
+                if now - self._window_start >= 1:
+                    self._window_start, self._window_count = now, 0
+                self._window_count += 1
+                if self._window_count > self.rate_limit:
+                    self.throttled += 1
+                    return False
+        return True
+
+    def count(self, method: str) -> None:
+        with self._lock:
+            self.calls[method] += 1
+
+    def add_bytes_out(self, sent: int) -> None:
+        with self._lock:
+            self.bytes_out += sent
+
+    # --------------------------------------------------------
+    # Chain model
+    # --------------------------------------------------------
+
+    def latest(self, chain: str) -> int:
+        cfg = CHAINS[chain]
+        return int((time.time() - cfg["genesis_ts"]) // cfg["block_time"])
+
+    def timestamp(self, chain: str, block: int) -> int:
+        cfg = CHAINS[chain]
+        return cfg["genesis_ts"] + block * cfg["block_time"]
+
+    def block_at(self, chain: str, ts: int, after: bool) -> int:
+        cfg = CHAINS[chain]
+        offset = ts - cfg["genesis_ts"]
+        block = -(-offset // cfg["block_time"]) if after else offset // cfg["block_time"]
+        return max(0, min(block, self.latest(chain)))
+
+    def parse_block(self, chain: str, tag) -> int:
+        if tag in (None, "latest", "pending", "safe", "finalized"):
+            return self.latest(chain)
+        if tag == "earliest":
+            return 0
+        return int(tag, 16)
+
+    def erc20_call(self, chain: str, to: str, data: bytes, block: int) -> bytes:
+        if not self.archive and block < self.latest(chain) - ARCHIVE_DEPTH:
+            raise RpcError(-32000, "missing trie node (not an archive node)")
+
+        name = SELECTORS.get(data[:4].hex())
+        if name == "balanceOf":
+            wallet = "0x" + data[16:36].hex()
+            return encode(["uint256"], [(_digest(chain, to, wallet) % 10**6) * 10**18])
+        if name == "decimals":
+            return encode(["uint8"], [18])
+        if name == "symbol":
+            return encode(["string"], ["TK" + to[-4:].upper()])
+        if name == "name":
+            return encode(["string"], ["Token " + to[-4:].upper()])
+        if name == "totalSupply":
+            return encode(["uint256"], [(_digest(chain, to) % 10**9) * 10**18 + block])
+        if name == "aggregate3":
+            (calls,) = decode(["(address,bool,bytes)[]"], data[4:])
+            results = []
+            for target, allow_failure, call_data in calls:
+                try:
+                    results.append((True, self.erc20_call(chain, target.lower(), call_data, block)))
+                except RpcError:
+                    if not allow_failure:
+                        raise
+                    results.append((False, b""))
+            return encode(["(bool,bytes)[]"], [results])
+
+        raise RpcError(3, "execution reverted")
+
+    def rpc(self, chain: str, method: str, params: list):
+        if method == "eth_chainId":
+            return hex(CHAINS[chain]["chain_id"])
+        if method == "web3_clientVersion":
+            return "mock-node/1.0"
+        if method == "eth_blockNumber":
+            return hex(self.latest(chain))
+        if method == "eth_getBlockByNumber":
+            block = self.parse_block(chain, params[0])
+            return {
+                "number": hex(block),
+                "timestamp": hex(self.timestamp(chain, block)),
+                "hash": "0x" + hashlib.sha256(f"{chain}{block}".encode()).hexdigest(),
+                "parentHash": "0x" + hashlib.sha256(f"{chain}{block - 1}".encode()).hexdigest(),
+                "transactions": [],
+            }
+        if method == "eth_call":
+            call, tag = params[0], params[1] if len(params) > 1 else "latest"
+            data = bytes.fromhex(call["data"][2:])
+            return "0x" + self.erc20_call(chain, call["to"].lower(), data, self.parse_block(chain, tag)).hex()
+        if method == "eth_getLogs":
+            return []
+        if method == "eth_getStorageAt":
+            return "0x" + "00" * 32
+        if method == "qn_getBlockByTimestamp":
+            if not self.qn_timestamp_api:
+                raise RpcError(-32601, "Method not found")
+            block = self.block_at(chain, int(params[0]), after=params[1] == "after")
+            return {"blockNumber": hex(block), "timestamp": hex(self.timestamp(chain, block))}
+        if method == "alchemy_getBlockByTimestamp":
+            block = self.block_at(chain, int(params[0], 16), after=False)
+            return {"number": hex(block), "timestamp": hex(self.timestamp(chain, block))}
+
+        raise RpcError(-32601, f"Method not found: {method}")
+
+    # --------------------------------------------------------
+    # Moralis REST model
+    # --------------------------------------------------------
+
+    def moralis(self, path: str, query: Dict[str, list]):
+        chain = query.get("chain", ["eth"])[0]
+        if chain not in CHAINS:
+            chain = {"0x1": "eth", "0x38": "bsc"}.get(chain, "eth")
+
+        if path == "/dateToBlock":
+            ts = int(datetime.fromisoformat(query["date"][0].replace("Z", "+00:00")).timestamp())
+            block = self.block_at(chain, ts, after=True)
+            return "dateToBlock", {"block": block, "date": query["date"][0], "timestamp": self.timestamp(chain, block)}
+
+        parts = path.strip("/").split("/")
+        if len(parts) == 2 and parts[1] == "erc20":
+            wallet = parts[0].lower()
+            tokens = query.get("token_addresses", []) + query.get("token_addresses[]", [])
+            block = int(query.get("to_block", [str(self.latest(chain))])[0])
+            balances = []
+            for token in tokens:
+                token = token.lower()
+                raw = int.from_bytes(self.erc20_call(chain, token, bytes.fromhex("70a08231") + bytes(12) + bytes.fromhex(wallet[2:]), block), "big")
+                balances.append({
+                    "token_address": token,
+                    "symbol": "TK" + token[-4:].upper(),
+                    "name": "Token " + token[-4:].upper(),
+                    "decimals": 18,
+                    "balance": str(raw),
+                })
+            return "getWalletTokenBalances", balances
+
+        if len(parts) == 3 and parts[0] == "erc20" and parts[2] == "price":
+            token = parts[1].lower()
+            return "getTokenPrice", {"tokenAddress": token, "usdPrice": (_digest(chain, token) % 10000) / 100}
+
+        raise RpcError(404, f"Unknown Moralis path {path}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state: MockChainState = None  # set by start_mock_node
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body, extra_headers: Optional[Dict] = None) -> int:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        return len(payload)
+
+    def _rpc_item(self, chain: str, item: Dict) -> Dict:
+        try:
+            result = self.state.rpc(chain, item["method"], item.get("params", []))
+            response = {"jsonrpc": "2.0", "id": item.get("id"), "result": result}
+        except RpcError as e:
+            response = {"jsonrpc": "2.0", "id": item.get("id"), "error": {"code": e.code, "message": e.message}}
+        self.state.count(item["method"])
+        return response
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if path == "/__stats/reset":
+            self.state.reset()
+            self._reply(200, {"ok": True})
+            return
+
+        if not path.startswith("/rpc/"):
+            self._reply(404, {"error": "not found"})
+            return
+
+        if not self.state.admit(len(body)):
+            self._reply(429, {"jsonrpc": "2.0", "id": None, "error": {"code": -32005, "message": "rate limited"}},
+                        {"Retry-After": "1"})
+            return
+
+        time.sleep(self.state.latency_ms / 1000)
+
+        chain = path.split("/")[2]
+        request = json.loads(body)
+        if isinstance(request, list):
+            response = [self._rpc_item(chain, item) for item in request]
+        else:
+            response = self._rpc_item(chain, request)
+
+        self.state.add_bytes_out(self._reply(200, response))
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+
+        if parts.path == "/__stats":
+            self._reply(200, self.state.stats())
+            return
+
+        if not parts.path.startswith(MORALIS_PREFIX):
+            self._reply(404, {"error": "not found"})
+            return
+
+        if not self.state.admit(0):
+            self._reply(429, {"message": "Too many requests"}, {"Retry-After": "1"})
+            return
+
+        time.sleep(self.state.latency_ms / 1000)
+
+        try:
+            method, body = self.state.moralis(parts.path[len(MORALIS_PREFIX):], parse_qs(parts.query))
+        except RpcError as e:
+            self._reply(e.code if e.code >= 400 else 400, {"message": e.message})
+            return
+
+        self.state.count("moralis." + method)
+        self.state.add_bytes_out(self._reply(200, body))
+
+
+def start_mock_node(port: int = 0, **options) -> ThreadingHTTPServer:
+    """
+    Starts the mock on a background thread. server.server_address has the port.
+    """
+    handler = type("MockHandler", (_Handler,), {"state": MockChainState(**options)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,257 @@
+"""
+End-to-end benchmarks against a local mock node (tools/bench/mock_node.py).
+
+Each scenario runs in a fresh interpreter with an empty data directory,
+pointed at the mock through the same module-level config the app reads
+(PROVIDERS, CHAIN_CONFIG, QUICKNODE_*), and is run twice:
+  cold - nothing cached, every lookup goes to the provider
+  warm - same process again, block index / metadata caches populated
+
+For every phase it reports wall time, JSON-RPC calls, HTTP round trips
+and bytes. Call and round-trip counts are deterministic, so they are
+compared against tools/bench/baseline.json and any increase over the
+tolerance fails the run. Wall time is reported only.
+
+    python tools/bench/run_bench.py
+    python tools/bench/run_bench.py --latency-ms 50 --scenario balance_logic
+    python tools/bench/run_bench.py --update-baseline
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# A closed day, so results are final and eligible for every cache
+BENCH_DATE = "2024-06-01"
+
+WALLET = "0x3312cc371Fe0Dd5171878630A1E5cf69778E8fa5"
+
+TOKENS = {
+    "eth": [
+        "0x032dec3372f25c41ea8054b4987a7c4832cdb338",
+        "0xba47214edd2bb43099611b208f75e4b42fdcfedc",
+        "0xf6b1117ec07684d3958cad8beb1b302bfd21103f",
+    ],
+    "bsc": [
+        "0x7048f5227b032326cc8dbc53cf3fddd947a2c757",
+        "0x091fc7778e6932d4009b087b191d1ee3bac5729a",
+        "0x2494b603319d4d9f9715c9f4496d9e0364b59d93",
+    ],
+}
+
+# Counters a regression is judged on
+GATED_METRICS = ("rpc_calls", "round_trips")
+
+
+# ============================================================
+# SCENARIOS (run inside the worker process)
+# ============================================================
+
+def _chain_config():
+    return {chain: {"wallet": WALLET, "tokens": tokens} for chain, tokens in TOKENS.items()}
+
+
+def _point_moralis_at(base_url: str) -> None:
+    """
+    The Moralis SDK builds a fresh Configuration per call with a hardcoded
+    default host; default it to the stub instead.
+    """
+    import openapi_evm_api
+
+    original_init = openapi_evm_api.Configuration.__init__
+
+    def init(self, host=None, *args, **kwargs):
+        original_init(self, host or f"{base_url}/moralis/api/v2.2", *args, **kwargs)
+
+    openapi_evm_api.Configuration.__init__ = init
+
+
+def scenario_balance_logic(base_url: str):
+    import balance_logic
+
+    balance_logic.PROVIDERS = {
+        "eth": {"provider": "alchemy", "alchemy_url": f"{base_url}/rpc/eth"},
+        "bsc": {"provider": "moralis", "moralis_chain": "bsc"},
+    }
+    balance_logic.CHAIN_CONFIG = _chain_config()
+    return lambda: balance_logic.get_all_balances_by_date(BENCH_DATE)
+
+
+def scenario_quicknode_provider(base_url: str):
+    import quicknode_provider
+
+    quicknode_provider.QUICKNODE_PROVIDER = {
+        chain: {"rpc_url": f"{base_url}/rpc/{chain}"} for chain in TOKENS
+    }
+    quicknode_provider.CHAIN_CONFIG = _chain_config()
+    return lambda: quicknode_provider.qn_get_all_balances_by_date(BENCH_DATE)
+
+
+def scenario_quicknode_provider3(base_url: str):
+    import quicknode_provider3
+
+    quicknode_provider3.QUICKNODE_RPC = {chain: f"{base_url}/rpc/{chain}" for chain in TOKENS}
+    quicknode_provider3.CHAIN_CONFIG = _chain_config()
+    return lambda: quicknode_provider3.get_all_token_total_supply_at_date(BENCH_DATE)
+
+
+def scenario_provider_examples(base_url: str):
+    import provider_examples
+
+    rpc_urls = {chain: f"{base_url}/rpc/{chain}" for chain in TOKENS}
+    chain_config = _chain_config()
+    return lambda: provider_examples.get_all_chains_market_caps_at_date(rpc_urls, chain_config, BENCH_DATE)
+
+
+SCENARIOS = {
+    "balance_logic": scenario_balance_logic,
+    "quicknode_provider": scenario_quicknode_provider,
+    "quicknode_provider3": scenario_quicknode_provider3,
+    "provider_examples": scenario_provider_examples,
+}
+
+
+def _stats(base_url: str, reset: bool = False) -> dict:
+    if reset:
+        request = urllib.request.Request(f"{base_url}/__stats/reset", data=b"", method="POST")
+    else:
+        request = urllib.request.Request(f"{base_url}/__stats")
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def run_worker(scenario: str, base_url: str) -> None:
+    """
+    Runs one scenario cold then warm; prints the measurements as JSON.
+    """
+    sys.path.insert(0, APP_DIR)
+    os.environ.setdefault("MORALIS_API_KEY", "bench")
+    _point_moralis_at(base_url)
+
+    run = SCENARIOS[scenario](base_url)
+
+    phases = {}
+    for phase in ("cold", "warm"):
+        _stats(base_url, reset=True)
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        stats = _stats(base_url)
+        stats["wall_ms"] = round(elapsed * 1000, 1)
+        phases[phase] = stats
+
+    print(json.dumps(phases))
+
+
+# ============================================================
+# DRIVER
+# ============================================================
+
+def run_scenario(scenario: str, base_url: str) -> dict:
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, WALLET_BALANCE_DATA_DIR=data_dir)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", scenario, "--url", base_url],
+            cwd=APP_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{scenario} failed:\n{proc.stderr}")
+    # Scenarios print progress; the measurements are the last line
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Yields a message per gated counter that went up by more than
+    max(1, tolerance * baseline).
+    """
+    for scenario, phases in results.items():
+        for phase, stats in phases.items():
+            expected = baseline.get(scenario, {}).get(phase)
+            if not expected:
+                continue
+            for metric in GATED_METRICS:
+                allowed = expected[metric] + max(1, int(expected[metric] * tolerance))
+                if stats[metric] > allowed:
+                    yield f"{scenario}/{phase}: {metric} {stats[metric]} > baseline {expected[metric]}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every mock request")
+    parser.add_argument("--rate-limit", type=float, default=0, help="mock requests/second before 429")
+    parser.add_argument("--no-archive", action="store_true", help="mock rejects state older than 128 blocks")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.url)
+        return 0
+
+    sys.path.insert(0, BENCH_DIR)
+    from mock_node import start_mock_node
+
+    server = start_mock_node(latency_ms=args.latency_ms, rate_limit=args.rate_limit, archive=not args.no_archive)
+    base_url = "http://%s:%d" % server.server_address
+
+    results = {}
+    try:
+        for scenario in args.scenario or sorted(SCENARIOS):
+            results[scenario] = run_scenario(scenario, base_url)
+    finally:
+        server.shutdown()
+
+    print(f"{'scenario':<22}{'phase':<6}{'wall ms':>10}{'rpc calls':>11}{'round trips':>13}{'req bytes':>11}{'resp bytes':>12}")
+    for scenario, phases in results.items():
+        for phase, stats in phases.items():
+            print(
+                f"{scenario:<22}{phase:<6}{stats['wall_ms']:>10.1f}{stats['rpc_calls']:>11}"
+                f"{stats['round_trips']:>13}{stats['bytes_in']:>11}{stats['bytes_out']:>12}"
+            )
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)
+        for scenario, phases in results.items():
+            baseline[scenario] = {
+                phase: {metric: stats[metric] for metric in GATED_METRICS}
+                for phase, stats in phases.items()
+            }
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 0
+
+    if not os.path.exists(BASELINE_PATH):
+        print("No baseline yet; run with --update-baseline")
+        return 0
+
+    with open(BASELINE_PATH) as f:
+        regressions = list(compare(results, json.load(f), args.tolerance))
+
+    for message in regressions:
+        print(f"REGRESSION: {message}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Import-time budget for the Function entry point.
+
+Cold starts on the Consumption plan pay for every module function_app
+imports before the first request runs. This measures that cost in fresh
+interpreters with `python -X importtime` and fails when the median goes
+over budget, or when a heavy SDK is imported eagerly again.
+
+    python tools/check_import_time.py
+    python tools/check_import_time.py --budget-ms 250 --runs 7
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = int(os.getenv("IMPORT_BUDGET_MS", "300"))
+
+# Must only be imported on first use, never by importing the entry point
+HEAVY_MODULES = ("web3", "eth_account", "moralis", "eth_abi", "numpy")
+
+
+def measure(module: str):
+    """
+    Imports module in a fresh interpreter.
+    Returns (total_us, [(self_us, name), ...], [heavy modules loaded]).
+    """
+    probe = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total_us = 0
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        rows.append((int(self_us), name.strip()))
+        if name.strip() == module:
+            total_us = int(cumulative_us)
+
+    heavy = [m for m in proc.stdout.strip().split(",") if m]
+    return total_us, rows, heavy
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="function_app")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        total_us, rows, heavy = measure(args.module)
+        totals.append(total_us)
+
+    median_ms = statistics.median(totals) / 1000
+
+    print(f"{args.module}: median {median_ms:.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    print("Slowest modules (self time, last run):")
+    for self_us, name in sorted(rows, reverse=True)[:10]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: imported eagerly: {', '.join(heavy)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print("FAIL: over import-time budget")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
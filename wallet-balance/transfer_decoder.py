@@ -0,0 +1,115 @@
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from log_scanner import _as_bytes
+
+# ============================================================
+# BULK TRANSFER DECODER
+# ============================================================
+#
+# Decodes batches of raw Transfer logs into columnar numpy arrays instead
+# of building hex strings and Python ints per log:
+#   - from / to: fixed 20-byte values (dtype V20)
+#   - amounts:   uint256 split into 8 big-endian 32-bit limbs, shape (N, 8)
+# Sums run per limb column in uint64 (no overflow below 2**32 rows) and
+# are recombined into a Python int once per batch.
+
+LIMBS = 8
+LIMB_BITS = 32
+
+ADDRESS_DTYPE = np.dtype("V20")
+ZERO_ADDRESS = np.zeros(1, dtype=np.uint8).repeat(20).view(ADDRESS_DTYPE)[0]
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+class TransferBatch(NamedTuple):
+    blocks: np.ndarray     # (N,) int64
+    from_addr: np.ndarray  # (N,) V20
+    to_addr: np.ndarray    # (N,) V20
+    amounts: np.ndarray    # (N, 8) uint32, most significant limb first
+
+
+def decode_transfer_batch(logs: List[Dict]) -> TransferBatch:
+    """
+    Decodes raw Transfer logs (topics[1]=from, topics[2]=to, data=value).
+    """
+    n = len(logs)
+
+    from_topics = b"".join(_as_bytes(log["topics"][1]) for log in logs)
+    to_topics = b"".join(_as_bytes(log["topics"][2]) for log in logs)
+    data = b"".join(_as_bytes(log["data"]).rjust(32, b"\x00")[-32:] for log in logs)
+
+    def addresses(topics: bytes) -> np.ndarray:
+        words = np.frombuffer(topics, dtype=np.uint8).reshape(n, 32)
+        return np.ascontiguousarray(words[:, 12:]).view(ADDRESS_DTYPE).reshape(n)
+
+    return TransferBatch(
+        blocks=np.fromiter((log["blockNumber"] for log in logs), dtype=np.int64, count=n),
+        from_addr=addresses(from_topics),
+        to_addr=addresses(to_topics),
+        amounts=np.frombuffer(data, dtype=">u4").reshape(n, LIMBS).astype(np.uint32),
+    )
+
+
+def iter_transfer_batches(logs: Iterable[Dict], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[TransferBatch]:
+    """
+    Groups a log stream (e.g. log_scanner.iter_logs) into decoded batches.
+    """
+    logs = iter(logs)
+    while True:
+        chunk = list(islice(logs, batch_size))
+        if not chunk:
+            return
+        yield decode_transfer_batch(chunk)
+
+
+# ============================================================
+# AGGREGATES
+# ============================================================
+
+def _limbs_to_int(limb_sums) -> int:
+    total = 0
+    for limb in limb_sums:
+        total = (total << LIMB_BITS) + int(limb)
+    return total
+
+
+def sum_amounts(amounts: np.ndarray, mask: Optional[np.ndarray] = None) -> int:
+    if mask is not None:
+        amounts = amounts[mask]
+    return _limbs_to_int(amounts.sum(axis=0, dtype=np.uint64))
+
+
+def mint_burn_totals(batch: TransferBatch) -> Tuple[int, int]:
+    """
+    (minted, burned) for a batch. A 0x0 -> 0x0 transfer counts as a mint.
+    """
+    is_mint = batch.from_addr == ZERO_ADDRESS
+    is_burn = (batch.to_addr == ZERO_ADDRESS) & ~is_mint
+    return sum_amounts(batch.amounts, is_mint), sum_amounts(batch.amounts, is_burn)
+
+
+def address_deltas(batch: TransferBatch) -> Dict[str, int]:
+    """
+    Net balance change per address in the batch (received - sent).
+    Keys are lowercase 0x-prefixed addresses.
+    """
+    n = len(batch.blocks)
+    unique, inverse = np.unique(
+        np.concatenate([batch.from_addr, batch.to_addr]),
+        return_inverse=True,
+    )
+    inverse = inverse.reshape(-1)
+
+    sent = np.zeros((len(unique), LIMBS), dtype=np.uint64)
+    received = np.zeros((len(unique), LIMBS), dtype=np.uint64)
+    np.add.at(sent, inverse[:n], batch.amounts)
+    np.add.at(received, inverse[n:], batch.amounts)
+
+    return {
+        "0x" + bytes(address).hex(): _limbs_to_int(received[i]) - _limbs_to_int(sent[i])
+        for i, address in enumerate(unique)
+    }
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import resilience
+from settings import get_http_pool_maxsize, get_http_timeout
+
+# ============================================================
+# SHARED HTTP TRANSPORT
+# ============================================================
+#
+# One keep-alive requests.Session per host, created on first use and kept
+# at module level so warm Function invocations reuse open connections
+# instead of paying DNS + TCP + TLS on every call. All RPC and REST calls
+# (raw JSON-RPC, web3 providers, explorer APIs) go through here, so this
+# is also where every outbound call is counted and timed (metrics.py),
+# held to its provider's rate limit (rate_limit.py) and retried /
+# circuit-broken (resilience.py).
+
+if TYPE_CHECKING:
+    from web3 import Web3
+
+_SESSIONS: Dict[str, requests.Session] = {}
+_WEB3: Dict[str, Web3] = {}
+_LOCK = threading.RLock()
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+@lru_cache(maxsize=1024)
+def endpoint_name(url: str, provider: str, chain: str) -> str:
+    """
+    Circuit breaker name of url's endpoint (scheme + host + path), e.g.
+    "quicknode:eth@https://x.quiknode.pro/1a2b3c4d". The path is hashed:
+    RPC URLs often carry the API key there.
+    """
+    parts = urlsplit(url)
+    name = f"{provider}:{chain}@{parts.scheme}://{(parts.hostname or '')}"
+    if parts.port:
+        name += f":{parts.port}"
+    path = parts.path.rstrip("/")
+    if path:
+        name += "/" + hashlib.sha1(path.encode()).hexdigest()[:8]
+    return name.lower()
+
+
+class InstrumentedSession(requests.Session):
+    """
+    Session that records every request in metrics: one round trip per
+    HTTP request, plus one call per JSON-RPC method in the body (the
+    round-trip time is split evenly across a batch). Requests go through
+    resilience.call_endpoint() (the endpoint's breaker, retries, rate
+    limiter).
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        provider, chain = metrics.describe_endpoint(url)
+
+        body = kwargs.get("json")
+        if body is None:
+            body = kwargs.get("data")
+        rpc_methods = metrics.rpc_methods(body) if body is not None else ()
+        if not rpc_methods:
+            params = kwargs.get("params") or {}
+            rpc_methods = [params.get("action") or method.upper()]
+
+        def send() -> requests.Response:
+            start = time.perf_counter()
+            try:
+                response = super(InstrumentedSession, self).request(method, url, *args, **kwargs)
+            except Exception:
+                elapsed = (time.perf_counter() - start) / len(rpc_methods)
+                for rpc_method in rpc_methods:
+                    metrics.record_call(provider, chain, rpc_method, elapsed, error=True)
+                raise
+
+            elapsed = (time.perf_counter() - start) / len(rpc_methods)
+            for rpc_method in rpc_methods:
+                metrics.record_call(provider, chain, rpc_method, elapsed, error=response.status_code >= 400)
+
+            sent = response.request.body
+            metrics.record_round_trip(
+                provider,
+                chain,
+                len(sent) if sent else 0,
+                len(response.content),
+            )
+            return response
+
+        return resilience.call_endpoint(endpoint_name(url, provider, chain), provider, chain, send)
+
+
+def get_session(url: str) -> requests.Session:
+    """
+    Returns the pooled session for url's host.
+    """
+    key = _host_key(url)
+
+    session = _SESSIONS.get(key)
+    if session:
+        return session
+
+    with _LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            pool_size = get_http_pool_maxsize()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=pool_size,
+                pool_block=False,
+            )
+            session = InstrumentedSession()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSIONS[key] = session
+
+    return session
+
+
+def post_json(url: str, payload, timeout: Optional[float] = None) -> requests.Response:
+    """
+    POSTs payload as JSON. route://<chain> URLs go through provider_router.
+    """
+    if url.startswith("route://"):
+        import provider_router
+
+        return provider_router.post_json(url, payload, timeout)
+
+    return get_session(url).post(
+        url,
+        json=payload,
+        timeout=timeout or get_http_timeout(),
+    )
+
+
+def get(url: str, params: Optional[dict] = None, timeout: Optional[float] = None) -> requests.Response:
+    return get_session(url).get(
+        url,
+        params=params,
+        timeout=timeout or get_http_timeout(),
+    )
+
+
+def get_web3(url: str) -> Web3:
+    """
+    Returns a cached Web3 instance for an RPC URL, backed by the pooled
+    session for its host.
+    """
+    w3 = _WEB3.get(url)
+    if w3:
+        return w3
+
+    from web3 import Web3
+
+    with _LOCK:
+        w3 = _WEB3.get(url)
+        if w3 is None:
+            w3 = Web3(Web3.HTTPProvider(
+                url,
+                request_kwargs={"timeout": get_http_timeout()},
+                session=get_session(url),
+            ))
+            _WEB3[url] = w3
+
+    return w3
+
+
+def close_all() -> None:
+    """
+    Closes every pooled session (tests / graceful shutdown).
+    """
+    with _LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
+        _WEB3.clear()